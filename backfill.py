@@ -0,0 +1,128 @@
+import os
+import re
+from datetime import datetime
+
+from db_adapter.logger import logger
+
+from wrf_layouts import get_rain_files
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def scan_dates(wrf_dir, version, gfs_data_hour, wrf_system, path_layout='v4'):
+    """
+    :return: sorted list of the run dates that have an output directory in the wrf tree
+    """
+    if path_layout == 'v4':
+        names = []
+        system_dir = os.path.join(wrf_dir, version, gfs_data_hour, wrf_system)
+        if os.path.isdir(system_dir):
+            names = os.listdir(system_dir)
+    else:
+        # STATIONS_<date> directories, shared by the wrf systems
+        names = [name[len('STATIONS_'):] for name in (os.listdir(wrf_dir) if os.path.isdir(wrf_dir) else [])
+                 if name.startswith('STATIONS_')]
+    return sorted([name for name in names if DATE_PATTERN.match(name)])
+
+
+def scan_wrf_outputs(config_data, start_date=None, end_date=None):
+    """
+    :param config_data: pusher config data (wrf_dir, version, gfs_data_hour, wrf_systems, path_layout, rain_variables)
+    :param start_date: e.g.: 2019-07-01, inclusive
+    :param end_date: e.g.: 2019-07-30, inclusive
+    :return: dict of (wrf system, date) -> RAINNC file path, for the outputs whose files are all present
+    """
+    outputs = {}
+    for wrf_system in config_data['wrf_systems']:
+        for date in scan_dates(config_data['wrf_dir'], config_data['version'], config_data['gfs_data_hour'],
+                               wrf_system, config_data.get('path_layout', 'v4')):
+            if (start_date is not None and date < start_date) or (end_date is not None and date > end_date):
+                continue
+            rain_files = get_rain_files(path_layout=config_data.get('path_layout', 'v4'),
+                                        wrf_dir=config_data['wrf_dir'], version=config_data['version'],
+                                        gfs_data_hour=config_data['gfs_data_hour'], wrf_system=wrf_system, date=date,
+                                        rain_variables=config_data.get('rain_variables', ['RAINNC']),
+                                        domain=config_data.get('domain', 'd03'))
+            if all(os.path.exists(file_path) for file_path in rain_files.values()):
+                outputs[(wrf_system, date)] = rain_files['RAINNC']
+    return outputs
+
+
+def get_source_coverage(pool, source_ids, tms_meta, fgts):
+    """
+    Runs and latest fgt of each source, and the number of its runs (grid cells) written with each of the fgts,
+    in two queries. A grid is written in batches of cells, a push that died partway has fewer runs than cells.
+    :param source_ids: list of source ids
+    :param tms_meta: sim_tag, variable_id and unit_id of the runs
+    :param fgts: the fgt strings to count the runs of, e.g.: those of the outputs in the wrf tree
+    :return: dict of source id -> {'fgts': dict of fgt string -> runs written, 'latest_fgt': fgt string or None,
+        'runs': count}
+    """
+    coverage = {source_id: {'fgts': {}, 'latest_fgt': None, 'runs': 0} for source_id in source_ids}
+    if not source_ids:
+        return coverage
+
+    run_filter = "`run`.`source` IN ({}) AND `run`.`sim_tag`=%s AND `run`.`variable`=%s AND `run`.`unit`=%s".format(
+        ", ".join(["%s"] * len(source_ids)))
+    run_params = list(source_ids) + [tms_meta['sim_tag'], tms_meta['variable_id'], tms_meta['unit_id']]
+
+    connection = pool.connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT `run`.`source`, MAX(`run`.`end_date`), COUNT(*) FROM `run` "
+                           "WHERE {} GROUP BY `run`.`source`;".format(run_filter), run_params)
+            for row in cursor.fetchall():
+                source_id, latest_fgt, runs = row.values() if isinstance(row, dict) else row
+                coverage[source_id]['latest_fgt'] = str(latest_fgt) if latest_fgt is not None else None
+                coverage[source_id]['runs'] = runs
+
+            if fgts:
+                # the fgt index (and the fgt partitions) keep this to the data of the outputs being checked
+                cursor.execute("SELECT `run`.`source`, `data`.`fgt`, COUNT(DISTINCT `data`.`id`) FROM `data` "
+                               "JOIN `run` ON `data`.`id`=`run`.`id` WHERE {} AND `data`.`fgt` IN ({}) "
+                               "GROUP BY `run`.`source`, `data`.`fgt`;".format(run_filter,
+                                                                             ", ".join(["%s"] * len(fgts))),
+                               run_params + sorted(fgts))
+                for row in cursor.fetchall():
+                    source_id, fgt, runs = row.values() if isinstance(row, dict) else row
+                    coverage[source_id]['fgts'][fgt.strftime('%Y-%m-%d %H:%M:%S')
+                                                if isinstance(fgt, datetime) else str(fgt)] = runs
+    finally:
+        connection.close()
+
+    return coverage
+
+
+def plan_backfill(outputs, source_ids, coverage, get_fgt, get_cell_count=None):
+    """
+    :param outputs: as returned by scan_wrf_outputs
+    :param source_ids: dict of wrf system -> source id, None if the source does not exist yet
+    :param coverage: as returned by get_source_coverage
+    :param get_fgt: RAINNC file path -> the fgt the pusher would write it with
+    :param get_cell_count: RAINNC file path -> number of grid cells (runs) a complete push writes, the source's
+        run count if None
+    :return: list of the (wrf system, date) not in the database yet or only partly written, newest date first
+    """
+    units = []
+    for (wrf_system, date), rainnc_net_cdf_file_path in outputs.items():
+        source_coverage = coverage.get(source_ids.get(wrf_system))
+        if source_coverage is not None:
+            runs = source_coverage['fgts'].get(get_fgt(rainnc_net_cdf_file_path), 0)
+            cells = get_cell_count(rainnc_net_cdf_file_path) if get_cell_count is not None \
+                else source_coverage['runs']
+            if runs > 0 and runs >= cells:
+                continue
+            if runs > 0:
+                logger.info("{}_{} only partly pushed, {} of {} cells.".format(wrf_system, date, runs, cells))
+        units.append((wrf_system, date))
+
+    # newest first, then wrf systems in order
+    units.sort(key=lambda unit: unit[0])
+    units.sort(key=lambda unit: unit[1], reverse=True)
+
+    logger.info("Backfill plan: {} of {} outputs missing or partly pushed: {}".format(
+        len(units), len(outputs), ", ".join(["{}_{}".format(wrf_system, date) for wrf_system, date in units])))
+    for source_id, source_coverage in coverage.items():
+        logger.info("Source {}: {} runs, latest fgt {}".format(source_id, source_coverage['runs'],
+                                                               source_coverage['latest_fgt']))
+    return units
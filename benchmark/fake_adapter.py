@@ -0,0 +1,148 @@
+import hashlib
+import json
+import time
+
+
+class FakePool:
+    """
+    In-process stand-in for the curw_fcst database, keeping only what the pusher reads back.
+    Each forked worker gets its own copy.
+    """
+
+    def __init__(self, latency_ms=0.0, keep_rows=False):
+        """
+        :param latency_ms: simulated round-trip time added to every call
+        :param keep_rows: keep the written rows (for checking results), only count them otherwise
+        """
+        self.latency = latency_ms / 1000.0
+        self.keep_rows = keep_rows
+        self.stations = {}
+        self.sources = {}
+        self.runs = {}
+        self.rows = []
+        self.row_count = 0
+        self.next_id = 1
+
+    def round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def destroy(self):
+        pass
+
+
+class FakeTimeseries:
+    """
+    Implements the Timeseries methods used by the pusher on a FakePool
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def generate_timeseries_id(self, meta_data):
+        return hashlib.sha256(json.dumps(meta_data, sort_keys=True).encode()).hexdigest()
+
+    def get_timeseries_id_if_exists(self, meta_data):
+        self.pool.round_trip()
+        tms_id = self.generate_timeseries_id(meta_data)
+        return tms_id if tms_id in self.pool.runs else None
+
+    def insert_run(self, run_meta):
+        self.pool.round_trip()
+        self.pool.runs[run_meta['tms_id']] = dict(run_meta)
+        return run_meta['tms_id']
+
+    def insert_formatted_data(self, timeseries, upsert=False):
+        self.pool.round_trip()
+        self.pool.row_count += len(timeseries)
+        if self.pool.keep_rows:
+            self.pool.rows.extend(timeseries)
+        return len(timeseries)
+
+    def update_latest_fgt(self, id_, fgt):
+        self.pool.round_trip()
+        self.pool.runs[id_]['end_date'] = fgt
+
+
+class NullTimeseries(FakeTimeseries):
+    """
+    Discards everything, leaving only the extraction and payload building cost
+    """
+
+    def get_timeseries_id_if_exists(self, meta_data):
+        return self.generate_timeseries_id(meta_data)
+
+    def insert_run(self, run_meta):
+        return run_meta['tms_id']
+
+    def insert_formatted_data(self, timeseries, upsert=False):
+        return len(timeseries)
+
+    def update_latest_fgt(self, id_, fgt):
+        pass
+
+
+def fake_get_wrf_stations(pool):
+    pool.round_trip()
+    return dict(pool.stations)
+
+
+def fake_add_station(pool, name, latitude, longitude, description, station_type):
+    pool.round_trip()
+    pool.stations[name] = pool.next_id
+    pool.next_id += 1
+
+
+def fake_get_station_id(pool, latitude, longitude, station_type):
+    pool.round_trip()
+    return pool.stations.get('wrf_{}_{}'.format(latitude, longitude))
+
+
+def fake_get_source_id(pool, model, version):
+    pool.round_trip()
+    return pool.sources.get((model, version))
+
+
+def fake_add_source(pool, model, version):
+    pool.round_trip()
+    pool.sources[(model, version)] = pool.next_id
+    pool.next_id += 1
+
+
+def fake_get_existing_run_ids(pool, tms_ids):
+    pool.round_trip()
+    return set([tms_id for tms_id in tms_ids if tms_id in pool.runs])
+
+
+def fake_update_latest_fgts(pool, tms_ids, fgt):
+    pool.round_trip()
+    for tms_id in tms_ids:
+        run = pool.runs[tms_id]
+        run['end_date'] = max(run.get('end_date') or fgt, fgt)
+        run['start_date'] = min(run.get('start_date') or fgt, fgt)
+
+
+def null_get_existing_run_ids(pool, tms_ids):
+    return set(tms_ids)
+
+
+def null_update_latest_fgts(pool, tms_ids, fgt):
+    pass
+
+
+def install_fake_adapter(module, pool, null_sink=False):
+    """
+    Point a module that imported the db_adapter names (e.g.: wrf_data_pusher) at the fake database
+    :param module: module object
+    :param pool: FakePool, also set as the module's pool
+    :param null_sink: discard the timeseries instead of keeping them in the fake database
+    """
+    module.pool = pool
+    module.Timeseries = NullTimeseries if null_sink else FakeTimeseries
+    module.get_wrf_stations = fake_get_wrf_stations
+    module.add_station = fake_add_station
+    module.get_station_id = fake_get_station_id
+    module.get_source_id = fake_get_source_id
+    module.add_source = fake_add_source
+    module.get_existing_run_ids = null_get_existing_run_ids if null_sink else fake_get_existing_run_ids
+    module.update_latest_fgts = null_update_latest_fgts if null_sink else fake_update_latest_fgts
@@ -0,0 +1,135 @@
+"""
+Local stand-in for the rfield hosts: runs the remote commands as local subprocesses, behind the same
+SSHClient / transport / channel calls SSHSessionPool makes.
+
+e.g.: python -m benchmark.fake_ssh --hosts 10.138.0.4,10.138.0.6,10.138.0.7 --slow-host 10.138.0.7
+"""
+import argparse
+import io
+import subprocess
+import sys
+import time
+
+from remote import get_session_pool, close_session_pools
+
+
+class LocalChannel:
+
+    def __init__(self):
+        self.process = None
+
+    def set_combined_stderr(self, combined):
+        pass
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def makefile(self, mode='r'):
+        return io.TextIOWrapper(self.process.stdout)
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+
+class LocalTransport:
+
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def open_session(self):
+        return LocalChannel()
+
+
+class LocalSSHClient:
+    """
+    SSHClient like object, connect sleeps for the host's connect delay (a hung host if it is long)
+    """
+
+    # host -> seconds connect takes
+    connect_delays = {}
+    # number of connects made, to check that the session pool reuses its connections
+    connects = 0
+    # host -> time its last connect finished
+    connected_at = {}
+
+    def __init__(self):
+        self.transport = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, port=22, username=None, key_filename=None):
+        time.sleep(LocalSSHClient.connect_delays.get(hostname, 0))
+        LocalSSHClient.connects += 1
+        LocalSSHClient.connected_at[hostname] = time.time()
+        self.transport = LocalTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.active = False
+
+
+def run_harness(hosts, slow_host=None, slow_secs=3.0):
+    """
+    Run a command twice on every host through the shared session pool
+    :return: list of problems, empty if the pool connects concurrently, reuses its connections and
+        reports the exit statuses
+    """
+    problems = []
+    LocalSSHClient.connect_delays = {slow_host: slow_secs} if slow_host else {}
+    LocalSSHClient.connects = 0
+    LocalSSHClient.connected_at = {}
+    if slow_host:
+        # the slow host goes first, so it would hold up the others if connects were serialized
+        hosts = [slow_host] + [host for host in hosts if host != slow_host]
+
+    session_pool = get_session_pool(user='curw', key='fake_key', client_factory=LocalSSHClient)
+    try:
+        start = time.time()
+        results = session_pool.run_on_hosts(hosts, 'echo rfield')
+        elapsed = time.time() - start
+        if not all(results.values()):
+            problems.append("echo failed on {}".format([host for host, result in results.items() if not result]))
+        if slow_host and elapsed > slow_secs + 1:
+            problems.append("connects are serialized, {:.1f}s for a {:.1f}s slow host".format(elapsed, slow_secs))
+        blocked = [host for host in hosts if host != slow_host and
+                   LocalSSHClient.connected_at.get(host, start + slow_secs) - start > slow_secs / 2.0]
+        if slow_host and blocked:
+            problems.append("{} waited for the slow host {}".format(blocked, slow_host))
+
+        results = session_pool.run_on_hosts(hosts, 'exit 3')
+        if any(results.values()):
+            problems.append("non zero exit status reported as success")
+        if LocalSSHClient.connects != len(hosts):
+            problems.append("{} connects for {} hosts, connections are not reused".format(LocalSSHClient.connects,
+                                                                                          len(hosts)))
+    finally:
+        close_session_pools()
+
+    return problems
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Exercise the ssh session pool against local stand-in hosts.')
+    parser.add_argument('--hosts', default='10.138.0.4,10.138.0.6')
+    parser.add_argument('--slow-host', default=None, help='host whose connect takes --slow-secs')
+    parser.add_argument('--slow-secs', type=float, default=3.0)
+    args = parser.parse_args()
+
+    problems = run_harness(args.hosts.split(','), slow_host=args.slow_host, slow_secs=args.slow_secs)
+    for problem in problems:
+        print("FAIL: {}".format(problem))
+    if problems:
+        sys.exit(1)
+    print("OK")
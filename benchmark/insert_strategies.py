@@ -0,0 +1,316 @@
+"""
+Compares the ways of writing wrf rows, (id, time, fgt, value), into the curw_fcst `data` table.
+
+Each strategy runs from --writers connections at once, each writing its share of the stations, as the pusher's
+worker processes do, so the row lock waits show the contention between them.
+
+Needs a local MySQL/MariaDB (e.g.: docker run -e MYSQL_ROOT_PASSWORD=password -p 3306:3306 mysql:5.7
+--local-infile=1) with an empty database for the benchmark. Run from the repository root, e.g.:
+    python -m benchmark.insert_strategies --password password --db curw_fcst_bench --stations 2000
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pymysql
+
+from db_adapter.logger import logger
+
+from create_schema.partitions import PLAIN_DATA_TABLE_DDL
+from wrf_data_pusher import PUSH_BATCH_CELLS
+
+# the statement of Timeseries.insert_formatted_data with upsert
+INSERT_SQL = "INSERT INTO `data` (`id`, `time`, `fgt`, `value`) VALUES (%s, %s, %s, %s) " \
+             "ON DUPLICATE KEY UPDATE `value`=VALUES(`value`)"
+
+UPSERT_SUFFIX = " ON DUPLICATE KEY UPDATE `value`=VALUES(`value`)"
+
+
+def generate_rows(stations, timesteps, fgt='2019-07-30 23:45:00', start='2019-07-30 05:30:00', seed=0):
+    """
+    :return: list of [id, time, fgt, value] in the pusher's order (all timesteps of a station together)
+    """
+    rand = random.Random(seed)
+    start_time = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+    times = [(start_time + timedelta(minutes=15 * i)).strftime('%Y-%m-%d %H:%M:%S') for i in range(timesteps)]
+
+    rows = []
+    for station in range(stations):
+        tms_id = hashlib.sha256('wrf_station_{}'.format(station).encode()).hexdigest()
+        for t in times:
+            rows.append([tms_id, t, fgt, round(rand.random() * 5, 3)])
+    return rows
+
+
+class CommitTimer:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.seconds = 0.0
+        self.commits = 0
+
+    def commit(self):
+        start = time.perf_counter()
+        self.connection.commit()
+        self.seconds += time.perf_counter() - start
+        self.commits += 1
+
+
+def per_station_insert_formatted_data(connection, rows, batch_size, commit_timer):
+    """
+    The pusher's path before it batched the cells: one executemany and one commit per station
+    """
+    with connection.cursor() as cursor:
+        station_rows = []
+        for row in rows:
+            if station_rows and station_rows[0][0] != row[0]:
+                cursor.executemany(INSERT_SQL, station_rows)
+                commit_timer.commit()
+                station_rows = []
+            station_rows.append(row)
+        if station_rows:
+            cursor.executemany(INSERT_SQL, station_rows)
+            commit_timer.commit()
+
+
+def cell_batches(connection, rows, batch_size, commit_timer):
+    """
+    The pusher's path (push_cells): one executemany and one commit per PUSH_BATCH_CELLS stations
+    """
+    with connection.cursor() as cursor:
+        batch_rows = []
+        stations = 0
+        for row in rows:
+            if not batch_rows or batch_rows[-1][0] != row[0]:
+                if stations == PUSH_BATCH_CELLS:
+                    cursor.executemany(INSERT_SQL, batch_rows)
+                    commit_timer.commit()
+                    batch_rows = []
+                    stations = 0
+                stations += 1
+            batch_rows.append(row)
+        if batch_rows:
+            cursor.executemany(INSERT_SQL, batch_rows)
+            commit_timer.commit()
+
+
+def executemany_single_commit(connection, rows, batch_size, commit_timer):
+    """
+    executemany over batch_size rows (pymysql packs them into multi VALUES statements), one commit at the end
+    """
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            cursor.executemany(INSERT_SQL, rows[i:i + batch_size])
+    commit_timer.commit()
+
+
+def multi_values(connection, rows, batch_size, commit_timer):
+    """
+    Explicit INSERT ... VALUES (...), (...), ... statements of batch_size rows, one commit at the end
+    """
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            sql = "INSERT INTO `data` (`id`, `time`, `fgt`, `value`) VALUES " + \
+                  ", ".join(["(%s, %s, %s, %s)"] * len(batch)) + UPSERT_SUFFIX
+            cursor.execute(sql, [value for row in batch for value in row])
+    commit_timer.commit()
+
+
+def staging_merge(connection, rows, batch_size, commit_timer):
+    """
+    Multi VALUES inserts into a temporary staging table, then one INSERT ... SELECT merge into data
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS `data_staging`;")
+        cursor.execute("CREATE TEMPORARY TABLE `data_staging` LIKE `data`;")
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            sql = "INSERT INTO `data_staging` (`id`, `time`, `fgt`, `value`) VALUES " + \
+                  ", ".join(["(%s, %s, %s, %s)"] * len(batch))
+            cursor.execute(sql, [value for row in batch for value in row])
+        cursor.execute("INSERT INTO `data` (`id`, `time`, `fgt`, `value`) "
+                       "SELECT `id`, `time`, `fgt`, `value` FROM `data_staging`" + UPSERT_SUFFIX)
+        cursor.execute("DROP TEMPORARY TABLE `data_staging`;")
+    commit_timer.commit()
+
+
+def load_data_local_infile(connection, rows, batch_size, commit_timer):
+    """
+    Rows written to a csv file and loaded with LOAD DATA LOCAL INFILE ... REPLACE (needs local_infile enabled)
+    """
+    fd, file_path = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            csv.writer(f, lineterminator='\n').writerows(rows)
+        with connection.cursor() as cursor:
+            cursor.execute("LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE `data` "
+                           "FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' (`id`, `time`, `fgt`, `value`);",
+                           (file_path,))
+        commit_timer.commit()
+    finally:
+        os.remove(file_path)
+
+
+STRATEGIES = {
+    'per_station_insert_formatted_data': per_station_insert_formatted_data,
+    'cell_batches': cell_batches,
+    'executemany': executemany_single_commit,
+    'multi_values': multi_values,
+    'staging_merge': staging_merge,
+    'load_data_local_infile': load_data_local_infile
+}
+
+
+def get_row_lock_status(connection):
+    """
+    :return: dict of Innodb_row_lock_waits / Innodb_row_lock_time (ms)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_%';")
+        return {name: int(value) for name, value in cursor.fetchall() if value.isdigit()}
+
+
+def split_rows(rows, writers):
+    """
+    :return: list of the rows of each writer, the stations dealt out in turn
+    """
+    station_ids = []
+    for row in rows:
+        if not station_ids or station_ids[-1] != row[0]:
+            station_ids.append(row[0])
+    writer_of = {station_id: i % writers for i, station_id in enumerate(station_ids)}
+
+    writer_rows = [[] for _ in range(writers)]
+    for row in rows:
+        writer_rows[writer_of[row[0]]].append(row)
+    return writer_rows
+
+
+def write_concurrently(connect, strategy, writer_rows, batch_size):
+    """
+    Run the strategy from a connection per writer at once
+    :param connect: returns a new connection
+    :return: (seconds, list of the writers' CommitTimers)
+    """
+    connections = [connect() for _ in writer_rows]
+    commit_timers = [CommitTimer(connection) for connection in connections]
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(writer_rows)) as executor:
+            futures = [executor.submit(STRATEGIES[strategy], connection, rows, batch_size, commit_timer)
+                       for connection, rows, commit_timer in zip(connections, writer_rows, commit_timers)]
+            for future in futures:
+                future.result()
+        return time.perf_counter() - start, commit_timers
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def run_strategy(connection, connect, strategy, rows, batch_size, writers=1, upsert_pass=True):
+    """
+    Write the rows into an emptied data table, and again over the existing rows if upsert_pass
+    :param connection: control connection, empties the table and reads the lock status
+    :param connect: returns a new connection, one per writer
+    :return: list of result dicts, one per pass
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("TRUNCATE TABLE `data`;")
+    connection.commit()
+
+    writer_rows = split_rows(rows, writers)
+
+    results = []
+    for pass_name in (['insert', 'upsert'] if upsert_pass else ['insert']):
+        lock_status = get_row_lock_status(connection)
+
+        seconds, commit_timers = write_concurrently(connect, strategy, writer_rows, batch_size)
+
+        lock_status_after = get_row_lock_status(connection)
+
+        results.append({
+            'strategy': strategy,
+            'batch_size': batch_size,
+            'writers': writers,
+            'pass': pass_name,
+            'rows': len(rows),
+            'seconds': seconds,
+            'rows_per_second': len(rows) / seconds if seconds else 0,
+            'commits': sum([commit_timer.commits for commit_timer in commit_timers]),
+            'commit_seconds': sum([commit_timer.seconds for commit_timer in commit_timers]),
+            'row_lock_waits': lock_status_after.get('Innodb_row_lock_waits', 0) -
+                              lock_status.get('Innodb_row_lock_waits', 0),
+            'row_lock_time_ms': lock_status_after.get('Innodb_row_lock_time', 0) -
+                                lock_status.get('Innodb_row_lock_time', 0)
+        })
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compare insert strategies for the curw_fcst data table.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--db', default='curw_fcst_bench', help='database the data table is (re)created in')
+    parser.add_argument('--stations', type=int, default=16038, help='wrf grid points, 16038 for the d03 grid')
+    parser.add_argument('--timesteps', type=int, default=96)
+    parser.add_argument('--strategies', default=','.join(STRATEGIES.keys()))
+    parser.add_argument('--batch-sizes', default='100,1000,5000',
+                        help='batch sizes of executemany, multi_values and staging_merge')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='connections writing at once, e.g.: the pusher processes')
+    parser.add_argument('--no-upsert-pass', action='store_true', help='skip the second pass over existing rows')
+    parser.add_argument('--output', default=None, help='write the results as json to this file')
+    args = parser.parse_args()
+
+    def connect():
+        return pymysql.connect(host=args.host, port=args.port, user=args.user, password=args.password,
+                               db=args.db, local_infile=True, autocommit=False)
+
+    connection = connect()
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(PLAIN_DATA_TABLE_DDL.format(table='data'))
+        connection.commit()
+
+        rows = generate_rows(stations=args.stations, timesteps=args.timesteps)
+        logger.info("Insert strategy benchmark with {} rows".format(len(rows)))
+
+        results = []
+        for strategy in args.strategies.split(','):
+            batch_sizes = [int(batch_size) for batch_size in args.batch_sizes.split(',')]
+            if strategy in ['per_station_insert_formatted_data', 'cell_batches', 'load_data_local_infile']:
+                batch_sizes = [None]
+            for batch_size in batch_sizes:
+                try:
+                    results.extend(run_strategy(connection, connect, strategy, rows, batch_size,
+                                                writers=args.writers, upsert_pass=not args.no_upsert_pass))
+                except Exception as e:
+                    connection.rollback()
+                    logger.error("Strategy {} ({}) failed :: {}".format(strategy, batch_size, e))
+                    print("{} ({}) failed :: {}".format(strategy, batch_size, e))
+
+        print("{:<36} {:>7} {:>7} {:>7} {:>12} {:>9} {:>12} {:>10} {:>12}".format(
+            'strategy', 'batch', 'writers', 'pass', 'rows/sec', 'commits', 'commit sec', 'lock waits', 'lock ms'))
+        for result in results:
+            print("{:<36} {:>7} {:>7} {:>7} {:>12.1f} {:>9} {:>12.3f} {:>10} {:>12}".format(
+                result['strategy'], result['batch_size'] or '-', result['writers'], result['pass'],
+                result['rows_per_second'], result['commits'], result['commit_seconds'], result['row_lock_waits'],
+                result['row_lock_time_ms']))
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        connection.close()
@@ -0,0 +1,169 @@
+"""
+Runs the standard synthetic workload and compares it to a stored baseline.
+
+Run from the repository root:
+    python -m benchmark.regression_gate --update-baseline    # store the current results as the baseline
+    python -m benchmark.regression_gate                      # exit 1 if throughput dropped or memory grew
+
+Baselines are machine specific, create them on the machine the gate runs on.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+BASELINE_FORMAT_VERSION = 1
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# scenario -> wrf_benchmark arguments, on top of the workload arguments
+SCENARIOS = {
+    # read_netcdf_file / extract_wrf_data with every row discarded
+    'extraction': ['--sink', 'null'],
+    # full write path against the in-process database stand-in
+    'write_path': ['--sink', 'fake']
+}
+
+# metric -> True if higher is better
+METRICS = {
+    'cells_per_second': True,
+    'rows_per_second': True,
+    'peak_rss_mb': False
+}
+
+
+def run_scenario(scenario, workload):
+    """
+    Run a scenario in its own process, so its peak RSS is not mixed up with the other scenarios
+    :return: wrf_benchmark result dict
+    """
+    fd, output = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        command = [sys.executable, '-m', 'benchmark.wrf_benchmark',
+                   '--lat-count', str(workload['lat_count']), '--lon-count', str(workload['lon_count']),
+                   '--timesteps', str(workload['timesteps']), '--systems', ','.join(workload['wrf_systems']),
+                   '--output', output] + SCENARIOS[scenario]
+        subprocess.check_call(command, stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL) \
+            .decode().strip()
+    except Exception:
+        return None
+
+
+def run_workload(workload, scenarios):
+    return {
+        'format_version': BASELINE_FORMAT_VERSION,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'git_revision': get_git_revision(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'workload': workload,
+        'results': {scenario: run_scenario(scenario, workload) for scenario in scenarios}
+    }
+
+
+def compare(baseline, current, throughput_tolerance, memory_tolerance):
+    """
+    :param throughput_tolerance: allowed relative drop of the per second metrics, e.g.: 0.1
+    :param memory_tolerance: allowed relative growth of the peak RSS, e.g.: 0.2
+    :return: (list of report lines, list of regressions)
+    """
+    lines = ["{:<12} {:<18} {:>14} {:>14} {:>9}".format('scenario', 'metric', 'baseline', 'current', 'change')]
+    regressions = []
+
+    for scenario, result in sorted(current['results'].items()):
+        baseline_result = baseline['results'].get(scenario)
+        if baseline_result is None:
+            lines.append("{:<12} not in the baseline".format(scenario))
+            continue
+
+        for metric, higher_is_better in sorted(METRICS.items()):
+            old = baseline_result[metric]
+            new = result[metric]
+            change = (new - old) / old if old else 0.0
+
+            if higher_is_better:
+                regressed = change < -throughput_tolerance
+            else:
+                regressed = change > memory_tolerance
+
+            lines.append("{:<12} {:<18} {:>14.1f} {:>14.1f} {:>+8.1f}%{}".format(
+                scenario, metric, old, new, change * 100, '  << REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append("{} {}".format(scenario, metric))
+
+    return lines, regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compare the standard wrf benchmark workload to a baseline.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--lat-count', type=int, default=162)
+    parser.add_argument('--lon-count', type=int, default=99)
+    parser.add_argument('--timesteps', type=int, default=97)
+    parser.add_argument('--systems', default='A,C,E,SE')
+    parser.add_argument('--scenarios', default=','.join(sorted(SCENARIOS.keys())))
+    parser.add_argument('--throughput-tolerance', type=float, default=0.1,
+                        help='allowed relative drop of cells/sec and rows/sec')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help='allowed relative growth of the peak RSS')
+    args = parser.parse_args()
+
+    workload = {
+        'lat_count': args.lat_count,
+        'lon_count': args.lon_count,
+        'timesteps': args.timesteps,
+        'wrf_systems': args.systems.split(',')
+    }
+
+    current = run_workload(workload, args.scenarios.split(','))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print("Baseline written to {}".format(args.baseline))
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, create one with --update-baseline.".format(args.baseline))
+        sys.exit(2)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline.get('format_version') != BASELINE_FORMAT_VERSION:
+        print("Baseline format {} is not supported, recreate it with --update-baseline."
+              .format(baseline.get('format_version')))
+        sys.exit(2)
+
+    if baseline['workload'] != workload:
+        print("Baseline workload {} differs from {}, recreate it with --update-baseline."
+              .format(baseline['workload'], workload))
+        sys.exit(2)
+
+    lines, regressions = compare(baseline, current, args.throughput_tolerance, args.memory_tolerance)
+
+    print("Baseline {} ({}) vs current ({})".format(baseline['created'], baseline['git_revision'],
+                                                   current['git_revision']))
+    print('\n'.join(lines))
+
+    if regressions:
+        print("Performance regression: {}".format(', '.join(regressions)))
+        sys.exit(1)
+
+    print("No performance regression.")
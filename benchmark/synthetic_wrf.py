@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+# d03 grid of wrf_stations.csv
+D03_LAT_MIN = 5.722969
+D03_LON_MIN = 79.521461
+D03_LAT_STEP = 0.027092
+D03_LON_STEP = 0.02723
+D03_LAT_COUNT = 162
+D03_LON_COUNT = 99
+
+
+def write_synthetic_rainnc(file_path, lat_count=D03_LAT_COUNT, lon_count=D03_LON_COUNT, timesteps=97,
+                           interval_minutes=15, start='2019-07-29T18:00:00', seed=0):
+    """
+    Write a d03_RAINNC.nc like file with XLAT, XLONG, XTIME and an accumulating RAINNC
+    :param file_path: e.g.: /tmp/wrf/4.0/18/A/2019-07-30/d03_RAINNC.nc
+    :param lat_count: south_north grid size
+    :param lon_count: west_east grid size
+    :param timesteps: number of XTIME values (one more than the number of time slots)
+    :param interval_minutes: minutes between XTIME values
+    :param start: XTIME origin, e.g.: 2019-07-29T18:00:00
+    :param seed: random seed, the same seed gives the same file
+    :return: file_path
+    """
+    output_dir = os.path.dirname(file_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    random = np.random.RandomState(seed)
+
+    lats = D03_LAT_MIN + D03_LAT_STEP * np.arange(lat_count)
+    lons = D03_LON_MIN + D03_LON_STEP * np.arange(lon_count)
+
+    # mostly dry cells with showers, accumulated over time like RAINNC
+    per_slot = random.gamma(shape=0.3, scale=2.0, size=(timesteps, lat_count, lon_count))
+    per_slot[random.rand(timesteps, lat_count, lon_count) < 0.6] = 0
+    per_slot[0] = 0
+    rainnc = np.cumsum(per_slot, axis=0).astype(np.float32)
+
+    nc_fid = Dataset(file_path, mode='w')
+    try:
+        nc_fid.createDimension('Time', None)
+        nc_fid.createDimension('south_north', lat_count)
+        nc_fid.createDimension('west_east', lon_count)
+
+        xlat = nc_fid.createVariable('XLAT', 'f4', ('Time', 'south_north', 'west_east'))
+        xlat.units = 'degree_north'
+        xlong = nc_fid.createVariable('XLONG', 'f4', ('Time', 'south_north', 'west_east'))
+        xlong.units = 'degree_east'
+        xtime = nc_fid.createVariable('XTIME', 'f4', ('Time',))
+        xtime.units = 'minutes since {}'.format(start)
+        rainnc_var = nc_fid.createVariable('RAINNC', 'f4', ('Time', 'south_north', 'west_east'))
+        rainnc_var.units = 'mm'
+
+        xtime[:] = np.arange(timesteps) * interval_minutes
+        xlat[:] = np.broadcast_to(lats[np.newaxis, :, np.newaxis], (timesteps, lat_count, lon_count))
+        xlong[:] = np.broadcast_to(lons[np.newaxis, np.newaxis, :], (timesteps, lat_count, lon_count))
+        rainnc_var[:] = rainnc
+    finally:
+        nc_fid.close()
+
+    return file_path
+
+
+def write_synthetic_wrf_tree(wrf_dir, version, gfs_data_hour, wrf_systems, dates, **kwargs):
+    """
+    Write synthetic files in the pusher's layout, {wrf_dir}/{version}/{gfs_data_hour}/{system}/{date}/d03_RAINNC.nc
+    :param kwargs: passed on to write_synthetic_rainnc
+    :return: list of file paths
+    """
+    file_paths = []
+    for index, wrf_system in enumerate(wrf_systems):
+        for date in dates:
+            file_path = os.path.join(wrf_dir, version, gfs_data_hour, wrf_system, date, 'd03_RAINNC.nc')
+            file_paths.append(write_synthetic_rainnc(file_path, seed=index, **kwargs))
+    return file_paths
@@ -0,0 +1,210 @@
+"""
+End-to-end throughput benchmark of extract_wrf_data on synthetic d03_RAINNC.nc files.
+
+Run from the repository root, e.g.:
+    python -m benchmark.wrf_benchmark --systems A,C,E,SE --timesteps 97 --output bench_result.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import shutil
+import tempfile
+import time
+
+from db_adapter.logger import logger
+
+import wrf_data_pusher
+from metadata_cache import MetadataCache
+from run_report import RunReportCollector, init_run_report
+from instrumentation import enable_instrumentation, flush_instrumentation
+
+from benchmark.synthetic_wrf import D03_LAT_COUNT, D03_LON_COUNT, write_synthetic_wrf_tree
+from benchmark.fake_adapter import FakePool, install_fake_adapter
+
+VERSION = '4.0'
+GFS_DATA_HOUR = '18'
+
+
+def get_peak_rss_mb():
+    """
+    :return: peak resident set size of this process and of its finished children, in MB
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.0
+
+
+def setup_sink(sink, latency_ms):
+    """
+    :param sink: "null" (rows are built and discarded), "fake" (in-process fake database) or "mysql"
+        (curw_fcst database of db_adapter's constants, e.g.: a local MySQL container)
+    :param latency_ms: simulated round-trip time of the fake database
+    :return: (variable_id, unit_id)
+    """
+    if sink in ['null', 'fake']:
+        install_fake_adapter(wrf_data_pusher, FakePool(latency_ms=latency_ms), null_sink=(sink == 'null'))
+        return 1, 1
+
+    from db_adapter.base import get_Pool
+    from db_adapter.constants import CURW_FCST_HOST, CURW_FCST_PORT, CURW_FCST_USERNAME, CURW_FCST_PASSWORD, \
+        CURW_FCST_DATABASE
+    from db_adapter.curw_fcst.variable import get_variable_id, add_variable
+    from db_adapter.curw_fcst.unit import get_unit_id, add_unit, UnitType
+
+    pool = get_Pool(host=CURW_FCST_HOST, port=CURW_FCST_PORT, user=CURW_FCST_USERNAME,
+                    password=CURW_FCST_PASSWORD, db=CURW_FCST_DATABASE)
+    wrf_data_pusher.pool = pool
+
+    if get_variable_id(pool=pool, variable='Precipitation') is None:
+        add_variable(pool=pool, variable='Precipitation')
+    if get_unit_id(pool=pool, unit='mm', unit_type=UnitType.getType('Accumulative')) is None:
+        add_unit(pool=pool, unit='mm', unit_type=UnitType.getType('Accumulative'))
+
+    return get_variable_id(pool=pool, variable='Precipitation'), \
+        get_unit_id(pool=pool, unit='mm', unit_type=UnitType.getType('Accumulative'))
+
+
+def run_wrf_benchmark(lat_count=D03_LAT_COUNT, lon_count=D03_LON_COUNT, timesteps=97, wrf_systems=('A',),
+                      dates=('2019-07-30',), processes=None, sink='fake', latency_ms=0.0, work_dir=None):
+    """
+    Push synthetic wrf outputs through extract_wrf_data and measure the throughput
+    :param lat_count: grid size
+    :param lon_count: grid size
+    :param timesteps: XTIME values per file
+    :param wrf_systems: e.g.: ['A', 'C', 'E', 'SE']
+    :param dates: e.g.: ['2019-07-30']
+    :param processes: worker processes, one per wrf system if None
+    :param sink: see setup_sink
+    :param latency_ms: see setup_sink
+    :param work_dir: directory for the synthetic files, a temporary one (removed afterwards) if None
+    :return: dict of workload, cells/sec, rows/sec, peak RSS and per stage seconds
+    """
+    remove_work_dir = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='wrf_benchmark_')
+
+    try:
+        write_synthetic_wrf_tree(wrf_dir=work_dir, version=VERSION, gfs_data_hour=GFS_DATA_HOUR,
+                                 wrf_systems=wrf_systems, dates=dates, lat_count=lat_count, lon_count=lon_count,
+                                 timesteps=timesteps)
+
+        report_queue = mp.Queue()
+        init_run_report(report_queue)
+        run_report = RunReportCollector(report_queue)
+        run_report.start()
+
+        enable_instrumentation()
+        wrf_data_pusher.metadata_cache = MetadataCache()
+
+        variable_id, unit_id = setup_sink(sink, latency_ms)
+
+        tms_meta = {
+            'sim_tag': 'evening_18hrs',
+            'version': VERSION,
+            'variable': 'Precipitation',
+            'unit': 'mm',
+            'unit_type': 'Accumulative',
+            'variable_id': variable_id,
+            'unit_id': unit_id
+        }
+
+        config_data = {
+            'model': 'WRF',
+            'version': VERSION,
+            'dates': list(dates),
+            'wrf_dir': work_dir,
+            'gfs_data_hour': GFS_DATA_HOUR,
+            'wrf_systems': list(wrf_systems)
+        }
+
+        start = time.time()
+
+        mp_pool = mp.Pool(processes or len(wrf_systems), initializer=init_run_report, initargs=(report_queue,))
+        try:
+            results = mp_pool.starmap(wrf_data_pusher.extract_wrf_data,
+                                      [(wrf_system, config_data, tms_meta) for wrf_system in wrf_systems])
+        finally:
+            mp_pool.close()
+            mp_pool.join()
+
+        seconds = time.time() - start
+
+        flush_instrumentation()
+        run_report.stop()
+
+        counts = {}
+        for context_counts in run_report.counts.values():
+            for name, value in context_counts.items():
+                counts[name] = counts.get(name, 0) + value
+
+        stages = {}
+        for context_stages in run_report.timings.values():
+            for stage, totals in context_stages.items():
+                stages[stage] = stages.get(stage, 0.0) + totals['seconds']
+
+        return {
+            'workload': {
+                'lat_count': lat_count,
+                'lon_count': lon_count,
+                'timesteps': timesteps,
+                'wrf_systems': list(wrf_systems),
+                'dates': list(dates),
+                'processes': processes or len(wrf_systems),
+                'sink': sink,
+                'latency_ms': latency_ms
+            },
+            'failed_files': sum([1 for grids in results for grid in grids.values() if grid is None]),
+            'errors': len(run_report.errors),
+            'seconds': seconds,
+            'cells': counts.get('cells', 0),
+            'rows_written': counts.get('rows_written', 0),
+            'cells_per_second': counts.get('cells', 0) / seconds if seconds else 0,
+            'rows_per_second': counts.get('rows_written', 0) / seconds if seconds else 0,
+            'peak_rss_mb': get_peak_rss_mb(),
+            'stage_seconds': stages
+        }
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_result(result):
+    print("cells          : {}".format(result['cells']))
+    print("rows written   : {}".format(result['rows_written']))
+    print("seconds        : {:.2f}".format(result['seconds']))
+    print("cells/sec      : {:.1f}".format(result['cells_per_second']))
+    print("rows/sec       : {:.1f}".format(result['rows_per_second']))
+    print("peak RSS (MB)  : {:.1f}".format(result['peak_rss_mb']))
+    print("errors         : {}".format(result['errors']))
+    print("stage breakdown (seconds, summed over workers):")
+    for stage, seconds in sorted(result['stage_seconds'].items(), key=lambda item: -item[1]):
+        print("  {:<20} {:>10.3f}".format(stage, seconds))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the wrf data pusher on synthetic d03_RAINNC.nc files.')
+    parser.add_argument('--lat-count', type=int, default=D03_LAT_COUNT)
+    parser.add_argument('--lon-count', type=int, default=D03_LON_COUNT)
+    parser.add_argument('--timesteps', type=int, default=97)
+    parser.add_argument('--systems', default='A', help='comma separated wrf systems, e.g.: A,C,E,SE')
+    parser.add_argument('--dates', default='2019-07-30', help='comma separated run dates')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--sink', choices=['null', 'fake', 'mysql'], default='fake')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='simulated db round-trip time of the fake sink')
+    parser.add_argument('--work-dir', default=None, help='keep the synthetic files in this directory')
+    parser.add_argument('--output', default=None, help='write the result as json to this file')
+    args = parser.parse_args()
+
+    result = run_wrf_benchmark(lat_count=args.lat_count, lon_count=args.lon_count, timesteps=args.timesteps,
+                               wrf_systems=args.systems.split(','), dates=args.dates.split(','),
+                               processes=args.processes, sink=args.sink, latency_ms=args.latency_ms,
+                               work_dir=args.work_dir)
+
+    print_result(result)
+    logger.info("WRF benchmark result {}".format(json.dumps(result)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
@@ -0,0 +1,267 @@
+"""
+Physical layout of the curw_fcst data table: range partitions on fgt (or time), one per day or month,
+so old forecasts are pruned by dropping partitions instead of DELETEs.
+
+InnoDB does not allow foreign keys on partitioned tables, the data -> run foreign key of db_adapter's schema
+is dropped when an existing table is partitioned.
+
+Run from the repository root, e.g. against a local MySQL (docker run -e MYSQL_ROOT_PASSWORD=password
+-p 3306:3306 mysql:5.7):
+    python -m create_schema.partitions --host 127.0.0.1 --password password --db curw_fcst create --start 2019-07-01
+    python -m create_schema.partitions partition --start 2019-01-01      # existing data table, rebuilds it
+    python -m create_schema.partitions extend --days-ahead 14            # called daily, before the runs
+    python -m create_schema.partitions list
+    python -m create_schema.partitions retention --keep-days 90 --dry-run
+"""
+import argparse
+from datetime import datetime, timedelta
+
+import pymysql
+
+from db_adapter.constants import CURW_FCST_HOST, CURW_FCST_PORT, CURW_FCST_USERNAME, CURW_FCST_PASSWORD, \
+    CURW_FCST_DATABASE
+from db_adapter.logger import logger
+
+DATA_TABLE = 'data'
+
+# catches everything past the last partition, split by extend_partitions
+MAX_PARTITION = 'pmax'
+
+# columns and primary key of the data table of db_adapter's curw_fcst schema, the one definition of them
+DATA_TABLE_COLUMNS = "`id` VARCHAR(64) NOT NULL, " \
+                     "`time` DATETIME NOT NULL, " \
+                     "`fgt` DATETIME NOT NULL, " \
+                     "`value` DECIMAL(8,3) NULL, " \
+                     "PRIMARY KEY (`id`, `time`, `fgt`)"
+
+DATA_TABLE_FGT_INDEXES = "KEY `data_fgt_idx` (`fgt`), " \
+                         "KEY `data_id_fgt_idx` (`id`, `fgt`)"
+
+# the data table as db_adapter creates it, unpartitioned
+PLAIN_DATA_TABLE_DDL = "CREATE TABLE IF NOT EXISTS `{table}` (" + DATA_TABLE_COLUMNS + ") ENGINE=InnoDB;"
+
+DATA_TABLE_DDL = "CREATE TABLE IF NOT EXISTS `{table}` (" + DATA_TABLE_COLUMNS + ", " + DATA_TABLE_FGT_INDEXES + \
+                 ") ENGINE=InnoDB PARTITION BY RANGE COLUMNS(`{column}`) ({partitions});"
+
+PARTITION_COLUMNS = ['fgt', 'time']
+INTERVALS = ['day', 'month']
+
+
+def get_connection(host=CURW_FCST_HOST, port=CURW_FCST_PORT, user=CURW_FCST_USERNAME, password=CURW_FCST_PASSWORD,
+                   db=CURW_FCST_DATABASE):
+    return pymysql.connect(host=host, port=port, user=user, password=password, db=db)
+
+
+def get_period_start(moment, interval):
+    if interval == 'month':
+        return datetime(moment.year, moment.month, 1)
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def get_next_period_start(period_start, interval):
+    if interval == 'month':
+        return datetime(period_start.year + period_start.month // 12, period_start.month % 12 + 1, 1)
+    return period_start + timedelta(days=1)
+
+
+def get_partition_name(period_start, interval):
+    """
+    e.g.: p20190730 (day), p201907 (month)
+    """
+    return period_start.strftime('p%Y%m' if interval == 'month' else 'p%Y%m%d')
+
+
+def get_partition_definitions(start, end, interval):
+    """
+    :param start: first period to create, e.g.: datetime(2019, 7, 1)
+    :param end: last period to create (inclusive)
+    :param interval: "day" or "month"
+    :return: list of "PARTITION p.. VALUES LESS THAN ('..')"
+    """
+    definitions = []
+    period_start = get_period_start(start, interval)
+    while period_start <= end:
+        period_end = get_next_period_start(period_start, interval)
+        definitions.append("PARTITION `{}` VALUES LESS THAN ('{}')".format(
+            get_partition_name(period_start, interval), period_end.strftime('%Y-%m-%d %H:%M:%S')))
+        period_start = period_end
+    return definitions
+
+
+def _get_partition_clause(start, end, interval):
+    return ", ".join(get_partition_definitions(start, end, interval) +
+                     ["PARTITION `{}` VALUES LESS THAN (MAXVALUE)".format(MAX_PARTITION)])
+
+
+def create_data_table(connection, start, end, column='fgt', interval='day', table=DATA_TABLE):
+    """
+    Create the partitioned data table, if it does not exist
+    :param connection: pymysql connection
+    :param start: first partition period, e.g.: datetime(2019, 7, 1)
+    :param end: last partition period, later rows go to pmax until extend_partitions splits it
+    :param column: "fgt" (retention by forecast version) or "time"
+    :param interval: "day" or "month"
+    :param table: table name, e.g.: data
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DATA_TABLE_DDL.format(table=table, column=column,
+                                             partitions=_get_partition_clause(start, end, interval)))
+    connection.commit()
+
+
+def get_foreign_keys(connection, table=DATA_TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT `CONSTRAINT_NAME` FROM `information_schema`.`TABLE_CONSTRAINTS` "
+                       "WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`=%s AND `CONSTRAINT_TYPE`='FOREIGN KEY';",
+                       (table,))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_index_names(connection, table=DATA_TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT `INDEX_NAME` FROM `information_schema`.`STATISTICS` "
+                       "WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`=%s;", (table,))
+        return set([row[0] for row in cursor.fetchall()])
+
+
+def partition_data_table(connection, start, end, column='fgt', interval='day', table=DATA_TABLE):
+    """
+    Partition an existing data table, adding the fgt indexes. Rebuilds (copies) the table once, in a single
+    ALTER TABLE, run it in a quiet window.
+    :param: see create_data_table
+    """
+    with connection.cursor() as cursor:
+        # dropping a foreign key is a metadata change, it does not rebuild the table
+        for foreign_key in get_foreign_keys(connection, table):
+            logger.info("Dropping foreign key {} of {}, not supported on partitioned tables".format(foreign_key, table))
+            cursor.execute("ALTER TABLE `{}` DROP FOREIGN KEY `{}`;".format(table, foreign_key))
+
+        index_names = get_index_names(connection, table)
+        alterations = []
+        if 'data_fgt_idx' not in index_names:
+            alterations.append("ADD KEY `data_fgt_idx` (`fgt`)")
+        if 'data_id_fgt_idx' not in index_names:
+            alterations.append("ADD KEY `data_id_fgt_idx` (`id`, `fgt`)")
+
+        # the partition options follow the other alterations, without a comma
+        cursor.execute("ALTER TABLE `{}` {} PARTITION BY RANGE COLUMNS(`{}`) ({});".format(
+            table, ", ".join(alterations), column, _get_partition_clause(start, end, interval)))
+    connection.commit()
+
+
+def _parse_bound(description):
+    """
+    :param description: PARTITION_DESCRIPTION, e.g.: '2019-07-31 00:00:00' or MAXVALUE
+    :return: datetime, None for MAXVALUE
+    """
+    description = description.strip("'")
+    if description == 'MAXVALUE':
+        return None
+    return datetime.strptime(description[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def get_partitions(connection, table=DATA_TABLE):
+    """
+    :return: list of dicts of name, upper bound (datetime, None for pmax), rows (estimate) and bytes, in order
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT `PARTITION_NAME`, `PARTITION_DESCRIPTION`, `TABLE_ROWS`, "
+                       "`DATA_LENGTH` + `INDEX_LENGTH` FROM `information_schema`.`PARTITIONS` "
+                       "WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`=%s AND `PARTITION_NAME` IS NOT NULL "
+                       "ORDER BY `PARTITION_ORDINAL_POSITION`;", (table,))
+        return [{'name': name, 'upper_bound': _parse_bound(description), 'rows': int(rows or 0),
+                 'bytes': int(size or 0)} for name, description, rows, size in cursor.fetchall()]
+
+
+def extend_partitions(connection, until, interval='day', table=DATA_TABLE):
+    """
+    Split pmax into the partitions up to until, so new fgts never land in pmax
+    :param until: last period to have a partition
+    :return: list of the partitions added
+    """
+    partitions = get_partitions(connection, table)
+    bounded = [partition for partition in partitions if partition['upper_bound'] is not None]
+    if not bounded:
+        raise ValueError("{} is not range partitioned".format(table))
+
+    definitions = get_partition_definitions(bounded[-1]['upper_bound'], until, interval)
+    if not definitions:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE `{}` REORGANIZE PARTITION `{}` INTO ({}, "
+                       "PARTITION `{}` VALUES LESS THAN (MAXVALUE));".format(
+                           table, MAX_PARTITION, ", ".join(definitions), MAX_PARTITION))
+    connection.commit()
+    return [definition.split('`')[1] for definition in definitions]
+
+
+def drop_partitions_before(connection, before, table=DATA_TABLE, dry_run=False):
+    """
+    Drop the partitions holding only rows older than before, instead of a DELETE
+    :param before: datetime, partitions whose upper bound is on or before it are dropped
+    :param dry_run: only return what would be dropped
+    :return: (list of dropped partition names, bytes reclaimed)
+    """
+    expired = [partition for partition in get_partitions(connection, table)
+               if partition['upper_bound'] is not None and partition['upper_bound'] <= before]
+
+    if expired and not dry_run:
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE `{}` DROP PARTITION {};".format(
+                table, ", ".join(["`{}`".format(partition['name']) for partition in expired])))
+        connection.commit()
+
+    return [partition['name'] for partition in expired], sum([partition['bytes'] for partition in expired])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Manage the partitions of the curw_fcst data table.')
+    parser.add_argument('--host', default=CURW_FCST_HOST)
+    parser.add_argument('--port', type=int, default=CURW_FCST_PORT)
+    parser.add_argument('--user', default=CURW_FCST_USERNAME)
+    parser.add_argument('--password', default=CURW_FCST_PASSWORD)
+    parser.add_argument('--db', default=CURW_FCST_DATABASE)
+    parser.add_argument('--table', default=DATA_TABLE)
+    parser.add_argument('--interval', choices=INTERVALS, default='day')
+
+    commands = parser.add_subparsers(dest='command')
+    for command in ['create', 'partition']:
+        command_parser = commands.add_parser(command)
+        command_parser.add_argument('--column', choices=PARTITION_COLUMNS, default='fgt')
+        command_parser.add_argument('--start', required=True, help='first partition, e.g.: 2019-07-01')
+        command_parser.add_argument('--days-ahead', type=int, default=14, help='partitions created past today')
+    commands.add_parser('extend').add_argument('--days-ahead', type=int, default=14)
+    commands.add_parser('list')
+    retention_parser = commands.add_parser('retention')
+    retention_parser.add_argument('--keep-days', type=int, required=True)
+    retention_parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    connection = get_connection(host=args.host, port=args.port, user=args.user, password=args.password, db=args.db)
+
+    try:
+        until = datetime.now() + timedelta(days=getattr(args, 'days_ahead', 0))
+
+        if args.command == 'create':
+            create_data_table(connection, start=datetime.strptime(args.start, '%Y-%m-%d'), end=until,
+                              column=args.column, interval=args.interval, table=args.table)
+        elif args.command == 'partition':
+            partition_data_table(connection, start=datetime.strptime(args.start, '%Y-%m-%d'), end=until,
+                                 column=args.column, interval=args.interval, table=args.table)
+        elif args.command == 'extend':
+            print("Added partitions {}".format(extend_partitions(connection, until, args.interval, args.table)))
+        elif args.command == 'retention':
+            dropped, size = drop_partitions_before(connection, datetime.now() - timedelta(days=args.keep_days),
+                                                   table=args.table, dry_run=args.dry_run)
+            print("{} {} partitions, {:.1f} MB reclaimed: {}".format(
+                "Would drop" if args.dry_run else "Dropped", len(dropped), size / 1024.0 / 1024.0, dropped))
+
+        if args.command in ['create', 'partition', 'extend', 'list']:
+            for partition in get_partitions(connection, args.table):
+                print("{:<12} {:<20} {:>12} rows {:>10.1f} MB".format(
+                    partition['name'], str(partition['upper_bound'] or 'MAXVALUE'), partition['rows'],
+                    partition['bytes'] / 1024.0 / 1024.0))
+    finally:
+        connection.close()
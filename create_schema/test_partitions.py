@@ -0,0 +1,84 @@
+from datetime import datetime
+
+from create_schema.partitions import get_partition_definitions, partition_data_table
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def execute(self, query, args=None):
+        self.connection.statements.append(query)
+        if 'TABLE_CONSTRAINTS' in query:
+            self.rows = [(name,) for name in self.connection.foreign_keys]
+        elif 'STATISTICS' in query:
+            self.rows = [(name,) for name in self.connection.index_names]
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+
+    def __init__(self, foreign_keys=(), index_names=('PRIMARY',)):
+        self.foreign_keys = list(foreign_keys)
+        self.index_names = list(index_names)
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+def get_alters(connection):
+    return [statement for statement in connection.statements if statement.startswith('ALTER TABLE')]
+
+
+def test_day_partitions():
+    assert get_partition_definitions(datetime(2019, 7, 30, 12), datetime(2019, 7, 31), 'day') == [
+        "PARTITION `p20190730` VALUES LESS THAN ('2019-07-31 00:00:00')",
+        "PARTITION `p20190731` VALUES LESS THAN ('2019-08-01 00:00:00')"]
+
+
+def test_month_partitions_roll_over_the_year():
+    assert get_partition_definitions(datetime(2019, 12, 5), datetime(2020, 1, 1), 'month') == [
+        "PARTITION `p201912` VALUES LESS THAN ('2020-01-01 00:00:00')",
+        "PARTITION `p202001` VALUES LESS THAN ('2020-02-01 00:00:00')"]
+
+
+def test_indexes_and_partitions_in_one_alter():
+    connection = FakeConnection(foreign_keys=['data_ibfk_1'])
+
+    partition_data_table(connection, datetime(2019, 7, 30), datetime(2019, 7, 30))
+
+    alters = get_alters(connection)
+    assert alters[0] == "ALTER TABLE `data` DROP FOREIGN KEY `data_ibfk_1`;"
+    assert len(alters) == 2
+    assert alters[1].startswith("ALTER TABLE `data` ADD KEY `data_fgt_idx` (`fgt`), "
+                                "ADD KEY `data_id_fgt_idx` (`id`, `fgt`) PARTITION BY RANGE COLUMNS(`fgt`) (")
+    assert "PARTITION `pmax` VALUES LESS THAN (MAXVALUE)" in alters[1]
+    assert connection.commits == 1
+
+
+def test_existing_indexes_are_not_added_again():
+    connection = FakeConnection(index_names=['PRIMARY', 'data_fgt_idx', 'data_id_fgt_idx'])
+
+    partition_data_table(connection, datetime(2019, 7, 30), datetime(2019, 7, 30), column='time')
+
+    alters = get_alters(connection)
+    assert len(alters) == 1
+    assert 'ADD KEY' not in alters[0]
+    assert 'PARTITION BY RANGE COLUMNS(`time`)' in alters[0]
@@ -0,0 +1,214 @@
+import functools
+import threading
+import time
+
+from pymysql.cursors import Cursor, RE_INSERT_VALUES
+
+from db_adapter.logger import logger
+from db_adapter.curw_fcst.timeseries import Timeseries
+
+from run_report import report_timing, report_count
+
+# Timeseries methods and db_adapter functions the pusher calls, traced when "db_trace" is set in config.json
+TRACED_TIMESERIES_METHODS = ['insert_run', 'insert_formatted_data']
+TRACED_FUNCTIONS = ['add_station', 'get_station_id', 'get_wrf_stations', 'get_source_id', 'add_source',
+                    'get_existing_run_ids', 'update_latest_fgts']
+
+# call type -> {'calls', 'statements', 'rows', 'bytes', 'seconds'} of this process since the last flush
+db_trace = {}
+
+lock = threading.Lock()
+local = threading.local()
+
+
+def _get_stats(call_type):
+    stats = db_trace.get(call_type)
+    if stats is None:
+        stats = db_trace[call_type] = {'calls': 0, 'statements': 0, 'rows': 0, 'bytes': 0, 'seconds': 0.0}
+    return stats
+
+
+def _current_call_type():
+    stack = getattr(local, 'call_types', None)
+    return stack[-1] if stack else 'other'
+
+
+def _traced(call_type, func):
+
+    @functools.wraps(func)
+    def traced_func(*args, **kwargs):
+        stack = getattr(local, 'call_types', None)
+        if stack is None:
+            stack = local.call_types = []
+        stack.append(call_type)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            with lock:
+                stats = _get_stats(call_type)
+                stats['calls'] += 1
+                stats['seconds'] += seconds
+
+    traced_func.db_traced = True
+    return traced_func
+
+
+def _record_statement(statements, rows, size):
+    with lock:
+        stats = _get_stats(_current_call_type())
+        stats['statements'] += statements
+        stats['rows'] += rows
+        stats['bytes'] += size
+
+
+class TracedCursor:
+    """
+    Cursor proxy counting the statements, affected/fetched rows and bytes sent
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __enter__(self):
+        self.cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.cursor.__exit__(exc_type, exc_val, exc_tb)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def _size(self, query, args):
+        try:
+            return len(self.cursor.mogrify(query, args))
+        except Exception:
+            return len(query)
+
+    def execute(self, query, args=None):
+        result = self.cursor.execute(query, args)
+        _record_statement(1, max(self.cursor.rowcount, 0), self._size(query, args))
+        return result
+
+    def executemany(self, query, args):
+        result = self.cursor.executemany(query, args)
+        if not args:
+            return result
+        # sized from the first row, a mogrify per row would inflate the wall time of the traced call
+        match = RE_INSERT_VALUES.match(query)
+        if match:
+            # pymysql packs the rows into multi VALUES statements of up to max_stmt_length bytes
+            row_size = self._size(match.group(2), args[0]) + 1
+            header_size = len(match.group(1)) + len(match.group(3))
+            max_length = getattr(self.cursor, 'max_stmt_length', Cursor.max_stmt_length)
+            statements = max(1, -(-row_size * len(args) // max(max_length - header_size, row_size)))
+            size = header_size * statements + row_size * len(args)
+        else:
+            statements = len(args)
+            size = self._size(query, args[0]) * len(args)
+        _record_statement(statements, max(self.cursor.rowcount, 0), size)
+        return result
+
+
+class TracedConnection:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return TracedCursor(self.connection.cursor(*args, **kwargs))
+
+    def commit(self):
+        start = time.perf_counter()
+        self.connection.commit()
+        with lock:
+            _get_stats('commit')['calls'] += 1
+            _get_stats('commit')['seconds'] += time.perf_counter() - start
+
+
+class TracedPool:
+    """
+    Connection pool proxy handing out TracedConnections
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def get_conn(self, *args, **kwargs):
+        return TracedConnection(self.pool.get_conn(*args, **kwargs))
+
+    def connection(self, *args, **kwargs):
+        return TracedConnection(self.pool.connection(*args, **kwargs))
+
+    def release(self, connection):
+        if isinstance(connection, TracedConnection):
+            connection = connection.connection
+        return self.pool.release(connection)
+
+
+def install_db_tracer(namespace):
+    """
+    Trace the Timeseries methods and the db_adapter functions imported into a module,
+    without changing db_adapter. Call before the pool workers are forked.
+    :param namespace: globals() of the module calling the db_adapter functions
+    """
+    for method in TRACED_TIMESERIES_METHODS:
+        func = getattr(Timeseries, method, None)
+        if func is not None and not getattr(func, 'db_traced', False):
+            setattr(Timeseries, method, _traced(method, func))
+
+    for name in TRACED_FUNCTIONS:
+        func = namespace.get(name)
+        if func is not None and not getattr(func, 'db_traced', False):
+            namespace[name] = _traced(name, func)
+
+
+def flush_db_trace():
+    """
+    Send the db trace of this process to the run report
+    """
+    with lock:
+        trace = dict(db_trace)
+        db_trace.clear()
+
+    for call_type, stats in trace.items():
+        context = {'db_call': call_type}
+        report_timing('db_call', stats['seconds'], count=stats['calls'], context=context)
+        report_count('db_statements', stats['statements'], context=context)
+        report_count('db_rows', stats['rows'], context=context)
+        report_count('db_bytes', stats['bytes'], context=context)
+
+
+def log_db_trace_summary(run_report, top=10):
+    """
+    Log the call types that spent the most time in the database
+    :param run_report: RunReportCollector, after it is stopped
+    :param top: number of call types to log
+    """
+    call_types = []
+    for context_key, stages in run_report.timings.items():
+        context = dict(context_key)
+        if 'db_call' in context and 'db_call' in stages:
+            counts = run_report.counts.get(context_key, {})
+            call_types.append((stages['db_call']['seconds'], context['db_call'], stages['db_call']['count'],
+                               counts.get('db_statements', 0), counts.get('db_rows', 0), counts.get('db_bytes', 0)))
+
+    if not call_types:
+        return
+
+    logger.info("DB trace, top {} call types by wall time:".format(top))
+    for seconds, call_type, calls, statements, rows, size in sorted(call_types, reverse=True)[:top]:
+        logger.info("{:<28} {:>10.2f} s {:>9} calls {:>9} statements {:>10} rows {:>12} bytes".format(
+            call_type, seconds, calls, statements, rows, size))
@@ -0,0 +1,56 @@
+import numpy as np
+
+ENSEMBLE_STATS = ['MEAN', 'MAX', 'MIN', 'SPREAD']
+
+
+def compute_ensemble_stats(diffs):
+    """
+    Compute per cell ensemble statistics over the stacked member diff cubes
+    :param diffs: list of (timestep, lat, lon) arrays, one per WRF system
+    :return: dict of stat name -> (timestep, lat, lon) array
+        SPREAD is the standard deviation across the members
+    """
+    stack = np.stack(diffs, axis=0)
+
+    return {
+        'MEAN': stack.mean(axis=0),
+        'MAX': stack.max(axis=0),
+        'MIN': stack.min(axis=0),
+        'SPREAD': stack.std(axis=0)
+    }
+
+
+def build_ensemble_grids(grids, min_members=2):
+    """
+    Build the derived ensemble grids for one date
+    :param grids: dict of wrf system -> decoded grid (see decode_rainnc_file), None for missing systems
+    :param min_members: e.g.: the number of configured wrf systems, so a partial ensemble is not published
+    :return: dict of stat name -> decoded grid, empty if fewer than min_members (at least two) are available
+    """
+    members = [grids[wrf_system] for wrf_system in sorted(grids.keys()) if grids[wrf_system] is not None]
+
+    if len(members) < max(min_members, 2):
+        return {}
+
+    reference = members[0]
+
+    for member in members[1:]:
+        if member['diff'].shape != reference['diff'].shape or member['timestamps'] != reference['timestamps'] \
+                or not np.allclose(member['lats'], reference['lats']) \
+                or not np.allclose(member['lons'], reference['lons']):
+            raise ValueError("WRF system grids do not match, cannot compute ensemble statistics.")
+
+    # the ensemble is as recent as its latest member
+    fgt = max(member['fgt'] for member in members)
+
+    stats = compute_ensemble_stats([member['diff'] for member in members])
+
+    return {
+        stat: {
+            'fgt': fgt,
+            'lats': reference['lats'],
+            'lons': reference['lons'],
+            'timestamps': reference['timestamps'],
+            'diff': stats[stat]
+        } for stat in ENSEMBLE_STATS
+    }
@@ -6,12 +6,12 @@ from db_adapter.base import get_Pool
 from db_adapter.curw_fcst.source import get_source_id, add_source
 from db_adapter.curw_fcst.variable import get_variable_id, add_variable
 from db_adapter.curw_fcst.unit import get_unit_id, add_unit, UnitType
-from db_adapter.curw_fcst.station import add_wrfv3_stations
 
 from logger import logger
+from station_seeder import seed_wrf_stations
 
 
-def init(pool, model, wrf_model_list, version, variable, unit, unit_type):
+def init(pool, model, wrf_model_list, version, variable, unit, unit_type, wrf_stations_csv='wrf_stations.csv'):
     for _wrf_model in wrf_model_list:
         source_name = "{}_{}".format(model, _wrf_model)
         add_source(pool=pool, model=source_name, version=version)
@@ -20,7 +20,8 @@ def init(pool, model, wrf_model_list, version, variable, unit, unit_type):
 
     add_unit(pool=pool, unit=unit, unit_type=unit_type)
 
-    add_wrfv3_stations(pool)
+    # only the stations missing from the database are inserted, so init can be rerun
+    seed_wrf_stations(pool, wrf_stations_csv)
 
 
 if __name__=="__main__":
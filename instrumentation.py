@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+
+import profiler
+from run_report import report_context, report_timing, report_count
+
+# fine grained stage timers and counters, off unless "instrumentation" is set in config.json
+enabled = False
+
+# (stage, context key) -> [count, seconds, max seconds] accumulated in this process since the last flush
+stage_totals = {}
+# (name, context key) -> value
+counter_totals = {}
+
+lock = threading.Lock()
+
+
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+
+    def __init__(self, stage, context):
+        self.stage = stage
+        self.context = context
+        self.start = None
+
+    def __enter__(self):
+        if profiler.trace_memory:
+            profiler.enter_memory_stage()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self.start
+        if profiler.trace_memory:
+            profiler.exit_memory_stage(self.stage)
+        key = (self.stage, self.context)
+        with lock:
+            totals = stage_totals.get(key)
+            if totals is None:
+                stage_totals[key] = [1, seconds, seconds]
+            else:
+                totals[0] += 1
+                totals[1] += seconds
+                if seconds > totals[2]:
+                    totals[2] = seconds
+        return False
+
+
+def enable_instrumentation(flag=True):
+    """
+    Set before the pool workers are forked, so they inherit it
+    """
+    global enabled
+    enabled = flag
+
+
+def _get_context(context):
+    return tuple(sorted((context if context is not None else report_context).items()))
+
+
+def stage_timer(stage, context=None):
+    """
+    Time a block, e.g.:
+        with stage_timer('read_rainnc'):
+            ...
+    :param stage: e.g.: insert_data
+    :param context: labels, the report context (wrf system, date) if None
+    :return: context manager, a shared no-op one when instrumentation is disabled
+    """
+    if not enabled:
+        return NULL_TIMER
+    return _StageTimer(stage, _get_context(context))
+
+
+def count(name, value=1, context=None):
+    """
+    :param name: e.g.: cells
+    :param value: amount to add
+    :param context: labels, the report context (wrf system, date) if None
+    """
+    if not enabled:
+        return
+    key = (name, _get_context(context))
+    with lock:
+        counter_totals[key] = counter_totals.get(key, 0) + value
+
+
+def timed(stage, func, context=None):
+    """
+    :return: func wrapped in a stage_timer, e.g.: for jobs run on another thread
+    """
+
+    def timed_func(*args, **kwargs):
+        with stage_timer(stage, context=context):
+            return func(*args, **kwargs)
+
+    return timed_func
+
+
+def flush_instrumentation():
+    """
+    Send the totals accumulated in this process to the run report
+    """
+    if not enabled:
+        return
+
+    with lock:
+        stages = dict(stage_totals)
+        counters = dict(counter_totals)
+        stage_totals.clear()
+        counter_totals.clear()
+
+    for (stage, context), (stage_count, seconds, max_seconds) in stages.items():
+        report_timing(stage, seconds, count=stage_count, max_seconds=max_seconds, context=dict(context))
+
+    for (name, context), value in counters.items():
+        report_count(name, value, context=dict(context))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(context_key, **extra):
+    labels = list(context_key) + sorted(extra.items())
+    return ','.join(['{}="{}"'.format(key, _escape_label(value)) for key, value in labels])
+
+
+def write_prometheus_textfile(run_report, file_path):
+    """
+    Export the run report for the node exporter textfile collector
+    :param run_report: RunReportCollector, after it is stopped
+    :param file_path: e.g.: /var/lib/node_exporter/textfile_collector/wrf_data_pusher.prom
+    :return:
+    """
+    report = run_report.to_dict()
+
+    rows_written = sum([counts.get('rows_written', 0) for counts in run_report.counts.values()])
+
+    lines = [
+        '# HELP wrf_data_pusher_stage_seconds Time spent in a stage during the last run.',
+        '# TYPE wrf_data_pusher_stage_seconds gauge'
+    ]
+    for context_key, stages in sorted(run_report.timings.items()):
+        for stage, totals in sorted(stages.items()):
+            lines.append('wrf_data_pusher_stage_seconds{{{}}} {}'.format(
+                _format_labels(context_key, stage=stage), totals['seconds']))
+
+    lines.extend([
+        '# HELP wrf_data_pusher_stage_runs Number of times a stage ran during the last run.',
+        '# TYPE wrf_data_pusher_stage_runs gauge'
+    ])
+    for context_key, stages in sorted(run_report.timings.items()):
+        for stage, totals in sorted(stages.items()):
+            lines.append('wrf_data_pusher_stage_runs{{{}}} {}'.format(
+                _format_labels(context_key, stage=stage), totals['count']))
+
+    lines.extend([
+        '# HELP wrf_data_pusher_count Counters of the last run (cells, rows_written, ...).',
+        '# TYPE wrf_data_pusher_count gauge'
+    ])
+    for context_key, counts in sorted(run_report.counts.items()):
+        for name, value in sorted(counts.items()):
+            lines.append('wrf_data_pusher_count{{{}}} {}'.format(_format_labels(context_key, name=name), value))
+
+    lines.extend([
+        '# HELP wrf_data_pusher_run_duration_seconds Duration of the last run.',
+        '# TYPE wrf_data_pusher_run_duration_seconds gauge',
+        'wrf_data_pusher_run_duration_seconds {}'.format(report['duration_seconds']),
+        '# HELP wrf_data_pusher_rows_per_second Rows written per second during the last run.',
+        '# TYPE wrf_data_pusher_rows_per_second gauge',
+        'wrf_data_pusher_rows_per_second {}'.format(
+            rows_written / report['duration_seconds'] if report['duration_seconds'] else 0),
+        '# HELP wrf_data_pusher_errors Errors reported during the last run.',
+        '# TYPE wrf_data_pusher_errors gauge',
+        'wrf_data_pusher_errors {}'.format(len(run_report.errors)),
+        '# HELP wrf_data_pusher_last_run_timestamp_seconds Unix time the last run finished.',
+        '# TYPE wrf_data_pusher_last_run_timestamp_seconds gauge',
+        'wrf_data_pusher_last_run_timestamp_seconds {}'.format(time.time())
+    ])
+
+    # the collector must never read a half written file
+    tmp_file_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    with open(tmp_file_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.rename(tmp_file_path, file_path)
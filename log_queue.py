@@ -0,0 +1,75 @@
+import logging
+import multiprocessing as mp
+from logging.handlers import QueueHandler, QueueListener
+
+from run_report import report_context, get_context_label
+
+# the handlers of logger_config.yaml get this format once they are behind the listener
+CONTEXT_FORMAT = '%(asctime)s - %(processName)s[%(process)d] - %(log_context)s - %(name)s - %(levelname)s - ' \
+                 '%(message)s'
+
+
+class LogContextFilter(logging.Filter):
+    """
+    Tags each record with the run report context (wrf system, date) of the process that logged it
+    """
+
+    def filter(self, record):
+        record.log_context = get_context_label(tuple(sorted(report_context.items())))
+        return True
+
+
+def _queue_handler(queue):
+    handler = QueueHandler(queue)
+    handler.addFilter(LogContextFilter())
+    return handler
+
+
+def start_log_listener(*loggers):
+    """
+    Move the handlers of the root logger (and of the given loggers) behind a queue, so the pool workers only
+    enqueue their records and this process alone formats them and writes/rotates the log file.
+    Call in the parent, before the pool workers are forked.
+    :param loggers: loggers configured with their own handlers, besides the root logger
+    :return: (queue, listener), pass the queue to init_worker_logging and the listener to stop_log_listener
+    """
+    queue = mp.Queue()
+
+    handlers = []
+    for configured_logger in [logging.getLogger()] + [l for l in loggers if l is not logging.getLogger()]:
+        if not configured_logger.handlers:
+            continue
+        for handler in list(configured_logger.handlers):
+            configured_logger.removeHandler(handler)
+            if handler not in handlers:
+                handlers.append(handler)
+        configured_logger.addHandler(_queue_handler(queue))
+
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(CONTEXT_FORMAT))
+
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return queue, listener
+
+
+def init_worker_logging(queue):
+    """
+    Pool initializer, makes the worker enqueue its records instead of writing them
+    :param queue: queue returned by start_log_listener
+    """
+    for configured_logger in [logging.getLogger()] + [logging.getLogger(name)
+                                                      for name in list(logging.root.manager.loggerDict.keys())]:
+        if isinstance(configured_logger, logging.Logger) and configured_logger.handlers:
+            for handler in list(configured_logger.handlers):
+                configured_logger.removeHandler(handler)
+            configured_logger.addHandler(_queue_handler(queue))
+
+
+def stop_log_listener(listener):
+    """
+    Write the records still in the queue and stop the listener
+    """
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class MetadataCache:
+    """
+    Keeps station/source/variable/unit meta data loaded from the database for ttl seconds,
+    so long running processes don't reload it for every job but still pick up changes.
+    """
+
+    def __init__(self, ttl=3600):
+        """
+        :param ttl: seconds an entry stays valid
+        """
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (value, loaded time)
+        self.entries = {}
+
+    def get(self, key, loader):
+        """
+        :param key: e.g.: ('source', 'WRF_A', '4.0')
+        :param loader: called without arguments to load the value when it is missing or expired
+        :return: cached or freshly loaded value (None values are not cached)
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                return entry[0]
+
+        value = loader()
+
+        if value is not None:
+            with self.lock:
+                self.entries[key] = (value, time.time())
+
+        return value
+
+    def invalidate(self, key=None):
+        """
+        :param key: entry to drop, every entry if None
+        """
+        with self.lock:
+            if key is None:
+                self.entries = {}
+            else:
+                self.entries.pop(key, None)
@@ -1,10 +1,13 @@
-import operator
-import collections
+"""
+Maps the new wrf stations and runs of curw_fcst to the old ones. Run as a module from the repository root, where
+spatial_index lives and the csv files are read from and written to, e.g.:
+    python -m old_data_import.gen_old_new_mappings
+"""
 import csv
 import pymysql
 import traceback
 
-from math import acos, cos, sin, radians
+from spatial_index import StationIndex
 
 
 def read_csv(file_name):
@@ -35,56 +38,86 @@ def create_csv(file_name, data):
     csvFile.close()
 
 
-def wrf_new_to_wrf_old_station_id_mapping(new_wrf_csv, old_wrf_csv):
-
+def wrf_new_to_wrf_old_station_id_mapping(new_wrf_csv, old_wrf_csv, k=1):
+    """
+    Map each new wrf station to its nearest old wrf stations
+    :param new_wrf_csv: id,name,latitude,longitude,...
+    :param old_wrf_csv: id,name,latitude,longitude,...
+    :param k: number of old stations per new station
+    :return:
+    """
     new_wrf_grids = read_csv(new_wrf_csv)
 
     old_wrf_grids = read_csv(old_wrf_csv)
 
-    wrf_new_to_old_id_mapping_list = [['new_wrf_id', 'old_wrf_id', 'dist']]
+    old_wrf_index = StationIndex(ids=[grid[0] for grid in old_wrf_grids],
+                                 lats=[float(grid[2]) for grid in old_wrf_grids],
+                                 lons=[float(grid[3]) for grid in old_wrf_grids])
 
-    for origin_index in range(len(new_wrf_grids)):
+    old_ids, distances = old_wrf_index.query(lats=[float(grid[2]) for grid in new_wrf_grids],
+                                             lons=[float(grid[3]) for grid in new_wrf_grids], k=k)
 
-        wrf_new_to_old_id_mapping = [new_wrf_grids[origin_index][0]]
+    header = ['new_wrf_id', 'old_wrf_id', 'dist']
+    for i in range(2, k + 1):
+        header.extend(['old_wrf_id_{}'.format(i), 'dist_{}'.format(i)])
 
-        origin_lat = float(new_wrf_grids[origin_index][2])
-        origin_lng = float(new_wrf_grids[origin_index][3])
+    wrf_new_to_old_id_mapping_list = [header]
 
-        distances = {}
+    for new_index in range(len(new_wrf_grids)):
+        wrf_new_to_old_id_mapping = [new_wrf_grids[new_index][0]]
+        for old_id, distance in zip(old_ids[new_index], distances[new_index]):
+            wrf_new_to_old_id_mapping.extend([old_id, float(distance)])
 
-        for old_index in range(len(old_wrf_grids)):
-            lat = float(old_wrf_grids[old_index][2])
-            lng = float(old_wrf_grids[old_index][3])
+        wrf_new_to_old_id_mapping_list.append(wrf_new_to_old_id_mapping)
 
-            intermediate_value = cos(radians(origin_lat)) * cos(radians(lat)) * cos(radians(lng) - radians(origin_lng)) + sin(radians(origin_lat)) * sin(radians(lat))
-            if intermediate_value < 1:
-                distance = 6371 * acos(intermediate_value)
-            else:
-                distance = 6371 * acos(1)
+    create_csv('wrf_new_to_old_station_id_mapping.csv', wrf_new_to_old_id_mapping_list)
 
-            distances[old_wrf_grids[old_index][0]] = distance
 
-        sorted_distances = collections.OrderedDict(sorted(distances.items(), key=operator.itemgetter(1))[:10])
+# wrf_new_to_wrf_old_station_id_mapping(new_wrf_csv="wrf_stations.csv", old_wrf_csv="outdated_wrf_stations.csv")
 
-        count = 0
-        for key in sorted_distances.keys():
-            if count < 1:
-                wrf_new_to_old_id_mapping.extend([key, sorted_distances.get(key)])
-                count += 1
-            else:
-                break
+def insert_old_runs(cursor, old_runs):
+    """
+    :param old_runs: list of (seq, old id, station, source)
+    """
+    sql_statement = "INSERT INTO `old_run` (`seq`, `old_id`, `station`, `source`) VALUES " + \
+                    ", ".join(["(%s, %s, %s, %s)"] * len(old_runs))
+    cursor.execute(sql_statement, [value for old_run in old_runs for value in old_run])
 
-        print(wrf_new_to_old_id_mapping)
-        wrf_new_to_old_id_mapping_list.append(wrf_new_to_old_id_mapping)
 
-    create_csv('wrf_new_to_old_station_id_mapping.csv', wrf_new_to_old_id_mapping_list)
+def load_old_runs(cursor, old_run_csv, batch_size=1000):
+    """
+    Load an old run csv into the temporary old_run table
+    :param cursor:
+    :param old_run_csv: id,sim_tag,start_date,end_date,station,source,variable,unit
+    :param batch_size: rows per insert statement
+    :return: number of old runs loaded
+    """
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS `old_run`;")
+    cursor.execute("CREATE TEMPORARY TABLE `old_run` (`seq` INT NOT NULL, `old_id` VARCHAR(64) NOT NULL, "
+                   "`station` INT NOT NULL, `source` INT NOT NULL, PRIMARY KEY (`seq`), "
+                   "KEY (`source`, `station`)) ENGINE=InnoDB;")
 
+    count = 0
+    with open(old_run_csv, 'r') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+
+        batch = []
+        for row in reader:
+            batch.append((count, row[0], row[4], row[5]))
+            count += 1
+            if len(batch) == batch_size:
+                insert_old_runs(cursor, batch)
+                batch = []
+        if batch:
+            insert_old_runs(cursor, batch)
+
+    return count
 
-# wrf_new_to_wrf_old_station_id_mapping(new_wrf_csv="wrf_stations.csv", old_wrf_csv="outdated_wrf_stations.csv")
 
 def curw_fcst_new_to_old_hash_id_mapping():
 
-    curw_fcst_new_to_old_hash_id_mapping_list = [['new_hash_id', 'old_hash_id']]
+    connection = None
 
     try:
 
@@ -95,29 +128,37 @@ def curw_fcst_new_to_old_hash_id_mapping():
                 db='curw_fcst',
                 cursorclass=pymysql.cursors.DictCursor)
 
-        for i in range(8):  # source id
-
-            old_hash_ids = read_csv('old_source{}_run.csv'.format(i+1))
-            # id,sim_tag,start_date,end_date,station,source,variable,unit
+        with open('curw_fcst_new_to_old_hash_id_mapping.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile)
+            writer.writerow(['new_hash_id', 'old_hash_id'])
 
-            for old_index in range(len(old_hash_ids)):
-                # Extract station ids
-                with connection.cursor() as cursor1:
-                    sql_statement = "SELECT `id` FROM `run` WHERE `source`=%s AND `station`=%s AND " \
-                                    "`sim_tag`='evening_18hrs' AND `variable`=1 AND `unit`=1;"
-                    cursor1.execute(sql_statement, (old_hash_ids[old_index][5], old_hash_ids[old_index][4]))
-                    new_id = cursor1.fetchone()['id']
+            for i in range(8):  # source id
 
-                    print([new_id, old_hash_ids[old_index][0]])
-                    curw_fcst_new_to_old_hash_id_mapping_list.append([new_id, old_hash_ids[old_index][0]])
+                old_run_csv = 'old_source{}_run.csv'.format(i+1)
 
-        create_csv('curw_fcst_new_to_old_hash_id_mapping.csv', curw_fcst_new_to_old_hash_id_mapping_list)
+                with connection.cursor() as cursor1:
+                    old_run_count = load_old_runs(cursor1, old_run_csv)
+
+                # one join per source instead of a lookup per old run, streamed into the mapping csv
+                mapped_count = 0
+                with connection.cursor(pymysql.cursors.SSCursor) as cursor2:
+                    sql_statement = "SELECT `run`.`id`, `old_run`.`old_id` FROM `old_run` " \
+                                    "JOIN `run` ON `run`.`source`=`old_run`.`source` AND " \
+                                    "`run`.`station`=`old_run`.`station` " \
+                                    "WHERE `run`.`sim_tag`='evening_18hrs' AND `run`.`variable`=1 AND " \
+                                    "`run`.`unit`=1 ORDER BY `old_run`.`seq`;"
+                    cursor2.execute(sql_statement)
+                    for new_id, old_id in cursor2:
+                        writer.writerow([new_id, old_id])
+                        mapped_count += 1
+
+                print("{}: {} of {} old runs mapped".format(old_run_csv, mapped_count, old_run_count))
 
     except Exception as ex:
         traceback.print_exc()
     finally:
-        connection.close()
+        if connection is not None:
+            connection.close()
 
 
 curw_fcst_new_to_old_hash_id_mapping()
-
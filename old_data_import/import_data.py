@@ -1,56 +1,241 @@
+"""
+Streams data_v3 into data, following curw_fcst_new_to_old_hash_id_mapping.csv.
+
+The old hash ids are split into chunks, each chunk is migrated by a pool worker with its own connections:
+the rows are streamed with a server side cursor ordered by (id, fgt) and written with multi row upserts,
+committed batch by batch. Each old id is appended to the checkpoint file once its last batch is committed, a rerun
+skips them, so the import can be stopped and resumed. Rerunning an old id is harmless since the rows are upserted.
+
+e.g.: python import_data.py --workers 4 --ids-per-chunk 50 --batch-size 5000
+"""
+import argparse
+import os
 import traceback
+import multiprocessing as mp
 import pymysql
 from db_adapter.csv_utils import read_csv
 
-from db_adapter.base import get_Pool, destroy_Pool
 from db_adapter.constants import CURW_FCST_HOST, CURW_FCST_USERNAME, CURW_FCST_PASSWORD, CURW_FCST_PORT, CURW_FCST_DATABASE
-from db_adapter.curw_fcst.timeseries import Timeseries
+from db_adapter.logger import logger
+
+INSERT_SQL = "INSERT INTO `data` (`id`, `time`, `fgt`, `value`) VALUES {} " \
+             "ON DUPLICATE KEY UPDATE `value`=VALUES(`value`);"
+
+# connections of this pool worker: read (streaming) and write
+read_connection = None
+write_connection = None
+
+# old hash ids already migrated, one per line, appended to by every worker
+checkpoint_file = None
+
+
+def get_connection():
+    return pymysql.connect(host=CURW_FCST_HOST, user=CURW_FCST_USERNAME, password=CURW_FCST_PASSWORD,
+                           port=CURW_FCST_PORT, db=CURW_FCST_DATABASE, autocommit=False)
+
+
+def init_worker(checkpoint_file_path):
+    """
+    Pool initializer, a server side cursor blocks its connection until it is exhausted,
+    so the worker reads and writes on separate connections
+    :param checkpoint_file_path: checkpoint file the worker appends its migrated old ids to
+    """
+    global read_connection, write_connection, checkpoint_file
+    checkpoint_file = checkpoint_file_path
+    read_connection = get_connection()
+    write_connection = get_connection()
+
 
+def reset_connections():
+    """
+    Reopen the worker's connections after a failure, a dropped connection or an abandoned server side
+    cursor would otherwise fail every later chunk of the worker
+    """
+    global read_connection, write_connection
+    for connection in [read_connection, write_connection]:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    read_connection = get_connection()
+    write_connection = get_connection()
 
-def import_old_data():
-    # Connect to the database
-    pool = get_Pool(host=CURW_FCST_HOST, user=CURW_FCST_USERNAME, password=CURW_FCST_PASSWORD, port=CURW_FCST_PORT, db=CURW_FCST_DATABASE)
 
-    connection = pool.connection()
+def write_checkpoint(old_ids):
+    """
+    Append migrated old ids to the checkpoint file, in a single append so the workers' lines do not interleave
+    """
+    if not old_ids:
+        return
+    with open(checkpoint_file, 'a') as f:
+        f.write(''.join(["{}\n".format(old_id) for old_id in old_ids]))
 
-    curw_fcst_new_to_old_hash_id_mapping = read_csv("curw_fcst_new_to_old_hash_id_mapping.csv")
 
-    TS = Timeseries(pool=pool)
+def insert_rows(cursor, rows):
+    """
+    :param cursor: cursor of the write connection
+    :param rows: list of [id, time, fgt, value]
+    """
+    sql_statement = INSERT_SQL.format(", ".join(["(%s, %s, %s, %s)"] * len(rows)))
+    cursor.execute(sql_statement, [value for row in rows for value in row])
+
+
+def update_start_dates(cursor, start_dates):
+    """
+    :param start_dates: dict of new id -> earliest fgt migrated
+    """
+    # only moved back, old ids of the same run may finish in any order
+    cursor.executemany("UPDATE `run` SET `start_date`=%s WHERE `id`=%s AND "
+                       "(`start_date` IS NULL OR `start_date`>%s);",
+                       [(fgt, new_id, fgt) for new_id, fgt in start_dates.items()])
+
+
+def import_chunk(old_to_new_ids, batch_size):
+    """
+    Migrate the data of a chunk of old hash ids, committing every batch
+    :param old_to_new_ids: dict of old hash id -> new hash id
+    :param batch_size: rows per insert statement and transaction
+    :return: (number of migrated old ids, number of rows), None if the chunk failed
+    """
+    old_ids = sorted(old_to_new_ids.keys())
+    rows = 0
+    migrated = set()
+    # old id being streamed, and its earliest fgt (the first, rows are ordered by id, fgt)
+    current_id = None
+    current_start_date = None
 
     try:
+        with read_connection.cursor(pymysql.cursors.SSCursor) as read_cursor:
+            sql_statement = "SELECT `id`, `time`, `fgt`, `value` FROM `data_v3` WHERE `id` IN ({}) " \
+                            "ORDER BY `id`, `fgt`;".format(", ".join(["%s"] * len(old_ids)))
+            read_cursor.execute(sql_statement, old_ids)
 
-        for hash_index in range(len(curw_fcst_new_to_old_hash_id_mapping)):
-            print("##### Hash index: ", hash_index, " #####")
-            fgt_list = []
-            # Extract fgts
-            with connection.cursor() as cursor1:
-                sql_statement = "select distinct `fgt` from `data_v3` where `id`=%s order by `fgt` desc;"
-                cursor1.execute(sql_statement, curw_fcst_new_to_old_hash_id_mapping[hash_index][1])
-                fgts = cursor1.fetchall()
-                for fgt in fgts:
-                    fgt_list.append(fgt.get('fgt'))
-
-            for fgt in fgt_list:
-                timeseries= []
-                with connection.cursor() as cursor2:
-                    sql_statement = "select * from `data_v3` where `id`=%s and `fgt`=%s;"
-                    cursor2.execute(sql_statement, (curw_fcst_new_to_old_hash_id_mapping[hash_index][1], fgt))
-                    results = cursor2.fetchall()
-                    for result in results:
-                        timeseries.append([curw_fcst_new_to_old_hash_id_mapping[hash_index][0],
-                                           result.get('time'), result.get('fgt'), result.get('value')])
-
-                TS.insert_data(timeseries=timeseries, upsert=True)
-                TS.update_start_date(id_=curw_fcst_new_to_old_hash_id_mapping[hash_index][0], start_date=fgt)
+            while True:
+                results = read_cursor.fetchmany(batch_size)
 
-    except Exception as ex:
+                batch = []
+                # old ids whose last row is in this batch, checkpointed once it is committed
+                finished = []
+                start_dates = {}
+                for old_id, time, fgt, value in results:
+                    if old_id != current_id:
+                        if current_id is not None:
+                            finished.append(current_id)
+                            start_dates[old_to_new_ids[current_id]] = current_start_date
+                        current_id = old_id
+                        current_start_date = fgt
+                    batch.append([old_to_new_ids[old_id], time, fgt, value])
+
+                if not results and current_id is not None:
+                    finished.append(current_id)
+                    start_dates[old_to_new_ids[current_id]] = current_start_date
+
+                with write_connection.cursor() as write_cursor:
+                    if batch:
+                        insert_rows(write_cursor, batch)
+                    if start_dates:
+                        update_start_dates(write_cursor, start_dates)
+                write_connection.commit()
+
+                rows += len(batch)
+                migrated.update(finished)
+                write_checkpoint(finished)
+
+                if not results:
+                    break
+
+        # old ids without any data_v3 rows are done as well
+        empty_ids = [old_id for old_id in old_ids if old_id not in migrated]
+        write_checkpoint(empty_ids)
+
+        return len(migrated) + len(empty_ids), rows
+    except Exception:
+        logger.error("Importing the data of old ids {} .. {} failed.".format(old_ids[0], old_ids[-1]))
         traceback.print_exc()
+        try:
+            write_connection.rollback()
+        except Exception:
+            pass
+        reset_connections()
+        return None
+
+
+def import_chunk_job(args):
+    return import_chunk(*args)
+
+
+def read_checkpoint(checkpoint_file):
+    """
+    :return: set of the old hash ids already migrated
+    """
+    if not os.path.exists(checkpoint_file):
+        return set()
+    with open(checkpoint_file, 'r') as f:
+        return set([line.strip() for line in f if line.strip()])
+
+
+def import_old_data(mapping_file, checkpoint_file, workers, ids_per_chunk, batch_size):
+    """
+    :param mapping_file: csv of new_hash_id, old_hash_id
+    :param checkpoint_file: old hash ids already migrated, one per line
+    :param workers: number of worker processes
+    :param ids_per_chunk: old hash ids per worker job
+    :param batch_size: rows fetched and inserted at a time
+    :return: True if every chunk was migrated
+    """
+    curw_fcst_new_to_old_hash_id_mapping = read_csv(mapping_file)
+
+    done = read_checkpoint(checkpoint_file)
+
+    old_to_new_ids = {}
+    for new_id, old_id in curw_fcst_new_to_old_hash_id_mapping:
+        if old_id not in done:
+            old_to_new_ids[old_id] = new_id
+
+    # contiguous hash ranges, so each worker reads adjacent parts of the data_v3 primary key
+    old_ids = sorted(old_to_new_ids.keys())
+    chunks = [{old_id: old_to_new_ids[old_id] for old_id in old_ids[i:i + ids_per_chunk]}
+              for i in range(0, len(old_ids), ids_per_chunk)]
+
+    logger.info("{} old ids already imported, {} to go in {} chunks.".format(len(done), len(old_ids), len(chunks)))
+
+    failed_chunks = 0
+    total_rows = 0
+
+    # the workers checkpoint their old ids as they are committed
+    mp_pool = mp.Pool(workers, initializer=init_worker, initargs=(checkpoint_file,))
+    try:
+        results = mp_pool.imap_unordered(import_chunk_job, [(chunk, batch_size) for chunk in chunks])
+        for index, result in enumerate(results):
+            if result is None:
+                failed_chunks += 1
+                continue
+
+            id_count, rows = result
+            total_rows += rows
+
+            logger.info("Chunk {}/{} done ({} old ids), {} rows imported so far.".format(
+                index + 1, len(chunks), id_count, total_rows))
     finally:
-        connection.close()
-        destroy_Pool(pool=pool)
-        print()
+        mp_pool.close()
+        mp_pool.join()
+
+    logger.info("Imported {} rows, {} chunks failed.".format(total_rows, failed_chunks))
+    return failed_chunks == 0
 
 
-import_old_data()
+if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='Import data_v3 into data, resuming from the checkpoint file.')
+    parser.add_argument('--mapping-file', default='curw_fcst_new_to_old_hash_id_mapping.csv')
+    parser.add_argument('--checkpoint-file', default='import_data.checkpoint')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ids-per-chunk', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
 
+    try:
+        import_old_data(mapping_file=args.mapping_file, checkpoint_file=args.checkpoint_file, workers=args.workers,
+                        ids_per_chunk=args.ids_per_chunk, batch_size=args.batch_size)
+    except Exception as ex:
+        traceback.print_exc()
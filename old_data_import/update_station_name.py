@@ -1,9 +1,31 @@
+import argparse
+import csv
+import sys
 import traceback
 import pymysql
 from db_adapter.csv_utils import read_csv
+from db_adapter.logger import logger
 
 
-def update_station_name_in_run_table():
+def get_coordinate_sql(column):
+    """
+    str(float('%.6f' % value)) in SQL: 6 decimals, trailing zeros dropped but one
+    """
+    rounded = "TRIM(TRAILING '0' FROM CAST(`{}` AS DECIMAL(9,6)))".format(column)
+    return "IF({0} LIKE '%.', CONCAT({0}, '0'), {0})".format(rounded)
+
+
+# the station name the pusher looks up (see station_seeder.get_wrf_station_name), computed by the server
+STATION_NAME_SQL = "CONCAT('wrf_', {}, '_', {})".format(get_coordinate_sql('latitude'), get_coordinate_sql('longitude'))
+
+
+def update_station_name_in_run_table(dry_run=False, diff_file=None):
+    """
+    Rename the stations to wrf_<latitude>_<longitude> in one statement, touching only the names that change
+    :param dry_run: only list the names that would change
+    :param diff_file: write the changes (id, old name, new name) to this csv
+    :return: number of stations renamed (to be renamed if dry_run), raises if the rename failed (rolled back)
+    """
     # Connect to the database
     connection = pymysql.connect(host='35.230.102.148',
             user='root',
@@ -11,29 +33,64 @@ def update_station_name_in_run_table():
             db='curw_fcst',
             cursorclass=pymysql.cursors.DictCursor)
 
-    results = {}
+    changed_condition = "`name` IS NULL OR BINARY `name` <> {}".format(STATION_NAME_SQL)
+
+    count = 0
 
     try:
-        # Extract station ids
-        with connection.cursor() as cursor1:
-            sql_statement = "select id, latitude, longitude from station;"
-            cursor1.execute(sql_statement)
-            results = cursor1.fetchall()
+        if dry_run or diff_file is not None:
+            with connection.cursor(pymysql.cursors.SSCursor) as cursor1:
+                sql_statement = "SELECT `id`, `name`, {} FROM `station` WHERE {} ORDER BY `id`;".format(
+                    STATION_NAME_SQL, changed_condition)
+                cursor1.execute(sql_statement)
 
-        with connection.cursor() as cursor3:
-            for result in results:
-                sql_statement = "UPDATE `curw_fcst`.`station` SET `name`=%s WHERE `id`=%s;"
-                cursor3.execute(sql_statement, ('wrf_{}_{}'.format(result.get('latitude'), result.get('longitude')),
-                                                result.get('id')))
+                diff_csv = open(diff_file, 'w') if diff_file is not None else None
+                try:
+                    writer = csv.writer(diff_csv) if diff_csv is not None else None
+                    if writer is not None:
+                        writer.writerow(['id', 'old_name', 'new_name'])
+                    for station_id, old_name, new_name in cursor1:
+                        count += 1
+                        if writer is not None:
+                            writer.writerow([station_id, old_name, new_name])
+                        if dry_run:
+                            print("{}: {} -> {}".format(station_id, old_name, new_name))
+                finally:
+                    if diff_csv is not None:
+                        diff_csv.close()
 
-        connection.commit()
+        if not dry_run:
+            with connection.cursor() as cursor2:
+                sql_statement = "UPDATE `station` SET `name`={} WHERE {};".format(STATION_NAME_SQL, changed_condition)
+                count = cursor2.execute(sql_statement)
 
-    except Exception as ex:
-        traceback.print_exc()
+            connection.commit()
+
+        print("{} station names {}".format(count, "would change" if dry_run else "changed"))
+        return count
+
+    except Exception:
+        connection.rollback()
+        logger.error("Renaming the stations failed, rolled back.")
+        raise
     finally:
         connection.close()
 
 
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Rename the stations to wrf_<latitude>_<longitude>.')
+    parser.add_argument('--dry-run', action='store_true', help='only list the names that would change')
+    parser.add_argument('--diff-file', default=None, help='write id, old name, new name of the changes to this csv')
+    args = parser.parse_args()
+
+    try:
+        update_station_name_in_run_table(dry_run=args.dry_run, diff_file=args.diff_file)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+
+
 # wrf_station_mapping_new_to_old = read_csv('wrf_new_to_old_station_id_mapping.csv')
 # new_wrf_stations_in_order = []
 # old_wrf_stations_in_order = []
@@ -0,0 +1,171 @@
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from db_adapter.logger import logger
+
+# per worker profiling, off unless --profile is given. Set before the pool workers are forked, so they inherit it
+profile_dir = None
+sampling = False
+trace_memory = False
+
+# stage -> peak bytes allocated inside the stage, of the unit being profiled in this process
+stage_peaks = {}
+
+local = threading.local()
+
+SUMMARY_FILE = 'summary.txt'
+
+
+def enable_profiling(directory, use_sampling=False, use_tracemalloc=False):
+    """
+    :param directory: the profile files are written here, one per wrf system and date
+    :param use_sampling: use the pyinstrument sampling profiler if installed, cProfile otherwise
+    :param use_tracemalloc: record the peak allocations of each instrumentation stage
+    """
+    global profile_dir, sampling, trace_memory
+
+    if use_sampling:
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            logger.warning("pyinstrument is not installed, profiling with cProfile.")
+            use_sampling = False
+
+    if use_tracemalloc and not hasattr(tracemalloc, 'reset_peak'):
+        logger.warning("tracemalloc.reset_peak needs python 3.9, stage allocations will not be recorded.")
+        use_tracemalloc = False
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    profile_dir = directory
+    sampling = use_sampling
+    trace_memory = use_tracemalloc
+
+
+def enter_memory_stage():
+    """
+    Called by the stage timers when trace_memory is set
+    """
+    if not tracemalloc.is_tracing():
+        return
+    stack = getattr(local, 'memory_stages', None)
+    if stack is None:
+        stack = local.memory_stages = []
+    current, peak = tracemalloc.get_traced_memory()
+    # the peak is reset below, the enclosing stage keeps what it reached so far
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+    # [memory at start, peak of the nested stages]
+    stack.append([current, 0])
+    tracemalloc.reset_peak()
+
+
+def exit_memory_stage(stage):
+    stack = getattr(local, 'memory_stages', None)
+    if not tracemalloc.is_tracing() or not stack:
+        return
+    start, nested_peak = stack.pop()
+    peak = max(tracemalloc.get_traced_memory()[1], nested_peak)
+    stage_peaks[stage] = max(stage_peaks.get(stage, 0), peak - start)
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+
+
+def _write_memory_file(file_path, snapshot):
+    top_lines = snapshot.statistics('lineno')[:20]
+    with open(file_path, 'w') as f:
+        json.dump({
+            'stage_peak_bytes': stage_peaks,
+            'top_allocations': [{'line': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+                                for stat in top_lines]
+        }, f, indent=2, sort_keys=True)
+
+
+@contextmanager
+def profile_unit(name):
+    """
+    Profile a block of a pool worker, e.g.:
+        with profile_unit('A_2019-07-30'):
+            read_netcdf_file(...)
+    :param name: file name prefix, e.g.: <wrf system>_<date>
+    """
+    if profile_dir is None:
+        yield
+        return
+
+    file_prefix = os.path.join(profile_dir, name.replace(os.sep, '_'))
+
+    if trace_memory:
+        stage_peaks.clear()
+        tracemalloc.start()
+
+    if sampling:
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        try:
+            if sampling:
+                profiler.stop()
+                with open(file_prefix + '.txt', 'w') as f:
+                    f.write(profiler.output_text())
+            else:
+                profiler.disable()
+                profiler.dump_stats(file_prefix + '.prof')
+
+            if trace_memory:
+                _write_memory_file(file_prefix + '.memory.json', tracemalloc.take_snapshot())
+                tracemalloc.stop()
+        except Exception:
+            logger.warning("Could not write the profile of {}".format(name))
+
+
+def write_profile_summary(directory, top=30):
+    """
+    Merge the cProfile files and the stage allocations of all workers into directory/summary.txt
+    :param directory: profile directory
+    :param top: number of functions listed, by cumulative time
+    :return: summary file path, None if there was nothing to merge
+    """
+    profile_files = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    memory_files = sorted(glob.glob(os.path.join(directory, '*.memory.json')))
+
+    if not profile_files and not memory_files:
+        return None
+
+    output = io.StringIO()
+
+    if profile_files:
+        output.write("Merged {} profiles, top {} functions by cumulative time\n".format(len(profile_files), top))
+        stats = pstats.Stats(*profile_files, stream=output)
+        stats.sort_stats('cumulative').print_stats(top)
+
+    if memory_files:
+        peaks = {}
+        for memory_file in memory_files:
+            with open(memory_file) as f:
+                for stage, peak in json.load(f)['stage_peak_bytes'].items():
+                    peaks[stage] = max(peaks.get(stage, 0), peak)
+
+        output.write("Peak allocations per stage, max over {} units\n".format(len(memory_files)))
+        for stage, peak in sorted(peaks.items(), key=lambda item: -item[1]):
+            output.write("  {:<24} {:>12.1f} KB\n".format(stage, peak / 1024.0))
+
+    summary_file = os.path.join(directory, SUMMARY_FILE)
+    with open(summary_file, 'w') as f:
+        f.write(output.getvalue())
+    return summary_file
@@ -0,0 +1,126 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from db_adapter.logger import logger
+
+
+class SSHSessionPool:
+    """
+    Keeps one authenticated ssh connection per host and runs commands on separate channels of it,
+    so concurrent commands to the same host share a single handshake.
+    """
+
+    def __init__(self, user, key, port=22, client_factory=paramiko.SSHClient):
+        """
+        :param user: remote user name
+        :param key: path to the private key file
+        :param port: ssh port
+        :param client_factory: callable returning a paramiko.SSHClient like object
+            (lets the pool be pointed at a local ssh server stand-in)
+        """
+        self.user = user
+        self.key = key
+        self.port = port
+        self.client_factory = client_factory
+        self.clients = {}
+        # guards clients and host_locks, never held while connecting
+        self.lock = threading.Lock()
+        # one lock per host, so a slow or hung host only holds up its own commands
+        self.host_locks = {}
+
+    def get_client(self, host):
+        """
+        :param host:
+        :return: connected client of the host, reconnected if the previous connection dropped
+        """
+        with self.lock:
+            host_lock = self.host_locks.setdefault(host, threading.Lock())
+
+        with host_lock:
+            with self.lock:
+                client = self.clients.get(host)
+
+            if client is not None:
+                transport = client.get_transport()
+                if transport is not None and transport.is_active():
+                    return client
+                client.close()
+
+            client = self.client_factory()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(hostname=host, port=self.port, username=self.user, key_filename=self.key)
+
+            with self.lock:
+                self.clients[host] = client
+
+            return client
+
+    def run(self, host, command):
+        """
+        Run a command on a new channel, streaming its output to the log
+        :param host:
+        :param command:
+        :return: True if the command exited with status 0, False otherwise
+        """
+        channel = None
+        try:
+            channel = self.get_client(host).get_transport().open_session()
+            channel.set_combined_stderr(True)
+            channel.exec_command(command)
+
+            for line in channel.makefile('r'):
+                logger.info("[{}] {}".format(host, line.rstrip()))
+
+            return channel.recv_exit_status() == 0
+        except Exception:
+            logger.error("Remote command failed :: {} :: {}".format(host, command.split('2>&1')[0]))
+            traceback.print_exc()
+            return False
+        finally:
+            if channel is not None:
+                channel.close()
+
+    def run_on_hosts(self, hosts, command):
+        """
+        Run the same command on several hosts concurrently
+        :param hosts: list of hosts
+        :param command:
+        :return: dict of host -> True if successful, False otherwise
+        """
+        with ThreadPoolExecutor(max_workers=max(len(hosts), 1)) as executor:
+            futures = {host: executor.submit(self.run, host, command) for host in hosts}
+
+        return {host: future.result() for host, future in futures.items()}
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients = {}
+
+
+session_pools = {}
+session_pools_lock = threading.Lock()
+
+
+def get_session_pool(user, key, port=22, client_factory=paramiko.SSHClient):
+    """
+    :param port: ssh port
+    :param client_factory: see SSHSessionPool, e.g.: benchmark.fake_ssh.LocalSSHClient
+    :return: the shared SSHSessionPool of the user, key, port and client factory
+    """
+    with session_pools_lock:
+        if (user, key, port, client_factory) not in session_pools:
+            session_pools[(user, key, port, client_factory)] = SSHSessionPool(user=user, key=key, port=port,
+                                                                              client_factory=client_factory)
+        return session_pools[(user, key, port, client_factory)]
+
+
+def close_session_pools():
+    with session_pools_lock:
+        for session_pool in session_pools.values():
+            session_pool.close()
+        session_pools.clear()
@@ -0,0 +1,201 @@
+"""
+Prunes old forecast versions (fgts) of the curw_fcst timeseries.
+
+A version of a run is kept if it is one of the run's latest keep_versions fgts, or newer than keep_days.
+Whole partitions older than keep_days are dropped when the data table is partitioned on fgt and every sim tag is
+pruned; the rest is deleted per run in short chunked transactions, so inserts are never blocked for long.
+
+e.g.:
+    python retention.py --sim-tags evening_18hrs --keep-versions 7 --keep-days 30 --dry-run
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import pymysql
+
+from db_adapter.constants import CURW_FCST_HOST, CURW_FCST_PORT, CURW_FCST_USERNAME, CURW_FCST_PASSWORD, \
+    CURW_FCST_DATABASE
+from db_adapter.logger import logger
+
+from create_schema.partitions import DATA_TABLE, get_partitions, drop_partitions_before
+
+
+def get_connection():
+    return pymysql.connect(host=CURW_FCST_HOST, port=CURW_FCST_PORT, user=CURW_FCST_USERNAME,
+                           password=CURW_FCST_PASSWORD, db=CURW_FCST_DATABASE)
+
+
+def get_run_ids(connection, sim_tags=None):
+    """
+    :param sim_tags: e.g.: ['evening_18hrs'], every run if None
+    :return: list of run ids
+    """
+    with connection.cursor() as cursor:
+        if sim_tags:
+            cursor.execute("SELECT `id` FROM `run` WHERE `sim_tag` IN ({}) ORDER BY `id`;".format(
+                ", ".join(["%s"] * len(sim_tags))), sim_tags)
+        else:
+            cursor.execute("SELECT `id` FROM `run` ORDER BY `id`;")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_expired_fgts(fgts, keep_versions=None, keep_days=None, now=None):
+    """
+    :param fgts: fgts of a run
+    :param keep_versions: number of latest fgts to keep
+    :param keep_days: fgts newer than this many days are kept
+    :return: sorted list of the fgts to purge
+    """
+    if keep_versions is None and keep_days is None:
+        return []
+
+    cutoff = (now or datetime.now()) - timedelta(days=keep_days) if keep_days is not None else None
+    latest = set(sorted(fgts, reverse=True)[:keep_versions]) if keep_versions is not None else set()
+
+    expired = []
+    for fgt in sorted(fgts):
+        if fgt in latest:
+            continue
+        if cutoff is not None and fgt >= cutoff:
+            continue
+        expired.append(fgt)
+    return expired
+
+
+def get_average_row_length(connection, table=DATA_TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT `AVG_ROW_LENGTH` FROM `information_schema`.`TABLES` "
+                       "WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`=%s;", (table,))
+        row = cursor.fetchone()
+    return int(row[0] or 0) if row else 0
+
+
+def delete_fgts(connection, run_id, fgts, chunk_size, pause=0.0):
+    """
+    Delete the rows of some fgts of a run, chunk_size rows per transaction
+    :return: number of rows deleted
+    """
+    deleted = 0
+    sql_statement = "DELETE FROM `{}` WHERE `id`=%s AND `fgt` IN ({}) LIMIT {};".format(
+        DATA_TABLE, ", ".join(["%s"] * len(fgts)), int(chunk_size))
+
+    while True:
+        with connection.cursor() as cursor:
+            count = cursor.execute(sql_statement, [run_id] + list(fgts))
+        connection.commit()
+        deleted += count
+        if count < chunk_size:
+            return deleted
+        if pause:
+            # let the pusher's inserts through
+            time.sleep(pause)
+
+
+def purge_run(connection, run_id, keep_versions=None, keep_days=None, chunk_size=5000, pause=0.0, dry_run=False,
+              dropped_before=None):
+    """
+    :param dropped_before: fgts before this are in partitions dropped by the same dry run, not counted again
+    :return: (number of fgts purged, number of rows deleted)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT `fgt`, COUNT(*) FROM `{}` WHERE `id`=%s GROUP BY `fgt`;".format(DATA_TABLE),
+                       (run_id,))
+        rows_per_fgt = dict(cursor.fetchall())
+
+    if dry_run and dropped_before is not None:
+        rows_per_fgt = {fgt: rows for fgt, rows in rows_per_fgt.items() if fgt >= dropped_before}
+
+    expired = get_expired_fgts(list(rows_per_fgt.keys()), keep_versions=keep_versions, keep_days=keep_days)
+    if not expired:
+        return 0, 0
+
+    if dry_run:
+        return len(expired), sum([rows_per_fgt[fgt] for fgt in expired])
+
+    deleted = delete_fgts(connection, run_id, expired, chunk_size, pause=pause)
+
+    # the run starts at its oldest remaining version
+    remaining = sorted(set(rows_per_fgt.keys()) - set(expired))
+    if remaining:
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE `run` SET `start_date`=%s WHERE `id`=%s;", (remaining[0], run_id))
+        connection.commit()
+
+    return len(expired), deleted
+
+
+def is_partitioned_on_fgt(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT `PARTITION_EXPRESSION` FROM `information_schema`.`PARTITIONS` "
+                       "WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`=%s AND `PARTITION_NAME` IS NOT NULL;",
+                       (DATA_TABLE,))
+        expressions = [row[0] for row in cursor.fetchall()]
+    return len(expressions) == 1 and expressions[0].strip('`') == 'fgt'
+
+
+def apply_retention(connection, sim_tags=None, keep_versions=None, keep_days=None, chunk_size=5000, pause=0.0,
+                    dry_run=False):
+    """
+    :param sim_tags: sim tags to prune, every sim tag if None
+    :param keep_versions: latest fgts kept per run
+    :param keep_days: fgts newer than this are kept
+    :param chunk_size: rows deleted per transaction
+    :param pause: seconds between the chunks of a run
+    :param dry_run: only report what would be purged
+    :return: dict of runs, fgts, rows, partitions, bytes (partition bytes + deleted rows * average row length)
+    """
+    report = {'runs': 0, 'fgts': 0, 'rows': 0, 'partitions': [], 'bytes': 0}
+    dropped_before = None
+
+    # partitions are shared by every sim tag and run, they only go when nothing in them is kept
+    if keep_days is not None and keep_versions is None and not sim_tags and is_partitioned_on_fgt(connection):
+        cutoff = datetime.now() - timedelta(days=keep_days)
+        bounds = [partition['upper_bound'] for partition in get_partitions(connection)
+                  if partition['upper_bound'] is not None and partition['upper_bound'] <= cutoff]
+        dropped_before = max(bounds) if bounds else None
+        report['partitions'], report['bytes'] = drop_partitions_before(connection, cutoff, dry_run=dry_run)
+        logger.info("{} partitions {}".format("Would drop" if dry_run else "Dropped", report['partitions']))
+
+    average_row_length = get_average_row_length(connection)
+
+    for run_id in get_run_ids(connection, sim_tags):
+        fgts, rows = purge_run(connection, run_id, keep_versions=keep_versions, keep_days=keep_days,
+                               chunk_size=chunk_size, pause=pause, dry_run=dry_run, dropped_before=dropped_before)
+        if fgts:
+            report['runs'] += 1
+            report['fgts'] += fgts
+            report['rows'] += rows
+
+    report['bytes'] += report['rows'] * average_row_length
+    return report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Prune old forecast versions from the curw_fcst data table.')
+    parser.add_argument('--sim-tags', default=None, help='comma separated, e.g.: evening_18hrs (default: all)')
+    parser.add_argument('--keep-versions', type=int, default=None, help='latest fgts kept per run')
+    parser.add_argument('--keep-days', type=int, default=None, help='fgts newer than this are kept')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='rows deleted per transaction')
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds between the delete chunks')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    if args.keep_versions is None and args.keep_days is None:
+        parser.error("give --keep-versions and/or --keep-days")
+
+    connection = get_connection()
+    try:
+        start = time.time()
+        report = apply_retention(connection, sim_tags=args.sim_tags.split(',') if args.sim_tags else None,
+                                 keep_versions=args.keep_versions, keep_days=args.keep_days,
+                                 chunk_size=args.chunk_size, pause=args.pause, dry_run=args.dry_run)
+        report['seconds'] = time.time() - start
+
+        logger.info("Retention {}: {}".format("dry run" if args.dry_run else "done", report))
+        print("{} {} fgts of {} runs ({} rows) and {} partitions, ~{:.1f} MB reclaimed".format(
+            "Would purge" if args.dry_run else "Purged", report['fgts'], report['runs'], report['rows'],
+            len(report['partitions']), report['bytes'] / 1024.0 / 1024.0))
+    finally:
+        connection.close()
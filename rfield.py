@@ -0,0 +1,87 @@
+import os
+import traceback
+
+import numpy as np
+
+from db_adapter.logger import logger
+
+SRI_LANKA_EXTENT = [79.5213, 5.91948, 81.879, 9.83506]
+
+KELANI_BASIN_EXTENT = [79.6, 6.6, 81.0, 7.4]
+
+# rfield region name -> [lon_min, lat_min, lon_max, lat_max]
+RFIELD_REGIONS = {
+    'kelani_basin': KELANI_BASIN_EXTENT,
+    'd03': SRI_LANKA_EXTENT
+}
+
+
+def get_rfield_file_path(rfield_dir, region, source_name, version, sim_tag, timestamp):
+    """
+    :param rfield_dir: e.g.: /var/www/html/wrf/rfield
+    :param region: e.g.: kelani_basin
+    :param source_name: e.g.: WRF_A
+    :param version: e.g.: v4.0
+    :param sim_tag: e.g.: "evening_18hrs"
+    :param timestamp: e.g.: 2019-07-30 05:45:00
+    :return: e.g.: /var/www/html/wrf/rfield/v4.0/evening_18hrs/kelani_basin/WRF_A_2019-07-30_05-45_rfield.txt
+    """
+    return os.path.join(rfield_dir, version, sim_tag, region,
+                        '{}_{}_rfield.txt'.format(source_name, timestamp[:16].replace(' ', '_').replace(':', '-')))
+
+
+def write_rfield_file(file_path, coordinates, values):
+    """
+    Write one rfield file, a "lon lat value" line per grid cell
+    :param file_path:
+    :param coordinates: list of "lon lat" strings
+    :param values: precipitation values in the same order as coordinates
+    :return:
+    """
+    with open(file_path, 'w') as f:
+        f.write('\n'.join(['{} {:.3f}'.format(coordinate, value) for coordinate, value in zip(coordinates, values)]))
+
+
+def gen_rfields(grid, source_name, version, sim_tag, region, rfield_dir):
+    """
+    Generate the rfield files of a region directly from a decoded WRF grid, one file per timestep.
+    Written on the calling (scheduler) thread: the files are small and the coordinates are built once, instead of
+    being pickled into a pool task per timestep and queued behind the ingestion jobs.
+    :param grid: decoded grid (see decode_rainnc_file in wrf_data_pusher)
+    :param source_name: e.g.: WRF_A
+    :param version: e.g.: v4.0
+    :param sim_tag: e.g.: "evening_18hrs"
+    :param region: key of RFIELD_REGIONS, e.g.: kelani_basin
+    :param rfield_dir: root directory of the rfield files
+    :return: True if successful, False otherwise
+    """
+    try:
+        lon_min, lat_min, lon_max, lat_max = RFIELD_REGIONS[region]
+
+        lats = grid['lats']
+        lons = grid['lons']
+
+        lat_inds = np.where((lats >= lat_min) & (lats <= lat_max))[0]
+        lon_inds = np.where((lons >= lon_min) & (lons <= lon_max))[0]
+
+        # lon varies fastest, matching the row order of the station grid
+        coordinates = ['%.6f %.6f' % (lons[x], lats[y]) for y in lat_inds for x in lon_inds]
+
+        values = grid['diff'][:, lat_inds, :][:, :, lon_inds]
+        values = values.reshape(values.shape[0], -1)
+
+        output_dir = os.path.dirname(get_rfield_file_path(rfield_dir, region, source_name, version, sim_tag,
+                                                          grid['timestamps'][0]))
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        logger.info("Generate {} {} rfield files.".format(source_name, region))
+
+        for i, timestamp in enumerate(grid['timestamps']):
+            write_rfield_file(get_rfield_file_path(rfield_dir, region, source_name, version, sim_tag, timestamp),
+                              coordinates, values[i].tolist())
+        return True
+    except Exception:
+        logger.error("{} {} rfield generation failed.".format(source_name, region))
+        traceback.print_exc()
+        return False
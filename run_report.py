@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from db_adapter.constants import COMMON_DATE_TIME_FORMAT
+from db_adapter.logger import logger
+
+# queue the events of this process are sent to, set in the parent and in each pool worker (see init_run_report)
+report_queue = None
+
+# wrf system, date etc. the events of this process belong to
+report_context = {}
+
+
+def init_run_report(queue):
+    """
+    Pool initializer, makes the worker send its events to the parent's collector
+    :param queue: multiprocessing queue of the RunReportCollector
+    """
+    global report_queue
+    report_queue = queue
+    report_context.clear()
+
+
+def set_report_context(**context):
+    """
+    Tag the following events of this process, e.g.: set_report_context(wrf_system='A', date='2019-07-30')
+    """
+    report_context.clear()
+    report_context.update(context)
+
+
+def _send(event, context=None):
+    event['time'] = datetime.now().strftime(COMMON_DATE_TIME_FORMAT)
+    event['pid'] = os.getpid()
+    event['context'] = dict(report_context) if context is None else dict(context)
+
+    if report_queue is None:
+        return
+    try:
+        report_queue.put(event)
+    except Exception:
+        logger.warning("Could not send run report event {}".format(event))
+
+
+def report_error(msg):
+    """
+    Record an error for the run report and the email summary (the message is expected to be logged by the caller)
+    :param msg:
+    """
+    _send({'type': 'error', 'message': msg})
+
+
+def report_timing(stage, seconds, count=1, max_seconds=None, context=None):
+    """
+    :param stage: e.g.: decode_netcdf
+    :param seconds: total duration of the stage
+    :param count: number of times the stage ran in that duration
+    :param max_seconds: longest single run, seconds / count if not given
+    :param context: overrides the context set with set_report_context
+    """
+    if max_seconds is None:
+        max_seconds = seconds / count if count else seconds
+    _send({'type': 'timing', 'stage': stage, 'seconds': seconds, 'count': count, 'max_seconds': max_seconds},
+          context=context)
+
+
+def report_count(name, value=1, context=None):
+    """
+    :param name: e.g.: rows_written
+    :param value: amount to add
+    :param context: overrides the context set with set_report_context
+    """
+    _send({'type': 'count', 'name': name, 'value': value}, context=context)
+
+
+def _context_key(context):
+    return tuple(sorted(context.items()))
+
+
+def get_context_label(context_key):
+    """
+    :param context_key: key of RunReportCollector.timings / counts
+    :return: e.g.: "date=2019-07-30 wrf_system=A"
+    """
+    return ' '.join(['{}={}'.format(key, value) for key, value in context_key]) or 'run'
+
+
+class RunReportCollector:
+    """
+    Collects the events sent by the parent and the pool workers and aggregates them into the run report.
+    """
+
+    def __init__(self, queue):
+        """
+        :param queue: multiprocessing queue, shared with the workers through init_run_report
+        """
+        self.queue = queue
+        self.started = datetime.now()
+        self.errors = []
+        # context key -> stage -> {'count', 'seconds', 'max_seconds'}
+        self.timings = {}
+        # context key -> name -> value
+        self.counts = {}
+        # guards the collected events, the resident modes read them while the collector runs (see rotate)
+        self.lock = threading.Lock()
+        self.flushed = threading.Condition(self.lock)
+        self.flush_requests = 0
+        self.flushes_done = 0
+        self.thread = threading.Thread(target=self._collect, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop once every event sent so far is collected
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def flush(self, timeout=10):
+        """
+        Wait until the events this process sent so far are collected. Events of the workers still on their way
+        through the queue are collected into the next report.
+        :param timeout: seconds
+        """
+        with self.lock:
+            self.flush_requests += 1
+            flush_id = self.flush_requests
+        self.queue.put({'type': 'flush', 'id': flush_id})
+        with self.flushed:
+            self.flushed.wait_for(lambda: self.flushes_done >= flush_id, timeout=timeout)
+
+    def rotate(self):
+        """
+        Hand over the events collected so far and start over, for the resident modes that never stop
+        :return: RunReportCollector holding the events collected so far (not started)
+        """
+        with self.lock:
+            report = RunReportCollector(self.queue)
+            report.started, report.errors, report.timings, report.counts = \
+                self.started, self.errors, self.timings, self.counts
+            self.started = datetime.now()
+            self.errors = []
+            self.timings = {}
+            self.counts = {}
+        return report
+
+    def _collect(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            try:
+                with self.lock:
+                    self._add(event)
+            except Exception:
+                logger.warning("Invalid run report event {}".format(event))
+
+    def _add(self, event):
+        if event['type'] == 'flush':
+            self.flushes_done = max(self.flushes_done, event['id'])
+            self.flushed.notify_all()
+            return
+
+        context = _context_key(event['context'])
+
+        if event['type'] == 'error':
+            self.errors.append(event)
+        elif event['type'] == 'timing':
+            stage = self.timings.setdefault(context, {}).setdefault(
+                event['stage'], {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stage['count'] += event['count']
+            stage['seconds'] += event['seconds']
+            stage['max_seconds'] = max(stage['max_seconds'], event['max_seconds'])
+        elif event['type'] == 'count':
+            counts = self.counts.setdefault(context, {})
+            counts[event['name']] = counts.get(event['name'], 0) + event['value']
+
+    def email_content(self):
+        """
+        :return: dict of time -> error message, in the format of the former email_content
+        """
+        email_content = {}
+        for error in self.errors:
+            key = error['time']
+            # several errors may share a second
+            duplicate = 1
+            while key in email_content:
+                duplicate += 1
+                key = "{} #{}".format(error['time'], duplicate)
+            email_content[key] = error['message']
+        return email_content
+
+    def to_dict(self):
+        return {
+            'started': self.started.strftime(COMMON_DATE_TIME_FORMAT),
+            'finished': datetime.now().strftime(COMMON_DATE_TIME_FORMAT),
+            'duration_seconds': (datetime.now() - self.started).total_seconds(),
+            'errors': self.errors,
+            'timings': {get_context_label(key): stages for key, stages in self.timings.items()},
+            'counts': {get_context_label(key): counts for key, counts in self.counts.items()}
+        }
+
+    def write_json(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
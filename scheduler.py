@@ -0,0 +1,143 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from db_adapter.logger import logger
+
+
+class PipelineScheduler:
+    """
+    Runs ingestion jobs on a multiprocessing pool and starts the dependent jobs of each ingestion job
+    (e.g.: rfield generation of a wrf system) as soon as it finishes, instead of waiting for the slowest one.
+
+    Dependent jobs run on a bounded thread pool, so they may themselves block on the multiprocessing pool.
+    """
+
+    def __init__(self, mp_pool, max_dependent_jobs=2, keep_results=True):
+        """
+        :param mp_pool: multiprocessing pool the ingestion jobs run on
+        :param max_dependent_jobs: maximum number of dependent jobs running at once
+        :param keep_results: keep the job results for join, False for the resident modes that never join,
+            a job's result is then only handed to its callbacks and dropped
+        """
+        self.mp_pool = mp_pool
+        self.keep_results = keep_results
+        self.executor = ThreadPoolExecutor(max_workers=max_dependent_jobs)
+        self.lock = threading.Lock()
+        self.async_results = {}
+        self.ingestion_results = {}
+        self.dependent_futures = {}
+
+    def _submit_dependents(self, key, result, get_dependent_jobs):
+        try:
+            dependent_jobs = get_dependent_jobs(key, result)
+        except Exception:
+            logger.error("Scheduling the dependent jobs of {} failed.".format(key))
+            traceback.print_exc()
+            return
+
+        with self.lock:
+            for name, func, kwargs in dependent_jobs:
+                logger.info("Start {}".format(name))
+                future = self.executor.submit(func, **kwargs)
+                if self.keep_results:
+                    self.dependent_futures[name] = future
+                else:
+                    future.add_done_callback(lambda future, name=name: self._log_dependent_result(name, future))
+
+    def _log_dependent_result(self, name, future):
+        try:
+            if not future.result():
+                logger.error("{} failed.".format(name))
+        except Exception:
+            logger.error("{} failed.".format(name))
+            traceback.print_exc()
+
+    def _forget(self, key):
+        with self.lock:
+            self.async_results.pop(key, None)
+            self.ingestion_results.pop(key, None)
+
+    def _finish(self, key, result, on_finished):
+        # runs on the pool's result handler thread, an exception would kill it and hang the pool for good
+        if on_finished is not None:
+            try:
+                on_finished(key, result)
+            except Exception:
+                logger.error("Finishing ingestion job {} failed.".format(key))
+                traceback.print_exc()
+        if not self.keep_results:
+            self._forget(key)
+
+    def submit(self, key, func, args, get_dependent_jobs, on_finished=None):
+        """
+        Start an ingestion job without waiting for it
+        :param key: e.g.: A
+        :param func: ingestion function, e.g.: extract_wrf_data
+        :param args: ingestion function arguments
+        :param get_dependent_jobs: called with (key, ingestion result) once the ingestion job finishes, the result
+            is None if it failed, returns a list of (name, func, kwargs) to start right away
+        :param on_finished: optional, called with (key, ingestion result) after the dependent jobs are started
+        :return:
+        """
+
+        def on_done(result):
+            with self.lock:
+                self.ingestion_results[key] = result
+            # runs on the pool's result handler thread, submitting to the executor does not block it
+            self._submit_dependents(key, result, get_dependent_jobs)
+            self._finish(key, result, on_finished)
+
+        def on_error(e):
+            logger.error("Ingestion job {} failed :: {}".format(key, e))
+            with self.lock:
+                self.ingestion_results[key] = None
+            # the dependent jobs may wait for a group of ingestion jobs, they hear of the failed ones too
+            self._submit_dependents(key, None, get_dependent_jobs)
+            self._finish(key, None, on_finished)
+
+        with self.lock:
+            self.async_results[key] = self.mp_pool.apply_async(func, args, callback=on_done, error_callback=on_error)
+
+    def join(self):
+        """
+        Wait for every submitted ingestion job and its dependent jobs, only with keep_results
+        :return: (dict of key -> ingestion result, dict of dependent job name -> dependent job result)
+            failed jobs have None as result
+        """
+        # the callbacks may submit more ingestion jobs (e.g.: the ensemble of a date once its members are in),
+        # wait until none is left
+        while True:
+            with self.lock:
+                async_results = [async_result for async_result in self.async_results.values()
+                                 if not async_result.ready()]
+            if not async_results:
+                break
+            for async_result in async_results:
+                async_result.wait()
+
+        # an ingestion job's callback has run by the time it is ready, so every dependent job is submitted
+        self.executor.shutdown(wait=True)
+
+        dependent_results = {}
+        for name, future in self.dependent_futures.items():
+            try:
+                dependent_results[name] = future.result()
+            except Exception:
+                logger.error("{} failed.".format(name))
+                traceback.print_exc()
+                dependent_results[name] = None
+
+        return dict(self.ingestion_results), dependent_results
+
+    def run(self, ingestion_jobs, get_dependent_jobs, on_finished=None):
+        """
+        :param ingestion_jobs: dict of key -> (func, args), e.g.: {'A': (extract_wrf_data, ('A', config_data, tms_meta))}
+        :param get_dependent_jobs: see submit
+        :param on_finished: see submit
+        :return: see join
+        """
+        for key, (func, args) in ingestion_jobs.items():
+            self.submit(key=key, func=func, args=args, get_dependent_jobs=get_dependent_jobs, on_finished=on_finished)
+
+        return self.join()
@@ -0,0 +1,96 @@
+import json
+import os
+import time
+import traceback
+
+from db_adapter.logger import logger
+
+
+class SpoolDirectory:
+    """
+    Ingestion job queue on the local file system.
+
+    A job is a json file dropped into {spool_dir}/incoming, e.g.:
+        {"wrf_systems": "A,C", "run_date": ["2019-07-30"]}
+    It is claimed by moving it to {spool_dir}/running and ends up in {spool_dir}/done or {spool_dir}/failed.
+    Write job files under another name (e.g.: job.json.tmp) and rename them, so half written jobs are not claimed.
+    """
+
+    def __init__(self, spool_dir):
+        """
+        :param spool_dir: e.g.: /home/uwcc-admin/curw_wrf_data_pusher/spool
+        """
+        self.spool_dir = spool_dir
+        for state in ['incoming', 'running', 'done', 'failed']:
+            state_dir = os.path.join(spool_dir, state)
+            if not os.path.exists(state_dir):
+                os.makedirs(state_dir)
+
+    def claim(self):
+        """
+        :return: list of (job name, job) claimed from the incoming directory, oldest first
+        """
+        incoming_dir = os.path.join(self.spool_dir, 'incoming')
+        job_names = sorted([name for name in os.listdir(incoming_dir) if name.endswith('.json')],
+                           key=lambda name: os.path.getmtime(os.path.join(incoming_dir, name)))
+
+        jobs = []
+        for job_name in job_names:
+            running_path = os.path.join(self.spool_dir, 'running', job_name)
+            try:
+                os.rename(os.path.join(incoming_dir, job_name), running_path)
+            except OSError:
+                # claimed by someone else
+                continue
+
+            try:
+                with open(running_path) as f:
+                    jobs.append((job_name, json.load(f)))
+            except ValueError:
+                logger.error("Invalid spool job {}.".format(job_name))
+                self.finish(job_name, False)
+
+        return jobs
+
+    def finish(self, job_name, success):
+        os.rename(os.path.join(self.spool_dir, 'running', job_name),
+                  os.path.join(self.spool_dir, 'done' if success else 'failed', job_name))
+
+
+def finish_job(spool, job_name, success):
+    """
+    on_finished of a spool job, runs on the pool's result handler thread, so it never raises
+    """
+    try:
+        spool.finish(job_name, success)
+    except Exception:
+        logger.error("Moving spool job {} out of the running directory failed.".format(job_name))
+        traceback.print_exc()
+
+
+def serve(spool, handle_job, poll_interval=5):
+    """
+    Hand every spool job to handle_job, forever
+    :param spool: SpoolDirectory
+    :param handle_job: called with (job name, job, on_finished), on_finished must be called with
+        True/False once the job is over
+    :param poll_interval: seconds between checks of the incoming directory
+    :return: never returns
+    """
+    logger.info("Serving ingestion jobs from {}.".format(spool.spool_dir))
+
+    while True:
+        try:
+            for job_name, job in spool.claim():
+                logger.info("Start spool job {} :: {}".format(job_name, json.dumps(job)))
+                try:
+                    handle_job(job_name, job,
+                               lambda success, job_name=job_name: finish_job(spool, job_name, success))
+                except Exception:
+                    logger.error("Spool job {} failed.".format(job_name))
+                    traceback.print_exc()
+                    finish_job(spool, job_name, False)
+        except Exception:
+            logger.error("Reading the spool directory failed.")
+            traceback.print_exc()
+        time.sleep(poll_interval)
@@ -0,0 +1,94 @@
+import numpy as np
+
+try:
+    # optional, the index falls back to a chunked brute force search without it
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance, vectorized, the arguments broadcast like numpy arrays
+    :param lat1: degrees
+    :param lon1: degrees
+    :param lat2: degrees
+    :param lon2: degrees
+    :return: distance in km
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def to_unit_vectors(lats, lons):
+    """
+    :return: (n, 3) array of points on the unit sphere, where euclidean nearest is great circle nearest
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+
+class StationIndex:
+    """
+    Nearest station lookup, e.g.: new wrf grid points -> old wrf stations
+    """
+
+    def __init__(self, ids, lats, lons, use_kd_tree=True):
+        """
+        :param ids: station ids, in the order of lats and lons
+        :param lats: degrees
+        :param lons: degrees
+        :param use_kd_tree: use a KD tree on the unit vectors when scipy is available
+        """
+        self.ids = np.asarray(ids)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+
+        self.tree = None
+        if use_kd_tree and cKDTree is not None:
+            self.tree = cKDTree(to_unit_vectors(self.lats, self.lons))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def query(self, lats, lons, k=1, chunk_size=1024):
+        """
+        :param lats: degrees, of the points to look up
+        :param lons: degrees
+        :param k: number of nearest stations
+        :param chunk_size: points per distance matrix in the brute force search
+        :return: (ids, distances in km), (n, k) arrays, nearest first
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        k = min(k, len(self.ids))
+
+        if self.tree is not None:
+            chords, indices = self.tree.query(to_unit_vectors(lats, lons), k=k)
+            indices = np.asarray(indices).reshape(len(lats), k)
+            # chord length -> great circle distance, keeps the order
+            distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chords).reshape(len(lats), k) / 2,
+                                                                0.0, 1.0))
+            return self.ids[indices], distances
+
+        indices = np.empty((len(lats), k), dtype=np.int64)
+        distances = np.empty((len(lats), k), dtype=np.float64)
+
+        for start in range(0, len(lats), chunk_size):
+            end = start + chunk_size
+            matrix = haversine_km(lats[start:end, np.newaxis], lons[start:end, np.newaxis],
+                                  self.lats[np.newaxis, :], self.lons[np.newaxis, :])
+            if k < matrix.shape[1]:
+                nearest = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+            else:
+                nearest = np.tile(np.arange(matrix.shape[1]), (matrix.shape[0], 1))
+            nearest_distances = np.take_along_axis(matrix, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1)
+            indices[start:end] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:end] = np.take_along_axis(nearest_distances, order, axis=1)
+
+        return self.ids[indices], distances
@@ -0,0 +1,138 @@
+import csv
+
+from db_adapter.logger import logger
+
+STATION_COLUMNS = ['id', 'name', 'latitude', 'longitude', 'description']
+
+
+def get_wrf_station_name(latitude, longitude):
+    """
+    The station name the pusher looks up: coordinates rounded with '%.6f', trailing zeros dropped
+    e.g.: (5.722969, 79.57592) -> wrf_5.722969_79.57592
+    """
+    return 'wrf_{}_{}'.format(float('%.6f' % float(latitude)), float('%.6f' % float(longitude)))
+
+
+def read_wrf_stations_csv(file_path):
+    """
+    Stream the stations of a wrf_stations.csv
+    :param file_path: csv with the columns id,name,latitude,longitude,description
+    :return: generator of station dicts
+    """
+    with open(file_path, 'r') as f:
+        for row in csv.DictReader(f):
+            yield {column: row[column] for column in STATION_COLUMNS}
+
+
+def validate_wrf_station(station):
+    """
+    :param station: station dict, as read by read_wrf_stations_csv
+    :return: list of problems, empty if the station is consistent with the pusher's '%.6f' naming
+    """
+    problems = []
+    for column in ['latitude', 'longitude']:
+        decimals = station[column].split('.')[1] if '.' in station[column] else ''
+        if len(decimals) > 6:
+            problems.append("{} {} has more than 6 decimals, the pusher rounds it".format(column, station[column]))
+
+    # trailing zeros aside (e.g.: wrf_5.722969_79.575920), the name has to hold the same coordinates
+    expected_name = get_wrf_station_name(station['latitude'], station['longitude'])
+    try:
+        _, latitude, longitude = station['name'].split('_')
+        same_coordinates = get_wrf_station_name(latitude, longitude) == expected_name
+    except ValueError:
+        same_coordinates = False
+    if not same_coordinates:
+        problems.append("name {} does not match the coordinates, expected {}".format(station['name'], expected_name))
+    return problems
+
+
+def get_existing_stations(pool):
+    """
+    :return: (set of station ids, set of station names) in one query
+    """
+    connection = pool.connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT `id`, `name` FROM `station`;")
+            results = cursor.fetchall()
+    finally:
+        connection.close()
+
+    ids = set()
+    names = set()
+    for result in results:
+        station_id, name = (result.get('id'), result.get('name')) if isinstance(result, dict) else result
+        ids.add(int(station_id))
+        names.add(name)
+    return ids, names
+
+
+def insert_stations(pool, stations):
+    """
+    :param stations: list of station dicts
+    """
+    sql_statement = "INSERT INTO `station` (`id`, `name`, `latitude`, `longitude`, `description`) VALUES " + \
+                    ", ".join(["(%s, %s, %s, %s, %s)"] * len(stations))
+
+    connection = pool.connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql_statement, [station[column] for station in stations for column in STATION_COLUMNS])
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def seed_wrf_stations(pool, file_path, batch_size=1000, dry_run=False):
+    """
+    Insert the stations of a wrf_stations.csv that are not in the database yet, safe to rerun.
+    Stations are named as the pusher looks them up, see get_wrf_station_name.
+    :param pool: database connection pool
+    :param file_path: e.g.: wrf_stations.csv
+    :param batch_size: stations per insert statement
+    :param dry_run: only count what would be inserted
+    :return: dict of counts: read, existing, inserted, renamed (csv name differed from the pusher's), invalid
+    """
+    existing_ids, existing_names = get_existing_stations(pool)
+
+    counts = {'read': 0, 'existing': 0, 'inserted': 0, 'renamed': 0, 'invalid': 0}
+    batch = []
+
+    for station in read_wrf_stations_csv(file_path):
+        counts['read'] += 1
+
+        problems = validate_wrf_station(station)
+        if problems:
+            counts['invalid'] += 1
+            logger.warning("Station {}: {}".format(station['id'], ', '.join(problems)))
+
+        name = get_wrf_station_name(station['latitude'], station['longitude'])
+        if name != station['name']:
+            counts['renamed'] += 1
+            station['name'] = name
+
+        if int(station['id']) in existing_ids or name in existing_names:
+            counts['existing'] += 1
+            continue
+
+        existing_ids.add(int(station['id']))
+        existing_names.add(name)
+        batch.append(station)
+
+        if len(batch) == batch_size:
+            if not dry_run:
+                insert_stations(pool, batch)
+            counts['inserted'] += len(batch)
+            batch = []
+
+    if batch:
+        if not dry_run:
+            insert_stations(pool, batch)
+        counts['inserted'] += len(batch)
+
+    logger.info("WRF station seeding{}: {}".format(" (dry run)" if dry_run else "", counts))
+    return counts
@@ -0,0 +1,64 @@
+import os
+
+from backfill import scan_wrf_outputs, plan_backfill
+
+FGTS = {
+    '/wrf/A/2019-07-29/d03_RAINNC.nc': '2019-07-29 23:45:00',
+    '/wrf/A/2019-07-30/d03_RAINNC.nc': '2019-07-30 23:45:00',
+    '/wrf/C/2019-07-29/d03_RAINNC.nc': '2019-07-29 23:50:00',
+    '/wrf/C/2019-07-30/d03_RAINNC.nc': '2019-07-30 23:50:00',
+    '/wrf/E/2019-07-30/d03_RAINNC.nc': '2019-07-30 23:55:00'
+}
+
+OUTPUTS = {(path.split('/')[2], path.split('/')[3]): path for path in FGTS.keys()}
+
+
+def coverage_of(fgt_runs, runs=12):
+    return {'fgts': fgt_runs, 'latest_fgt': max(fgt_runs.keys()) if fgt_runs else None, 'runs': runs}
+
+
+def test_plan_skips_complete_outputs_and_orders_newest_first():
+    coverage = {1: coverage_of({'2019-07-29 23:45:00': 12}),
+                2: coverage_of({'2019-07-29 23:50:00': 12, '2019-07-30 23:50:00': 12})}
+
+    units = plan_backfill(outputs=OUTPUTS, source_ids={'A': 1, 'C': 2, 'E': None}, coverage=coverage,
+                          get_fgt=FGTS.get, get_cell_count=lambda path: 12)
+
+    # E has no source yet, so nothing of it is in the database
+    assert units == [('A', '2019-07-30'), ('E', '2019-07-30')]
+
+
+def test_plan_repairs_partly_pushed_outputs():
+    coverage = {1: coverage_of({'2019-07-29 23:45:00': 12, '2019-07-30 23:45:00': 5})}
+
+    units = plan_backfill(outputs={unit: path for unit, path in OUTPUTS.items() if unit[0] == 'A'},
+                          source_ids={'A': 1}, coverage=coverage, get_fgt=FGTS.get, get_cell_count=lambda path: 12)
+
+    assert units == [('A', '2019-07-30')]
+
+
+def test_plan_falls_back_to_the_run_count_of_the_source():
+    coverage = {1: coverage_of({'2019-07-29 23:45:00': 12, '2019-07-30 23:45:00': 11}, runs=12)}
+
+    units = plan_backfill(outputs={unit: path for unit, path in OUTPUTS.items() if unit[0] == 'A'},
+                          source_ids={'A': 1}, coverage=coverage, get_fgt=FGTS.get)
+
+    assert units == [('A', '2019-07-30')]
+
+
+def test_scan_finds_the_complete_outputs_in_the_date_range(tmp_path):
+    wrf_dir = str(tmp_path)
+    for wrf_system, date in [('A', '2019-07-28'), ('A', '2019-07-29'), ('A', '2019-07-30'), ('C', '2019-07-30')]:
+        output_dir = os.path.join(wrf_dir, '4.0', '18', wrf_system, date)
+        os.makedirs(output_dir)
+        if (wrf_system, date) != ('C', '2019-07-30'):
+            open(os.path.join(output_dir, 'd03_RAINNC.nc'), 'w').close()
+    # not a run date
+    os.makedirs(os.path.join(wrf_dir, '4.0', '18', 'A', 'logs'))
+
+    outputs = scan_wrf_outputs({'wrf_dir': wrf_dir, 'version': '4.0', 'gfs_data_hour': '18',
+                                'wrf_systems': ['A', 'C']}, start_date='2019-07-29')
+
+    assert outputs == {
+        ('A', '2019-07-29'): os.path.join(wrf_dir, '4.0', '18', 'A', '2019-07-29', 'd03_RAINNC.nc'),
+        ('A', '2019-07-30'): os.path.join(wrf_dir, '4.0', '18', 'A', '2019-07-30', 'd03_RAINNC.nc')}
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from ensemble import ENSEMBLE_STATS, build_ensemble_grids
+
+
+def make_grid(value, fgt='2019-07-30 23:45:00', lats=(7.0, 7.1)):
+    return {
+        'fgt': fgt,
+        'lats': np.array(lats),
+        'lons': np.array([80.0]),
+        'timestamps': ['2019-07-31 00:00:00'],
+        'diff': np.full((1, len(lats), 1), value)
+    }
+
+
+def test_stats_over_the_members():
+    grids = build_ensemble_grids({'A': make_grid(1.0, fgt='2019-07-30 23:45:00'),
+                                  'C': make_grid(3.0, fgt='2019-07-31 00:15:00')})
+
+    assert sorted(grids.keys()) == sorted(ENSEMBLE_STATS)
+    assert np.allclose(grids['MEAN']['diff'], 2.0)
+    assert np.allclose(grids['MAX']['diff'], 3.0)
+    assert np.allclose(grids['MIN']['diff'], 1.0)
+    assert np.allclose(grids['SPREAD']['diff'], 1.0)
+    # as recent as its latest member
+    assert grids['MEAN']['fgt'] == '2019-07-31 00:15:00'
+
+
+def test_missing_members_below_min_members_give_no_ensemble():
+    grids = {'A': make_grid(1.0), 'C': make_grid(3.0), 'E': None}
+
+    assert build_ensemble_grids(grids, min_members=3) == {}
+    assert sorted(build_ensemble_grids(grids, min_members=2).keys()) == sorted(ENSEMBLE_STATS)
+
+
+def test_a_single_member_is_never_an_ensemble():
+    assert build_ensemble_grids({'A': make_grid(1.0), 'C': None}, min_members=1) == {}
+
+
+def test_mismatched_grids_raise():
+    with pytest.raises(ValueError):
+        build_ensemble_grids({'A': make_grid(1.0), 'C': make_grid(3.0, lats=(7.0, 7.2))})
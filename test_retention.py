@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from retention import get_expired_fgts
+
+# one fgt a day, 2019-07-25 .. 2019-07-30
+FGTS = [datetime(2019, 7, day, 23, 45) for day in range(25, 31)]
+NOW = datetime(2019, 7, 31, 12, 0)
+
+
+def test_nothing_expires_without_a_policy():
+    assert get_expired_fgts(FGTS, now=NOW) == []
+
+
+def test_keep_versions_keeps_the_latest_fgts():
+    assert get_expired_fgts(list(reversed(FGTS)), keep_versions=2, now=NOW) == FGTS[:4]
+
+
+def test_keep_days_keeps_the_recent_fgts():
+    # cutoff 2019-07-28 12:00
+    assert get_expired_fgts(FGTS, keep_days=3, now=NOW) == FGTS[:3]
+
+
+def test_a_fgt_kept_by_either_policy_is_kept():
+    assert get_expired_fgts(FGTS, keep_versions=4, keep_days=1, now=NOW) == FGTS[:2]
+    assert get_expired_fgts(FGTS, keep_versions=1, keep_days=3, now=NOW) == FGTS[:3]
+
+
+def test_keep_versions_beyond_the_fgts_keeps_everything():
+    assert get_expired_fgts(FGTS, keep_versions=10, now=NOW) == []
@@ -0,0 +1,99 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+from scheduler import PipelineScheduler
+
+
+def ingest(key):
+    if key == 'bad':
+        raise ValueError(key)
+    return {'2019-07-30': key}
+
+
+def test_run_returns_the_ingestion_and_dependent_results():
+    with ThreadPool(2) as pool:
+        scheduler = PipelineScheduler(pool)
+        results, dependent_results = scheduler.run(
+            ingestion_jobs={'A': (ingest, ('A',)), 'C': (ingest, ('C',))},
+            get_dependent_jobs=lambda key, result: [("{} rfield".format(key), lambda grids: list(grids.values()),
+                                                     {'grids': result})])
+
+    assert results == {'A': {'2019-07-30': 'A'}, 'C': {'2019-07-30': 'C'}}
+    assert dependent_results == {'A rfield': ['A'], 'C rfield': ['C']}
+
+
+def test_dependent_jobs_start_before_the_slowest_ingestion_finishes():
+    fast_rfield_started = threading.Event()
+
+    def slow(key):
+        # only returns True if the rfield of the fast job ran while this job was still running
+        return fast_rfield_started.wait(timeout=5)
+
+    with ThreadPool(2) as pool:
+        scheduler = PipelineScheduler(pool)
+        results, _ = scheduler.run(
+            ingestion_jobs={'fast': (ingest, ('fast',)), 'slow': (slow, ('slow',))},
+            get_dependent_jobs=lambda key, result: [("fast rfield", fast_rfield_started.set, {})]
+            if key == 'fast' else [])
+
+    assert results['slow'] is True
+
+
+def test_failed_jobs_reach_the_callbacks_as_none():
+    dependent_calls = []
+    finished_calls = []
+
+    with ThreadPool(2) as pool:
+        scheduler = PipelineScheduler(pool)
+        results, _ = scheduler.run(
+            ingestion_jobs={'A': (ingest, ('A',)), 'bad': (ingest, ('bad',))},
+            get_dependent_jobs=lambda key, result: dependent_calls.append((key, result)) or [],
+            on_finished=lambda key, result: finished_calls.append((key, result)))
+
+    assert results == {'A': {'2019-07-30': 'A'}, 'bad': None}
+    assert sorted(dependent_calls) == [('A', {'2019-07-30': 'A'}), ('bad', None)]
+    assert sorted(finished_calls) == [('A', {'2019-07-30': 'A'}), ('bad', None)]
+
+
+def test_join_waits_for_the_jobs_submitted_by_the_callbacks():
+    with ThreadPool(2) as pool:
+        scheduler = PipelineScheduler(pool)
+
+        def on_finished(key, result):
+            if key == 'A':
+                scheduler.submit(key='ENS', func=ingest, args=('ENS',), get_dependent_jobs=lambda key, result: [])
+
+        results, _ = scheduler.run(ingestion_jobs={'A': (ingest, ('A',))},
+                                   get_dependent_jobs=lambda key, result: [], on_finished=on_finished)
+
+    assert results == {'A': {'2019-07-30': 'A'}, 'ENS': {'2019-07-30': 'ENS'}}
+
+
+def test_a_raising_callback_does_not_hang_the_pool():
+
+    def on_finished(key, result):
+        raise RuntimeError(key)
+
+    with ThreadPool(2) as pool:
+        scheduler = PipelineScheduler(pool)
+        results, _ = scheduler.run(ingestion_jobs={'A': (ingest, ('A',)), 'C': (ingest, ('C',))},
+                                   get_dependent_jobs=lambda key, result: [], on_finished=on_finished)
+
+    assert sorted(results.keys()) == ['A', 'C']
+
+
+def test_results_are_dropped_without_keep_results():
+    finished_calls = []
+
+    pool = ThreadPool(2)
+    scheduler = PipelineScheduler(pool, keep_results=False)
+    for key in ['A', 'C']:
+        scheduler.submit(key=key, func=ingest, args=(key,), get_dependent_jobs=lambda key, result: [],
+                         on_finished=lambda key, result: finished_calls.append(key))
+    pool.close()
+    # also waits for the result handler thread, so every callback has run
+    pool.join()
+
+    assert sorted(finished_calls) == ['A', 'C']
+    assert scheduler.async_results == {}
+    assert scheduler.ingestion_results == {}
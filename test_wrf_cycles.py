@@ -0,0 +1,69 @@
+import pytest
+
+from wrf_cycles import read_cycles, plan_units, SystemCountdown
+
+
+def get_keys(units):
+    return [key for key, cycle, wrf_system, date in units]
+
+
+def test_read_cycles_defaults():
+    assert read_cycles({}) == []
+
+    cycles = read_cycles({'cycles': [{'gfs_data_hour': 18, 'sim_tag': 'evening_18hrs'},
+                                     {'gfs_data_hour': '00', 'domain': 'd01', 'sim_tag': 'dwrf_00hrs_d01',
+                                      'priority': 5, 'system_priorities': {'A': '1'}}]})
+
+    assert cycles == [
+        {'gfs_data_hour': '18', 'domain': 'd03', 'sim_tag': 'evening_18hrs', 'priority': 0, 'system_priorities': {}},
+        {'gfs_data_hour': '00', 'domain': 'd01', 'sim_tag': 'dwrf_00hrs_d01', 'priority': 5,
+         'system_priorities': {'A': 1}}]
+
+
+@pytest.mark.parametrize('entries', [
+    [{'gfs_data_hour': '03', 'sim_tag': 'a'}],
+    [{'gfs_data_hour': '18', 'domain': 'd04', 'sim_tag': 'a'}],
+    [{'gfs_data_hour': '18'}],
+    [{'gfs_data_hour': '18', 'sim_tag': 'a'}, {'gfs_data_hour': '00', 'sim_tag': 'a'}]
+])
+def test_read_cycles_rejects_invalid_cycles(entries):
+    with pytest.raises(ValueError):
+        read_cycles({'cycles': entries})
+
+
+def test_plan_units_by_cycle_priority_then_config_order():
+    cycles = read_cycles({'cycles': [{'gfs_data_hour': '18', 'sim_tag': 'evening_18hrs', 'priority': 1},
+                                     {'gfs_data_hour': '00', 'sim_tag': 'dwrf_00hrs', 'priority': 0}]})
+
+    assert get_keys(plan_units(cycles, ['A', 'C'], ['2019-07-30', '2019-07-29'])) == [
+        '00_d03_A_2019-07-30', '00_d03_C_2019-07-30', '00_d03_A_2019-07-29', '00_d03_C_2019-07-29',
+        '18_d03_A_2019-07-30', '18_d03_C_2019-07-30', '18_d03_A_2019-07-29', '18_d03_C_2019-07-29']
+
+
+def test_system_priorities_interleave_the_cycles():
+    cycles = read_cycles({'cycles': [
+        {'gfs_data_hour': '18', 'sim_tag': 'evening_18hrs', 'system_priorities': {'C': 3}},
+        {'gfs_data_hour': '00', 'sim_tag': 'dwrf_00hrs', 'priority': 1, 'system_priorities': {'A': -1}},
+        {'gfs_data_hour': '18', 'domain': 'd01', 'sim_tag': 'evening_18hrs_d01', 'priority': 2}]})
+
+    assert get_keys(plan_units(cycles, ['A', 'C'], ['2019-07-30'])) == [
+        '18_d03_A_2019-07-30', '00_d03_A_2019-07-30', '00_d03_C_2019-07-30', '18_d01_A_2019-07-30',
+        '18_d01_C_2019-07-30', '18_d03_C_2019-07-30']
+
+
+def test_system_countdown_waits_for_the_last_unit_of_a_system():
+    cycles = read_cycles({'cycles': [{'gfs_data_hour': '18', 'sim_tag': 'evening_18hrs'},
+                                     {'gfs_data_hour': '00', 'sim_tag': 'dwrf_00hrs'}]})
+    countdown = SystemCountdown(plan_units(cycles, ['A', 'C'], ['2019-07-30', '2019-07-29']))
+
+    assert countdown.finish('18_d03_A_2019-07-30', True) is None
+    assert countdown.finish('18_d03_A_2019-07-29', False) is None
+    assert countdown.finish('00_d03_A_2019-07-30', True) is None
+    assert countdown.finish('00_d03_C_2019-07-30', False) is None
+    assert countdown.finish('00_d03_A_2019-07-29', True) == {'evening_18hrs': ['2019-07-30'],
+                                                             'dwrf_00hrs': ['2019-07-30', '2019-07-29']}
+
+    for key in ['18_d03_C_2019-07-30', '18_d03_C_2019-07-29']:
+        assert countdown.finish(key, False) is None
+    # every unit of C failed
+    assert countdown.finish('00_d03_C_2019-07-29', False) == {}
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from wrf_layouts import get_rain_files
+
+
+def test_v4_layout_per_domain():
+    assert get_rain_files('v4', '/wrf_nfs/wrf', '4.0', '18', 'A', '2019-07-30', domain='d01') == {
+        'RAINNC': os.path.join('/wrf_nfs/wrf', '4.0', '18', 'A', '2019-07-30', 'd01_RAINNC.nc')}
+
+
+def test_v3_layout_has_a_file_per_rain_variable():
+    rain_files = get_rain_files('v3', '/mnt/disks/wrf-mod', '3.0', '18', 'A', '2019-03-23',
+                                rain_variables=['RAINC', 'RAINNC'])
+
+    assert rain_files == {
+        'RAINC': os.path.join('/mnt/disks/wrf-mod', 'STATIONS_2019-03-23', 'RAINC_2019-03-23_A.nc'),
+        'RAINNC': os.path.join('/mnt/disks/wrf-mod', 'STATIONS_2019-03-23', 'RAINNC_2019-03-23_A.nc')}
+
+
+def test_rain_variables_without_a_file_of_their_own_are_read_from_the_rainnc_file():
+    rain_files = get_rain_files('v3_d03', '/mnt/disks/wrf-mod', '3.0', '18', 'C', '2019-03-23',
+                                rain_variables=['RAINC', 'RAINNC'])
+
+    rainnc_file = os.path.join('/mnt/disks/wrf-mod', 'STATIONS_2019-03-23', 'd03_RAINNC_2019-03-23_C.nc')
+    assert rain_files == {'RAINC': rainnc_file, 'RAINNC': rainnc_file}
+
+
+def test_unknown_layout_raises():
+    with pytest.raises(ValueError):
+        get_rain_files('v5', '/wrf_nfs/wrf', '4.0', '18', 'A', '2019-07-30')
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from db_adapter.logger import logger
+
+try:
+    # inotify only sees local writes, NFS mounts fall back to polling
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+
+class WrfOutputWatcher:
+    """
+    Watches /wrf_nfs/wrf/{version}/{gfs_hour}/{system}/{date}/d03_RAINNC.nc and dispatches ingestion of a
+    wrf system's output as soon as the file is complete.
+
+    A file is complete once the marker file next to it exists, or, without a marker file, once its size and
+    modified time stay unchanged for stable_secs. Each (system, date, file version) is dispatched until it is
+    ingested, and never while a previous ingestion of the same (system, date) is still running.
+    """
+
+    def __init__(self, wrf_dir, version, gfs_data_hour, wrf_systems, dispatch, rainnc_net_cdf_file='d03_RAINNC.nc',
+                 marker_file=None, stable_secs=60, poll_interval=30, use_inotify=True):
+        """
+        :param wrf_dir: e.g.: /wrf_nfs/wrf
+        :param version: e.g.: 4.0
+        :param gfs_data_hour: e.g.: 18
+        :param wrf_systems: list of wrf systems, e.g.: ['A', 'C', 'E', 'SE']
+        :param dispatch: called with (wrf_system, date, on_finished) to start the ingestion,
+            on_finished must be called with True/False once the ingestion is over, a failed
+            (system, date) is dispatched again on the next scan
+        :param rainnc_net_cdf_file:
+        :param marker_file: optional, e.g.: d03_RAINNC.done
+        :param stable_secs: seconds the file has to stay unchanged to be considered complete
+        :param poll_interval: seconds between scans
+        :param use_inotify: wake up on local file events when inotify_simple is available
+        """
+        self.wrf_dir = wrf_dir
+        self.version = version
+        self.gfs_data_hour = gfs_data_hour
+        self.wrf_systems = wrf_systems
+        self.dispatch = dispatch
+        self.rainnc_net_cdf_file = rainnc_net_cdf_file
+        self.marker_file = marker_file
+        self.stable_secs = stable_secs
+        self.poll_interval = poll_interval
+
+        self.lock = threading.Lock()
+        # (system, date) -> (size, mtime, first seen with that size and mtime)
+        self.observations = {}
+        # (system, date) -> (size, mtime) of the dispatched file
+        self.dispatched = {}
+        self.running = set()
+
+        self.inotify = None
+        self.watched_dirs = set()
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+
+    def get_output_dir(self, wrf_system, date):
+        #     /wrf_nfs/wrf/4.0/18/A/2019-07-30
+        return os.path.join(self.wrf_dir, self.version, self.gfs_data_hour, wrf_system, date)
+
+    def _watch(self, directory):
+        if self.inotify is None or directory in self.watched_dirs or not os.path.isdir(directory):
+            return
+        try:
+            self.inotify.add_watch(directory, inotify_flags.CREATE | inotify_flags.CLOSE_WRITE |
+                                   inotify_flags.MOVED_TO)
+            self.watched_dirs.add(directory)
+        except OSError:
+            logger.warning("Cannot watch {}, polling it instead.".format(directory))
+
+    def is_complete(self, wrf_system, date, now):
+        """
+        :return: (size, mtime) of the output file if it is complete, None otherwise
+        """
+        output_dir = self.get_output_dir(wrf_system, date)
+        rainnc_net_cdf_file_path = os.path.join(output_dir, self.rainnc_net_cdf_file)
+
+        try:
+            stat = os.stat(rainnc_net_cdf_file_path)
+        except OSError:
+            return None
+
+        version = (stat.st_size, stat.st_mtime)
+
+        if self.marker_file is not None:
+            return version if os.path.exists(os.path.join(output_dir, self.marker_file)) else None
+
+        observation = self.observations.get((wrf_system, date))
+        if observation is None or observation[:2] != version:
+            self.observations[(wrf_system, date)] = version + (now,)
+            return None
+
+        return version if now - observation[2] >= self.stable_secs else None
+
+    def _on_finished(self, key, success=True):
+        with self.lock:
+            self.running.discard(key)
+            if not success:
+                # e.g.: the database was down, retry on the next scan instead of waiting for a new file version
+                self.dispatched.pop(key, None)
+
+    def scan(self, dates):
+        """
+        Check every (system, date) once and dispatch the newly completed ones
+        :param dates: list of dates, e.g.: ['2019-07-30']
+        :return: list of dispatched (system, date)
+        """
+        now = time.time()
+        dispatched = []
+
+        for wrf_system in self.wrf_systems:
+            self._watch(os.path.join(self.wrf_dir, self.version, self.gfs_data_hour, wrf_system))
+            for date in dates:
+                self._watch(self.get_output_dir(wrf_system, date))
+
+                key = (wrf_system, date)
+                version = self.is_complete(wrf_system, date, now)
+
+                with self.lock:
+                    if version is None or key in self.running or self.dispatched.get(key) == version:
+                        continue
+                    self.running.add(key)
+                    self.dispatched[key] = version
+
+                logger.info("{} output for {} is complete, dispatching ingestion.".format(wrf_system, date))
+                try:
+                    self.dispatch(wrf_system, date, lambda success, key=key: self._on_finished(key, success))
+                    dispatched.append(key)
+                except Exception:
+                    logger.error("Dispatching ingestion of {} for {} failed.".format(wrf_system, date))
+                    traceback.print_exc()
+                    with self.lock:
+                        self.running.discard(key)
+                        self.dispatched.pop(key, None)
+
+        return dispatched
+
+    def wait(self):
+        """
+        Sleep until the next scan, waking up early on local file events
+        """
+        if self.inotify is None:
+            time.sleep(self.poll_interval)
+            return
+
+        if self.inotify.read(timeout=self.poll_interval * 1000):
+            # let the writer finish before the stability check
+            time.sleep(1)
+
+    def run(self, get_dates):
+        """
+        Watch forever
+        :param get_dates: called before every scan, returns the dates to watch
+        :return:
+        """
+        logger.info("Watching {} outputs of {} ({}).".format(self.rainnc_net_cdf_file, self.wrf_systems,
+                                                            'inotify' if self.inotify is not None else 'polling'))
+        while True:
+            try:
+                self.scan(get_dates())
+            except Exception:
+                logger.error("Scanning the wrf outputs failed.")
+                traceback.print_exc()
+            self.wait()
+
+
+def get_recent_dates(days=2):
+    """
+    :return: today's date and the previous days (local time), newest first, e.g.: ['2019-07-30', '2019-07-29']
+    """
+    today = datetime.now() + timedelta(hours=5, minutes=30)
+    return [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
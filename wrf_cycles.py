@@ -0,0 +1,122 @@
+from db_adapter.logger import logger
+
+GFS_CYCLES = ['00', '06', '12', '18']
+DOMAINS = ['d01', 'd02', 'd03']
+
+
+def read_cycles(config):
+    """
+    Cycles of config.json, each a gfs data hour and domain pushed under a sim tag of its own, e.g.:
+        "cycles": [
+            {"gfs_data_hour": "18", "domain": "d03", "sim_tag": "evening_18hrs"},
+            {"gfs_data_hour": "00", "domain": "d03", "sim_tag": "dwrf_00hrs", "priority": 1,
+             "system_priorities": {"A": 0, "C": 2}},
+            {"gfs_data_hour": "18", "domain": "d01", "sim_tag": "evening_18hrs_d01", "priority": 2}
+        ]
+    A unit's priority is its cycle's priority plus the priority of its wrf system in system_priorities (0 if not
+    listed), so e.g. the A units of a later cycle can go ahead of the C units of an earlier one.
+    :param config: loaded config.json
+    :return: list of cycle dicts (gfs_data_hour, domain, sim_tag, priority, system_priorities), empty if "cycles"
+        is not set
+    """
+    if 'cycles' not in config or (config['cycles'] == ""):
+        return []
+
+    cycles = []
+    for index, entry in enumerate(config['cycles']):
+        cycle = {
+            'gfs_data_hour': str(entry.get('gfs_data_hour', '')),
+            'domain': entry.get('domain', 'd03'),
+            'sim_tag': entry.get('sim_tag', ''),
+            # lower goes first, config order by default
+            'priority': int(entry.get('priority', index)),
+            'system_priorities': dict([(wrf_system, int(priority)) for wrf_system, priority in
+                                       entry.get('system_priorities', {}).items()])
+        }
+        if cycle['gfs_data_hour'] not in GFS_CYCLES:
+            raise ValueError("Unknown gfs_data_hour {} in cycle {}, expected one of {}".format(
+                cycle['gfs_data_hour'], index, GFS_CYCLES))
+        if cycle['domain'] not in DOMAINS:
+            raise ValueError("Unknown domain {} in cycle {}, expected one of {}".format(cycle['domain'], index, DOMAINS))
+        if cycle['sim_tag'] == "":
+            raise ValueError("sim_tag not specified in cycle {}".format(index))
+        cycles.append(cycle)
+
+    # the timeseries ids are hashed from the sim tag and the coordinates, grids of two domains under the same
+    # sim tag would overwrite each other where they overlap
+    sim_tags = [cycle['sim_tag'] for cycle in cycles]
+    duplicates = sorted(set([sim_tag for sim_tag in sim_tags if sim_tags.count(sim_tag) > 1]))
+    if duplicates:
+        raise ValueError("Each cycle needs a sim_tag of its own, {} used more than once".format(duplicates))
+
+    return cycles
+
+
+def get_unit_key(cycle, wrf_system, date):
+    """
+    e.g.: 18_d03_A_2019-07-30
+    """
+    return "{}_{}_{}_{}".format(cycle['gfs_data_hour'], cycle['domain'], wrf_system, date)
+
+
+def get_unit_priority(cycle, wrf_system):
+    """
+    :return: priority of the cycle's unit of a wrf system, lower goes first
+    """
+    return cycle['priority'] + cycle.get('system_priorities', {}).get(wrf_system, 0)
+
+
+def plan_units(cycles, wrf_systems, dates):
+    """
+    :param cycles: as returned by read_cycles
+    :param wrf_systems: e.g.: ['A', 'C']
+    :param dates: e.g.: ['2019-07-30']
+    :return: list of (key, cycle, wrf system, date), by unit priority, then in config order of cycles, dates and
+        systems
+    """
+    units = []
+    for position, cycle in enumerate(cycles):
+        for date_index, date in enumerate(dates):
+            for system_index, wrf_system in enumerate(wrf_systems):
+                units.append(((get_unit_priority(cycle, wrf_system), position, date_index, system_index),
+                              (get_unit_key(cycle, wrf_system, date), cycle, wrf_system, date)))
+
+    units.sort(key=lambda unit: unit[0])
+
+    logger.info("{} ingestion units over {} cycles: {}".format(
+        len(units), len(cycles), ", ".join(["{}_{} ({})".format(cycle['gfs_data_hour'], cycle['domain'],
+                                                                cycle['sim_tag']) for cycle in cycles])))
+    return [unit for _, unit in units]
+
+
+class SystemCountdown:
+    """
+    Counts down the units of each wrf system as they finish, for the jobs that need every date and cycle of a
+    system in the database first (e.g.: the rfield scripts, which read it)
+    """
+
+    def __init__(self, units):
+        """
+        :param units: as returned by plan_units
+        """
+        self.units = dict([(key, (cycle, wrf_system, date)) for key, cycle, wrf_system, date in units])
+        self.unfinished = {}
+        for key, (cycle, wrf_system, date) in self.units.items():
+            self.unfinished.setdefault(wrf_system, set()).add(key)
+        # wrf system -> sim_tag -> ingested dates
+        self.ingested = {}
+
+    def finish(self, key, ingested):
+        """
+        :param key: unit key, as planned
+        :param ingested: True if the unit was pushed
+        :return: dict of sim_tag -> ingested dates of the unit's wrf system once its last unit finished, {} if
+            none of its units was pushed, None while it has unfinished units
+        """
+        cycle, wrf_system, date = self.units[key]
+        self.unfinished[wrf_system].discard(key)
+        if ingested:
+            self.ingested.setdefault(wrf_system, {}).setdefault(cycle['sim_tag'], []).append(date)
+        if self.unfinished[wrf_system]:
+            return None
+        return self.ingested.pop(wrf_system, {})
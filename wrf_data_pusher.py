@@ -5,9 +5,10 @@ import os
 import json
 from datetime import datetime, timedelta
 import time
-import paramiko
 import multiprocessing as mp
 import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from db_adapter.base import get_Pool, destroy_Pool
 
@@ -16,7 +17,6 @@ from db_adapter.curw_fcst.variable import get_variable_id, add_variable
 from db_adapter.curw_fcst.unit import get_unit_id, add_unit, UnitType
 from db_adapter.curw_fcst.station import StationEnum, get_station_id, add_station, get_wrf_stations
 from db_adapter.curw_fcst.timeseries import Timeseries
-from db_adapter.constants import COMMON_DATE_TIME_FORMAT
 from db_adapter.constants import (
     CURW_FCST_DATABASE, CURW_FCST_PASSWORD, CURW_FCST_USERNAME, CURW_FCST_PORT,
     CURW_FCST_HOST,
@@ -24,11 +24,29 @@ from db_adapter.constants import (
 
 from db_adapter.logger import logger
 
-SRI_LANKA_EXTENT = [79.5213, 5.91948, 81.879, 9.83506]
-
-wrf_v3_stations = { }
-
-email_content = {}
+from ensemble import ENSEMBLE_STATS, build_ensemble_grids
+from rfield import RFIELD_REGIONS, gen_rfields
+from scheduler import PipelineScheduler
+from remote import get_session_pool, close_session_pools
+from watcher import WrfOutputWatcher, get_recent_dates
+from metadata_cache import MetadataCache
+from service import SpoolDirectory, serve
+from run_report import RunReportCollector, init_run_report, set_report_context, report_error, report_timing, \
+    report_count
+from instrumentation import enable_instrumentation, stage_timer, timed, flush_instrumentation, \
+    write_prometheus_textfile
+from db_tracer import TracedPool, install_db_tracer, flush_db_trace, log_db_trace_summary
+from profiler import enable_profiling, profile_unit, write_profile_summary
+from log_queue import start_log_listener, init_worker_logging, stop_log_listener
+from wrf_layouts import PATH_LAYOUTS, get_rain_files
+from wrf_cycles import read_cycles, plan_units, SystemCountdown
+from backfill import scan_wrf_outputs, get_source_coverage, plan_backfill
+
+# station/source/variable/unit meta data, reloaded once metadata_ttl expires
+metadata_cache = MetadataCache()
+
+# grid cells written per round trip of push_cells
+PUSH_BATCH_CELLS = 100
 
 
 def read_attribute_from_config_file(attribute, config):
@@ -43,7 +61,7 @@ def read_attribute_from_config_file(attribute, config):
     else:
         msg = "{} not specified in config file.".format(attribute)
         logger.error(msg)
-        email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = msg
+        report_error(msg)
         sys.exit(1)
 
 
@@ -63,36 +81,24 @@ def datetime_utc_to_lk(timestamp_utc, shift_mins=0):
     return timestamp_utc + timedelta(hours=5, minutes=30 + shift_mins)
 
 
-def ssh_command(ssh, command):
-    ssh.invoke_shell()
-    stdin, stdout, stderr = ssh.exec_command(command)
-    if stdout.channel.recv_exit_status() is not 0:
-        return False
-    return True
-    # for line in stdout.readlines():
-    #     logger.info(line)
-    # for line in stderr.readlines():
-    #     logger.error(line)
-
-
-def run_remote_command(host, user, key, command):
+def run_remote_command(host, user, key, command, **session_params):
     """
-    :return:  True if successful, False otherwise
+    Run a command over the shared ssh connection(s) of the host(s)
+    :param host: host name, or comma separated host names to fan out to
+    :param session_params: optional port and client_factory of the session pool (see remote.get_session_pool)
+    :return:  True if successful on every host, False otherwise
     """
+    hosts = host.split(',')
 
-    try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(hostname=host, username=user, key_filename=key)
+    results = get_session_pool(user=user, key=key, **session_params).run_on_hosts(hosts=hosts, command=command)
 
-        return ssh_command(ssh, command)
-    except Exception as e:
-        msg = "Connection failed :: {} :: {}".format(host, command.split('2>&1')[0])
-        logger.error(msg)
-        email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)]=msg
-        return False
-    finally:
-        ssh.close()
+    for _host, result in results.items():
+        if not result:
+            msg = "Remote command failed :: {} :: {}".format(_host, command.split('2>&1')[0])
+            logger.error(msg)
+            report_error(msg)
+
+    return all(results.values())
 
 
 def gen_kelani_basin_rfields(source_names, version, sim_tag, rfield_host, rfield_key, rfield_user):
@@ -100,7 +106,7 @@ def gen_kelani_basin_rfields(source_names, version, sim_tag, rfield_host, rfield
     Generate kelani basin rfields
     :param source_names: e.g.: WRF_A,WRF_C
     :param version: e.g.: v4.0
-    :param rfield_host:
+    :param rfield_host: e.g.: 10.138.0.4 or 10.138.0.4,10.138.0.6
     :param sim_tag: e.g.: "evening_18hrs"
     :param rfield_key:
     :param rfield_user:
@@ -120,7 +126,7 @@ def gen_all_d03_rfields(source_names, version, sim_tag, rfield_host, rfield_key,
        :param source_names: e.g.: WRF_A,WRF_C
        :param version: e.g.: v4.0
        :param sim_tag: e.g.: "evening_18hrs"
-       :param rfield_host:
+       :param rfield_host: e.g.: 10.138.0.4 or 10.138.0.4,10.138.0.6
        :param rfield_key:
        :param rfield_user:
        :return:  True if successful, False otherwise
@@ -170,176 +176,740 @@ def gen_all_d03_rfields_locally(source_names, version, sim_tag):
     return True
 
 
-def push_rainfall_to_db(ts, ts_data, tms_id, fgt):
+def get_existing_run_ids(pool, tms_ids):
+    """
+    :param tms_ids: list of timeseries ids
+    :return: set of the ids that already have a run, in one query
     """
+    connection = pool.connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT `id` FROM `run` WHERE `id` IN ({});".format(", ".join(["%s"] * len(tms_ids))),
+                           list(tms_ids))
+            return set([row['id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()])
+    finally:
+        connection.close()
 
+
+def update_latest_fgts(pool, tms_ids, fgt):
+    """
+    Widen the start and end dates of several runs to cover the fgt, in one statement. Only ever moves the end
+    date forward and the start date back, so outputs may be pushed in any order (e.g.: backfill, newest first).
+    :param tms_ids: list of timeseries ids
+    :param fgt: e.g.: 2019-07-30 23:45:00
+    """
+    connection = pool.connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE `run` SET `end_date`=GREATEST(COALESCE(`end_date`, %s), %s), "
+                           "`start_date`=LEAST(COALESCE(`start_date`, %s), %s) WHERE `id` IN ({});".format(
+                               ", ".join(["%s"] * len(tms_ids))), [fgt, fgt, fgt, fgt] + list(tms_ids))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def push_rainfall_to_db(pool, ts, ts_data, tms_ids, fgt):
+    """
+    Upsert the timeseries of a batch of grid cells and widen their runs' start and end dates to the fgt
+    :param pool: database connection pool
     :param ts: timeseries class instance
-    :param ts_data: timeseries
-    :return:
+    :param ts_data: rows of every cell of the batch, [tms_id, time, fgt, value]
+    :param tms_ids: tms ids of the cells
+    :param fgt:
+    :return: True if successful, False otherwise
     """
 
     try:
-        ts.insert_formatted_data(ts_data, True)  # upsert True
-        ts.update_latest_fgt(id_=tms_id, fgt=fgt)
+        with stage_timer('insert_data'):
+            # one executemany across the cells, pymysql packs it into multi VALUES statements
+            ts.insert_formatted_data(ts_data, True)  # upsert True
+        with stage_timer('update_fgt'):
+            update_latest_fgts(pool, tms_ids, fgt)
         return True
     except Exception:
-        msg = "Inserting the timseseries for tms_id {} and fgt {} failed.".format(ts_data[0][0], ts_data[0][2])
+        msg = "Inserting the timseseries of {} cells ({} .. {}) for fgt {} failed.".format(
+            len(tms_ids), tms_ids[0], tms_ids[-1], fgt)
         logger.error(msg)
         traceback.print_exc()
-        email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = msg
+        report_error(msg)
         return False
 
 
-def read_netcdf_file(pool, rainnc_net_cdf_file_path, tms_meta):
+def decode_rainnc_file(rainnc_net_cdf_file_path, rain_files=None, timestamp_offset=1):
     """
-
-    :param pool: database connection pool
-    :param rainnc_net_cdf_file_path:
-    :param source_id:
-    :param variable_id:
-    :param unit_id:
-    :param tms_meta:
-    :return:
+    Decode a RAINNC netcdf file into the per time slot precipitation grid
+    :param rainnc_net_cdf_file_path: file with XLAT, XLONG, XTIME and RAINNC
+    :param rain_files: dict of variable -> netcdf file path of the variables summed into the precipitation,
+        e.g.: {'RAINC': .../RAINC_2019-03-23_A.nc, 'RAINNC': .../RAINNC_2019-03-23_A.nc}, only RAINNC if None
+    :param timestamp_offset: 1 if time slot i ends at times[i + 1] (v4), 0 if it is stamped times[i] (v3)
+    :return: dict with keys fgt, lats, lons, timestamps and diff
+        (diff is a (timestep, lat, lon) array of per time slot precipitation,
+        timestamps are the matching local time strings)
 
     rainc_unit_info:  mm
     lat_unit_info:  degree_north
     time_unit_info:  minutes since 2019-04-02T18:00:00
     """
-    if not os.path.exists(rainnc_net_cdf_file_path):
-        msg = 'no rainnc netcdf :: {}'.format(rainnc_net_cdf_file_path)
-        logger.warning(msg)
-        email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = msg
-        return False
-    else:
+    fgt = get_file_last_modified_time(rainnc_net_cdf_file_path)
 
-        try:
-            """
-            RAINNC netcdf data extraction
-    
-            """
-            fgt = get_file_last_modified_time(rainnc_net_cdf_file_path)
+    with stage_timer('open_file'):
+        nnc_fid = Dataset(rainnc_net_cdf_file_path, mode='r')
 
-            nnc_fid = Dataset(rainnc_net_cdf_file_path, mode='r')
+    time_unit_info = nnc_fid.variables['XTIME'].units
 
-            time_unit_info = nnc_fid.variables['XTIME'].units
+    time_unit_info_list = time_unit_info.split(' ')
 
-            time_unit_info_list = time_unit_info.split(' ')
+    lats = nnc_fid.variables['XLAT'][0, :, 0]
+    lons = nnc_fid.variables['XLONG'][0, 0, :]
 
-            lats = nnc_fid.variables['XLAT'][0, :, 0]
-            lons = nnc_fid.variables['XLONG'][0, 0, :]
+    lon_min = lons[0].item()
+    lat_min = lats[0].item()
+    lon_max = lons[-1].item()
+    lat_max = lats[-1].item()
 
-            lon_min = lons[0].item()
-            lat_min = lats[0].item()
-            lon_max = lons[-1].item()
-            lat_max = lats[-1].item()
+    lat_inds = np.where((lats >= lat_min) & (lats <= lat_max))
+    lon_inds = np.where((lons >= lon_min) & (lons <= lon_max))
 
-            lat_inds = np.where((lats >= lat_min) & (lats <= lat_max))
-            lon_inds = np.where((lons >= lon_min) & (lons <= lon_max))
+    if rain_files is None:
+        rain_files = {'RAINNC': rainnc_net_cdf_file_path}
 
-            rainnc = nnc_fid.variables['RAINNC'][:, lat_inds[0], lon_inds[0]]
+    with stage_timer('read_rainnc'):
+        prcp = None
+        for variable, file_path in sorted(rain_files.items()):
+            if file_path == rainnc_net_cdf_file_path:
+                values = nnc_fid.variables[variable][:, lat_inds[0], lon_inds[0]]
+            else:
+                with Dataset(file_path, mode='r') as fid:
+                    values = fid.variables[variable][:, lat_inds[0], lon_inds[0]]
+            prcp = values if prcp is None else prcp + values
 
-            times = nnc_fid.variables['XTIME'][:]
+    times = nnc_fid.variables['XTIME'][:]
 
-            start_date = fgt
-            end_date = fgt
+    nnc_fid.close()
 
-            nnc_fid.close()
+    with stage_timer('compute_diffs'):
+        diff = get_per_time_slot_values(prcp)
 
-            diff = get_per_time_slot_values(rainnc)
+    # time slot i ends at times[i + 1], the v3 pushers stamped it times[i]
+    time_origin = datetime.strptime(time_unit_info_list[2], '%Y-%m-%dT%H:%M:%S')
+    timestamps = [datetime_utc_to_lk(time_origin + timedelta(minutes=times[i + timestamp_offset].item()),
+                                     shift_mins=0).strftime('%Y-%m-%d %H:%M:%S') for i in range(len(diff))]
 
-            width = len(lons)
-            height = len(lats)
+    return {
+        'fgt': fgt,
+        'lats': np.asarray(lats),
+        'lons': np.asarray(lons),
+        'timestamps': timestamps,
+        'diff': np.ma.filled(diff, 0.0)
+    }
 
-            ts = Timeseries(pool)
 
-            for y in range(height):
-                for x in range(width):
+def get_grid_cell_count(rainnc_net_cdf_file_path):
+    """
+    :return: number of grid cells, one run each, the file is pushed as, from the shapes of XLAT and XLONG
+    """
+    with Dataset(rainnc_net_cdf_file_path, mode='r') as nnc_fid:
+        return nnc_fid.variables['XLAT'].shape[1] * nnc_fid.variables['XLONG'].shape[2]
 
-                    lat = float('%.6f' % lats[y])
-                    lon = float('%.6f' % lons[x])
 
-                    tms_meta['latitude'] = str(lat)
-                    tms_meta['longitude'] = str(lon)
+def init_worker(report_queue, log_queue):
+    """
+    Pool initializer, the worker's report events and log records go to the parent
+    """
+    init_run_report(report_queue)
+    init_worker_logging(log_queue)
 
-                    station_prefix = 'wrf_{}_{}'.format(lat, lon)
 
-                    station_id = wrf_v3_stations.get(station_prefix)
+def get_wrf_station_ids(pool):
+    """
+    :return: dict of wrf station name -> station id, e.g.: {'wrf_7.0_80.0': 1100000}
+    """
+    return metadata_cache.get('wrf_stations', lambda: get_wrf_stations(pool))
 
-                    if station_id is None:
-                        add_station(pool=pool, name=station_prefix, latitude=lat, longitude=lon,
-                                    description="WRF point", station_type=StationEnum.WRF)
-                        station_id = get_station_id(pool=pool, latitude=lat, longitude=lon, station_type=StationEnum.WRF)
 
-                    tms_id = ts.get_timeseries_id_if_exists(tms_meta)
+def push_cells(pool, ts, cells, fgt, counts, dry_run=False):
+    """
+    Write a batch of grid cells: one run lookup, an insert per missing run, one data upsert and one end date update
+    :param pool: database connection pool
+    :param ts: timeseries class instance
+    :param cells: list of (tms_id, run meta, rows) of the cells
+    :param fgt:
+    :param counts: push_wrf_grid counts, updated
+    :param dry_run: only count the rows
+    :return:
+    """
+    counts['cells'] += len(cells)
+    if dry_run:
+        counts['rows_discarded'] += sum([len(rows) for _, _, rows in cells])
+        return
+
+    tms_ids = [tms_id for tms_id, _, _ in cells]
+
+    with stage_timer('resolve_tms_id'):
+        existing_ids = get_existing_run_ids(pool, tms_ids)
+
+    # a cell without its run would fail the data upsert of the whole batch on the run foreign key
+    written_cells = []
+    for tms_id, run_meta, rows in cells:
+        if tms_id not in existing_ids:
+            try:
+                ts.insert_run(run_meta)
+                counts['new_runs'] += 1
+            except Exception:
+                logger.error("Exception occurred while inserting run entry {}".format(run_meta))
+                traceback.print_exc()
+                counts['failed_cells'] += 1
+                continue
+        written_cells.append((tms_id, run_meta, rows))
+
+    if not written_cells:
+        return
+
+    tms_ids = [tms_id for tms_id, _, _ in written_cells]
+    ts_data = [row for _, _, rows in written_cells for row in rows]
+    if push_rainfall_to_db(pool=pool, ts=ts, ts_data=ts_data, tms_ids=tms_ids, fgt=fgt):
+        counts['rows_written'] += len(ts_data)
+    else:
+        counts['failed_cells'] += len(written_cells)
+
 
-                    if tms_id is None:
-                        tms_id = ts.generate_timeseries_id(tms_meta)
+def push_wrf_grid(pool, grid, tms_meta, dry_run=False):
+    """
+    Push a decoded WRF grid to the database, one timeseries per grid cell, written PUSH_BATCH_CELLS cells at a time
+    :param pool: database connection pool
+    :param grid: decoded grid, as returned by decode_rainnc_file
+    :param tms_meta: timeseries meta data, with model and source_id set
+    :param dry_run: resolve stations from the cache and tms ids locally, build the rows and discard them,
+        without writing anything to the database
+    :return:
+    """
+    fgt = grid['fgt']
+    lats = grid['lats']
+    lons = grid['lons']
+    timestamps = grid['timestamps']
+    diff = grid['diff']
 
-                        run_meta = {
-                            'tms_id': tms_id,
-                            'sim_tag': tms_meta['sim_tag'],
-                            'start_date': start_date,
-                            'end_date': end_date,
-                            'station_id': station_id,
-                            'source_id': tms_meta['source_id'],
-                            'unit_id': tms_meta['unit_id'],
-                            'variable_id': tms_meta['variable_id']
-                        }
-                        try:
-                            ts.insert_run(run_meta)
-                        except Exception:
-                            logger.error("Exception occurred while inserting run entry {}".format(run_meta))
-                            traceback.print_exc()
+    start_date = fgt
+    end_date = fgt
 
-                    data_list = []
-                    # generate timeseries for each station
-                    for i in range(len(diff)):
-                        ts_time = datetime.strptime(time_unit_info_list[2], '%Y-%m-%dT%H:%M:%S') + timedelta(
-                            minutes=times[i + 1].item())
-                        t = datetime_utc_to_lk(ts_time, shift_mins=0)
-                        data_list.append([tms_id, t.strftime('%Y-%m-%d %H:%M:%S'), fgt, float(diff[i, y, x])])
+    width = len(lons)
+    height = len(lats)
 
-                    push_rainfall_to_db(ts=ts, ts_data=data_list, tms_id=tms_id, fgt=fgt)
-            return True
+    wrf_v3_stations = get_wrf_station_ids(pool)
+
+    ts = Timeseries(pool)
+
+    counts = {'cells': 0, 'rows_written': 0, 'failed_cells': 0, 'new_stations': 0, 'new_runs': 0}
+    if dry_run:
+        counts = {'cells': 0, 'rows_discarded': 0, 'missing_stations': 0}
+
+    # (tms_id, run meta, rows) of the cells not written yet
+    cells = []
+
+    for y in range(height):
+        for x in range(width):
+
+            lat = float('%.6f' % lats[y])
+            lon = float('%.6f' % lons[x])
+
+            tms_meta['latitude'] = str(lat)
+            tms_meta['longitude'] = str(lon)
+
+            station_prefix = 'wrf_{}_{}'.format(lat, lon)
+
+            with stage_timer('resolve_station'):
+                station_id = wrf_v3_stations.get(station_prefix)
+
+                if station_id is None and dry_run:
+                    counts['missing_stations'] += 1
+                elif station_id is None:
+                    add_station(pool=pool, name=station_prefix, latitude=lat, longitude=lon,
+                                description="WRF point", station_type=StationEnum.WRF)
+                    station_id = get_station_id(pool=pool, latitude=lat, longitude=lon, station_type=StationEnum.WRF)
+                    wrf_v3_stations[station_prefix] = station_id
+                    counts['new_stations'] += 1
+
+            # the id is a hash of the meta data, whether its run exists is asked per batch
+            tms_id = ts.generate_timeseries_id(tms_meta)
+
+            run_meta = {
+                'tms_id': tms_id,
+                'sim_tag': tms_meta['sim_tag'],
+                'start_date': start_date,
+                'end_date': end_date,
+                'station_id': station_id,
+                'source_id': tms_meta['source_id'],
+                'unit_id': tms_meta['unit_id'],
+                'variable_id': tms_meta['variable_id']
+            }
+
+            # generate timeseries for each station
+            data_list = [[tms_id, timestamps[i], fgt, float(diff[i, y, x])] for i in range(len(diff))]
+
+            cells.append((tms_id, run_meta, data_list))
+            if len(cells) == PUSH_BATCH_CELLS:
+                push_cells(pool=pool, ts=ts, cells=cells, fgt=fgt, counts=counts, dry_run=dry_run)
+                cells = []
+
+    if cells:
+        push_cells(pool=pool, ts=ts, cells=cells, fgt=fgt, counts=counts, dry_run=dry_run)
+
+    # sent once per grid, keeping the per cell loop free of queue traffic
+    for name, value in counts.items():
+        report_count(name, value)
+
+
+def read_netcdf_file(pool, rainnc_net_cdf_file_path, tms_meta, dry_run=False, rain_files=None, timestamp_offset=1):
+    """
+
+    :param pool: database connection pool
+    :param rainnc_net_cdf_file_path:
+    :param tms_meta:
+    :param dry_run: see push_wrf_grid
+    :param rain_files: see decode_rainnc_file
+    :param timestamp_offset: see decode_rainnc_file
+    :return: decoded grid if successful, None otherwise
+    """
+    missing_files = [file_path for file_path in set([rainnc_net_cdf_file_path] + list((rain_files or {}).values()))
+                     if not os.path.exists(file_path)]
+    if missing_files:
+        msg = 'no rainnc netcdf :: {}'.format(', '.join(sorted(missing_files)))
+        logger.warning(msg)
+        report_error(msg)
+        return None
+    else:
+
+        try:
+            start = time.time()
+            grid = decode_rainnc_file(rainnc_net_cdf_file_path, rain_files=rain_files,
+                                      timestamp_offset=timestamp_offset)
+            report_timing('decode_netcdf', time.time() - start)
+
+            start = time.time()
+            push_wrf_grid(pool=pool, grid=grid, tms_meta=tms_meta, dry_run=dry_run)
+            report_timing('push_grid', time.time() - start)
+            return grid
         except Exception as e:
             msg = "netcdf file at {} reading error.".format(rainnc_net_cdf_file_path)
             logger.error(msg)
             traceback.print_exc()
-            email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = msg
-            return False
+            report_error(msg)
+            return None
+
+
+def get_or_add_source_id(pool, source_name, version):
+
+    def load_source_id():
+        source_id = get_source_id(pool=pool, model=source_name, version=version)
+
+        if source_id is None:
+            add_source(pool=pool, model=source_name, version=version)
+            source_id = get_source_id(pool=pool, model=source_name, version=version)
+
+        return source_id
+
+    return metadata_cache.get(('source', source_name, version), load_source_id)
 
 
 def extract_wrf_data(wrf_system, config_data, tms_meta):
+    """
+    Push the RAINNC output of a WRF system (config_data['domain'], d03 by default) for each of the configured dates
+    :param wrf_system: e.g.: A
+    :param config_data:
+    :param tms_meta:
+    :return: dict of date -> decoded grid, or True if config_data['return_grids'] is off (None for dates that failed)
+    """
     logger.info(
         "######################################## {} #######################################".format(wrf_system))
+    set_report_context(wrf_system=wrf_system, sim_tag=tms_meta['sim_tag'])
+
+    source_name = "{}_{}".format(config_data['model'], wrf_system)
+
+    try:
+        if config_data.get('dry_run'):
+            source_id = get_source_id(pool=pool, model=source_name, version=tms_meta['version'])
+        else:
+            source_id = get_or_add_source_id(pool=pool, source_name=source_name, version=tms_meta['version'])
+    except Exception:
+        msg = "Exception occurred while loading source meta data for WRF_{} from database.".format(wrf_system)
+        logger.error(msg)
+        report_error(msg)
+        return {date: None for date in config_data['dates']}
+
+    tms_meta['model'] = source_name
+    tms_meta['source_id'] = source_id
+
+    grids = {}
+
     for date in config_data['dates']:
 
-        #     /wrf_nfs/wrf/4.0/18/A/2019-07-30/d03_RAINNC.nc
+        #     /wrf_nfs/wrf/4.0/18/A/2019-07-30/d03_RAINNC.nc (v4 layout, see wrf_layouts)
+
+        rain_files = get_rain_files(path_layout=config_data.get('path_layout', 'v4'), wrf_dir=config_data['wrf_dir'],
+                                    version=config_data['version'], gfs_data_hour=config_data['gfs_data_hour'],
+                                    wrf_system=wrf_system, date=date,
+                                    rain_variables=config_data.get('rain_variables', ['RAINNC']),
+                                    domain=config_data.get('domain', 'd03'))
+
+        set_report_context(wrf_system=wrf_system, date=date, sim_tag=tms_meta['sim_tag'])
+        with profile_unit("{}_{}_{}_{}".format(config_data['gfs_data_hour'], config_data.get('domain', 'd03'),
+                                               wrf_system, date)):
+            grid = read_netcdf_file(pool=pool, rainnc_net_cdf_file_path=rain_files['RAINNC'],
+                                    tms_meta=tms_meta, dry_run=config_data.get('dry_run', False),
+                                    rain_files={variable: rain_files[variable]
+                                                for variable in config_data.get('rain_variables', ['RAINNC'])},
+                                    timestamp_offset=config_data.get('timestamp_offset', 1))
+        # the grids are pickled back to the parent, only send them when the ensemble or native rfields use them
+        if config_data.get('return_grids', True) or grid is None:
+            grids[date] = grid
+        else:
+            grids[date] = True
+        flush_instrumentation()
+        flush_db_trace()
+
+    return grids
+
+
+def is_ingested(grids):
+    """
+    :param grids: result of extract_wrf_data, None if the job failed
+    :return: True if every date was pushed
+    """
+    return bool(grids) and all(grid is not None for grid in grids.values())
+
 
-        output_dir = os.path.join(config_data['wrf_dir'], config_data['version'], config_data['gfs_data_hour'],
-                                  wrf_system, date)
-        rainnc_net_cdf_file = 'd03_RAINNC.nc'
+def push_ensemble_grid(source_name, date, grid, tms_meta):
+    """
+    Push one ensemble statistic of a date as a derived source, run on the pool like the wrf systems
+    :param source_name: e.g.: WRF_ENS_MEAN
+    :param date: e.g.: 2019-07-30
+    :param grid: decoded grid of the statistic
+    :param tms_meta:
+    :return: True if successful, False otherwise
+    """
+    set_report_context(wrf_system=source_name, date=date, sim_tag=tms_meta['sim_tag'])
+
+    try:
+        ensemble_tms_meta = dict(tms_meta)
+        ensemble_tms_meta['model'] = source_name
+        ensemble_tms_meta['source_id'] = get_or_add_source_id(pool=pool, source_name=source_name,
+                                                              version=tms_meta['version'])
+
+        logger.info("Push {} for {}".format(source_name, date))
+        push_wrf_grid(pool=pool, grid=grid, tms_meta=ensemble_tms_meta)
+        return True
+    except Exception:
+        msg = "Pushing ensemble statistics {} for {} failed.".format(source_name, date)
+        logger.error(msg)
+        traceback.print_exc()
+        report_error(msg)
+        return False
+    finally:
+        flush_instrumentation()
+        flush_db_trace()
 
-        rainnc_net_cdf_file_path = os.path.join(output_dir, rainnc_net_cdf_file)
 
+def submit_ensemble_stats(scheduler, ensemble_source, grids, date, config_data, tms_meta, min_members):
+    """
+    Compute the ensemble statistics of the decoded WRF systems of a date and submit their pushes to the scheduler
+    :param scheduler: PipelineScheduler the derived sources are pushed on
+    :param ensemble_source: derived source name prefix, e.g.: WRF_ENS -> WRF_ENS_MEAN, WRF_ENS_MAX, ...
+    :param grids: dict of wrf system -> decoded grid, None for the systems that failed
+    :param date: e.g.: 2019-07-30
+    :param config_data:
+    :param tms_meta:
+    :param min_members: fewer decoded wrf systems than this and no ensemble is published
+    :return: list of the submitted job keys, empty if the ensemble was skipped
+    """
+    members = sorted([wrf_system for wrf_system, grid in grids.items() if grid is not None])
+    if len(members) < min_members:
+        msg = "Ensemble statistics for {} ({}) skipped, only {} of {} decoded.".format(
+            date, tms_meta['sim_tag'], members, config_data['wrf_systems'])
+        logger.error(msg)
+        report_error(msg)
+        return []
+
+    try:
+        ensemble_grids = build_ensemble_grids(grids, min_members=min_members)
+    except ValueError as e:
+        msg = "Ensemble statistics for {} skipped :: {}".format(date, e)
+        logger.error(msg)
+        report_error(msg)
+        return []
+
+    keys = []
+    for stat in ENSEMBLE_STATS:
+        source_name = "{}_{}".format(ensemble_source, stat)
+        key = "{}_{}_{}".format(tms_meta['sim_tag'], source_name, date)
+        scheduler.submit(key=key, func=push_ensemble_grid, args=(source_name, date, ensemble_grids[stat], tms_meta),
+                         get_dependent_jobs=lambda key, result: [])
+        keys.append(key)
+    return keys
+
+
+def get_rfield_jobs(wrf_system, grids, config_data, sim_tag, rfield_mode, rfield_params):
+    """
+    Kelani basin and SL d03 rfield jobs of a wrf system, to be started as soon as its ingestion finishes
+    :param wrf_system: e.g.: A
+    :param grids: dict of date -> decoded grid, as returned by extract_wrf_data
+    :param config_data:
+    :param sim_tag: e.g.: "evening_18hrs"
+    :param rfield_mode: "local", "remote" or "native"
+    :param rfield_params: rfield_dir (native mode) or rfield_host, rfield_user, rfield_key (remote mode)
+    :return: list of (job name, func, kwargs)
+    """
+    source_name = "{}_{}".format(config_data['model'], wrf_system)
+
+    if config_data.get('dry_run'):
+        logger.info("Dry run, skipping rfield generation for {}.".format(source_name))
+        return []
+
+    # the rfield regions are cut from the d03 grids
+    if config_data.get('domain', 'd03') != 'd03':
+        logger.info("No rfields for the {} domain of {}.".format(config_data['domain'], source_name))
+        return []
+
+    if not grids or all(grid is None for grid in grids.values()):
+        logger.warning("No data ingested for {}, skipping rfield generation.".format(source_name))
+        return []
+
+    if rfield_mode == 'native':
+        return [("{} {} {} rfield {}".format(source_name, sim_tag, region, date),
+                 timed('generate_rfields', gen_rfields, context={'source': source_name, 'region': region, 'date': date}),
+                 {'grid': grid, 'source_name': source_name, 'version': config_data['version'], 'sim_tag': sim_tag,
+                  'region': region, 'rfield_dir': rfield_params['rfield_dir']})
+                for date, grid in grids.items() if grid is not None for region in RFIELD_REGIONS.keys()]
+
+    if rfield_mode == 'remote':
+        remote_params = {'source_names': source_name, 'version': config_data['version'], 'sim_tag': sim_tag,
+                         'rfield_host': rfield_params['rfield_host'], 'rfield_user': rfield_params['rfield_user'],
+                         'rfield_key': rfield_params['rfield_key']}
+        return [("{} {} kelani_basin rfield".format(source_name, sim_tag),
+                 timed('generate_rfields', gen_kelani_basin_rfields,
+                       context={'source': source_name, 'region': 'kelani_basin'}), remote_params),
+                ("{} {} d03 rfield".format(source_name, sim_tag),
+                 timed('generate_rfields', gen_all_d03_rfields, context={'source': source_name, 'region': 'd03'}),
+                 remote_params)]
+
+    return [("{} {} kelani_basin rfield".format(source_name, sim_tag),
+             timed('generate_rfields', gen_kelani_basin_rfields_locally,
+                   context={'source': source_name, 'region': 'kelani_basin'}),
+             {'source_names': source_name, 'version': config_data['version'], 'sim_tag': sim_tag}),
+            ("{} {} d03 rfield".format(source_name, sim_tag),
+             timed('generate_rfields', gen_all_d03_rfields_locally, context={'source': source_name, 'region': 'd03'}),
+             {'source_names': source_name, 'version': config_data['version'], 'sim_tag': sim_tag})]
+
+
+def write_run_reports(config, run_report):
+    """
+    Log the db trace summary, run report and email content, and write the run report file and prometheus textfile
+    :param config: loaded config.json
+    :param run_report: RunReportCollector, stopped or rotated
+    :return:
+    """
+    log_db_trace_summary(run_report)
+    if 'run_report_file' in config and (config['run_report_file'] != ""):
         try:
-            source_name = "{}_{}".format(config_data['model'], wrf_system)
-            source_id = get_source_id(pool=pool, model=source_name, version=tms_meta['version'])
+            run_report.write_json(config['run_report_file'])
+        except Exception:
+            logger.error("Writing the run report {} failed.".format(config['run_report_file']))
+            traceback.print_exc()
+    if 'prometheus_textfile' in config and (config['prometheus_textfile'] != ""):
+        try:
+            write_prometheus_textfile(run_report, config['prometheus_textfile'])
+        except Exception:
+            logger.error("Writing the prometheus textfile {} failed.".format(config['prometheus_textfile']))
+            traceback.print_exc()
+    run_report_dict = run_report.to_dict()
+    logger.info("Run Report {}".format(json.dumps({'timings': run_report_dict['timings'],
+                                                   'counts': run_report_dict['counts']})))
+    logger.info("Email Content {}".format(json.dumps(run_report.email_content())))
 
-            if source_id is None:
-                add_source(pool=pool, model=source_name, version=tms_meta['version'])
-                source_id = get_source_id(pool=pool, model=source_name, version=tms_meta['version'])
 
+def publish_run_report(config, run_report):
+    """
+    Resident modes: write the reports of what finished since the previous call, and start a new report
+    :param config: loaded config.json
+    :param run_report: running RunReportCollector
+    :return:
+    """
+    try:
+        flush_instrumentation()
+        flush_db_trace()
+        run_report.flush()
+        write_run_reports(config, run_report.rotate())
+    except Exception:
+        logger.error("Publishing the run report failed.")
+        traceback.print_exc()
+
+
+def start_report_publisher(config, run_report):
+    """
+    Resident modes: publish the run report on a thread of its own, the callbacks run on the pool's result handler
+    thread and must not wait for the flushes and file writes (nor for the rfield jobs on the scheduler's threads)
+    :param config: loaded config.json
+    :param run_report: running RunReportCollector
+    :return: function queueing a publish_run_report, one at a time
+    """
+    publisher = ThreadPoolExecutor(max_workers=1)
+    return lambda: publisher.submit(publish_run_report, config, run_report)
+
+
+def watch_wrf_outputs(config, config_data, tms_meta, sim_tag, rfield_mode, rfield_params, scheduler, run_report):
+    """
+    Watch mode: ingest each wrf system's output as soon as it lands, instead of at fixed cron times
+    :param config: loaded config.json
+    :param config_data:
+    :param tms_meta:
+    :param sim_tag:
+    :param rfield_mode:
+    :param rfield_params:
+    :param scheduler: PipelineScheduler the ingestion and rfield jobs run on
+    :param run_report: RunReportCollector, its reports are written as each unit finishes
+    :return: never returns
+    """
+    queue_publish = start_report_publisher(config, run_report)
+
+    def on_unit_finished(key, grids, on_finished):
+        # runs on the pool's result handler thread, must not raise
+        try:
+            on_finished(is_ingested(grids))
         except Exception:
-            msg = "Exception occurred while loading source meta data for WRF_{} from database.".format(wrf_system)
-            logger.error(msg)
-            email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = msg
-            return False
+            logger.error("Finishing watch unit {} failed.".format(key))
+            traceback.print_exc()
+        queue_publish()
+
+    def dispatch(wrf_system, date, on_finished):
+        date_config_data = dict(config_data)
+        date_config_data['dates'] = [date]
+
+        scheduler.submit(key="{}_{}".format(wrf_system, date), func=extract_wrf_data,
+                         args=(wrf_system, date_config_data, tms_meta),
+                         get_dependent_jobs=lambda key, grids: get_rfield_jobs(
+                             wrf_system=wrf_system, grids=grids, config_data=date_config_data, sim_tag=sim_tag,
+                             rfield_mode=rfield_mode, rfield_params=rfield_params),
+                         on_finished=lambda key, grids: on_unit_finished(key, grids, on_finished))
+
+    marker_file = None
+    if 'watch_marker_file' in config and (config['watch_marker_file'] != ""):
+        marker_file = config['watch_marker_file']
+
+    stable_secs = 60
+    if 'watch_stable_secs' in config and (config['watch_stable_secs'] != ""):
+        stable_secs = int(config['watch_stable_secs'])
+
+    poll_interval = 30
+    if 'watch_poll_interval' in config and (config['watch_poll_interval'] != ""):
+        poll_interval = int(config['watch_poll_interval'])
+
+    watcher = WrfOutputWatcher(wrf_dir=config_data['wrf_dir'], version=config_data['version'],
+                               gfs_data_hour=config_data['gfs_data_hour'], wrf_systems=config_data['wrf_systems'],
+                               dispatch=dispatch,
+                               rainnc_net_cdf_file='{}_RAINNC.nc'.format(config_data.get('domain', 'd03')),
+                               marker_file=marker_file, stable_secs=stable_secs,
+                               poll_interval=poll_interval)
+
+    if 'run_date' in config and (config['run_date'] != ""):
+        watcher.run(get_dates=lambda: config['run_date'])
+    else:
+        watcher.run(get_dates=get_recent_dates)
+
+
+def backfill_wrf_outputs(config_data, tms_meta, scheduler, start_date=None, end_date=None):
+    """
+    Backfill mode: push the outputs in the wrf tree that are not in the database yet, newest first
+    :param config_data:
+    :param tms_meta:
+    :param scheduler: PipelineScheduler the ingestion jobs run on
+    :param start_date: e.g.: 2019-07-01, all dates in the tree if None
+    :param end_date: e.g.: 2019-07-30
+    :return: dict of "<wrf system>_<date>" -> True if pushed, False otherwise
+    """
+    outputs = scan_wrf_outputs(config_data, start_date=start_date, end_date=end_date)
+
+    source_ids = {}
+    for wrf_system in config_data['wrf_systems']:
+        source_name = "{}_{}".format(config_data['model'], wrf_system)
+        source_ids[wrf_system] = metadata_cache.get(
+            ('source', source_name, config_data['version']),
+            lambda: get_source_id(pool=pool, model=source_name, version=config_data['version']))
 
-        tms_meta['model'] = source_name
-        tms_meta['source_id'] = source_id
+    coverage = get_source_coverage(pool, [source_id for source_id in source_ids.values() if source_id is not None],
+                                   tms_meta, set([get_file_last_modified_time(path) for path in outputs.values()]))
 
-        return read_netcdf_file(pool=pool, rainnc_net_cdf_file_path=rainnc_net_cdf_file_path, tms_meta=tms_meta)
+    units = plan_backfill(outputs=outputs, source_ids=source_ids, coverage=coverage,
+                          get_fgt=get_file_last_modified_time, get_cell_count=get_grid_cell_count)
+
+    # the pool takes the jobs in submission order, so the newest dates go first
+    ingestion_jobs = {}
+    for wrf_system, date in units:
+        unit_config_data = dict(config_data)
+        unit_config_data['dates'] = [date]
+        unit_config_data['return_grids'] = False
+        ingestion_jobs["{}_{}".format(wrf_system, date)] = (extract_wrf_data, (wrf_system, unit_config_data, tms_meta))
+
+    statuses, _ = scheduler.run(ingestion_jobs=ingestion_jobs, get_dependent_jobs=lambda key, result: [])
+    return {key: is_ingested(result) for key, result in statuses.items()}
+
+
+def serve_spool_jobs(config, config_data, tms_meta, sim_tag, rfield_mode, rfield_params, scheduler, run_report):
+    """
+    Service mode: keep the pools and meta data warm and run the ingestion jobs dropped into the spool directory
+    :param config: loaded config.json
+    :param config_data:
+    :param tms_meta:
+    :param sim_tag:
+    :param rfield_mode:
+    :param rfield_params:
+    :param scheduler: PipelineScheduler the ingestion and rfield jobs run on
+    :param run_report: RunReportCollector, its reports are written as each unit finishes
+    :return: never returns
+    """
+    queue_publish = start_report_publisher(config, run_report)
+
+    def handle_job(job_name, job, on_finished):
+        job_config_data = dict(config_data)
+        if 'run_date' in job and (job['run_date'] != ""):
+            job_config_data['dates'] = job['run_date']
+        else:
+            job_config_data['dates'] = [(datetime.now() + timedelta(hours=5, minutes=30)).strftime('%Y-%m-%d')]
+
+        wrf_systems_list = config_data['wrf_systems']
+        if 'wrf_systems' in job and (job['wrf_systems'] != ""):
+            wrf_systems_list = job['wrf_systems'].split(',')
+
+        remaining = set(wrf_systems_list)
+        results = {}
+
+        def on_system_finished(key, grids):
+            # runs on the pool's result handler thread, must not raise
+            try:
+                wrf_system = key.rsplit(':', 1)[1]
+                results[wrf_system] = is_ingested(grids)
+                remaining.discard(wrf_system)
+                if remaining:
+                    return
+                logger.info("Spool job {} finished :: {}".format(job_name, json.dumps(results)))
+                on_finished(all(results.values()))
+            except Exception:
+                logger.error("Finishing spool job {} failed.".format(job_name))
+                traceback.print_exc()
+            queue_publish()
+
+        for wrf_system in wrf_systems_list:
+            scheduler.submit(key="{}:{}".format(job_name, wrf_system), func=extract_wrf_data,
+                             args=(wrf_system, job_config_data, tms_meta),
+                             get_dependent_jobs=lambda key, grids: get_rfield_jobs(
+                                 wrf_system=key.rsplit(':', 1)[1], grids=grids, config_data=job_config_data,
+                                 sim_tag=sim_tag, rfield_mode=rfield_mode, rfield_params=rfield_params),
+                             on_finished=on_system_finished)
+
+    spool_dir = 'spool'
+    if 'spool_dir' in config and (config['spool_dir'] != ""):
+        spool_dir = config['spool_dir']
+
+    serve(spool=SpoolDirectory(spool_dir), handle_job=handle_job)
 
 
 if __name__ == "__main__":
@@ -358,11 +928,42 @@ if __name__ == "__main__":
 
       "sim_tag": "evening_18hrs",
 
+      "cycles": [
+        {"gfs_data_hour": "18", "domain": "d03", "sim_tag": "evening_18hrs"},
+        {"gfs_data_hour": "00", "domain": "d03", "sim_tag": "dwrf_00hrs", "priority": 1,
+         "system_priorities": {"A": 0, "C": 2}},
+        {"gfs_data_hour": "18", "domain": "d01", "sim_tag": "evening_18hrs_d01", "priority": 2}
+      ],
+
       "unit": "mm",
       "unit_type": "Accumulative",
       "variable": "Precipitation",
 
-      "rfield_host": "233.646.456.78",
+      "ensemble_source": "WRF_ENS",
+      "ensemble_min_members": 4,
+
+      "sink": "null",
+
+      "path_layout": "v4",
+      "rain_variables": "RAINNC",
+      "timestamp_offset": 1,
+
+      "rfield_mode": "native",
+      "rfield_dir": "/var/www/html/wrf/rfield",
+      "rfield_parallelism": 2,
+
+      "metadata_ttl": 3600,
+      "run_report_file": "run_report.json",
+      "instrumentation": true,
+      "db_trace": true,
+      "prometheus_textfile": "/var/lib/node_exporter/textfile_collector/wrf_data_pusher.prom",
+      "spool_dir": "/home/uwcc-admin/curw_wrf_data_pusher/spool",
+
+      "watch_marker_file": "d03_RAINNC.done",
+      "watch_stable_secs": 60,
+      "watch_poll_interval": 30,
+
+      "rfield_host": "233.646.456.78,233.646.456.79",
       "rfield_user": "blah",
       "rfield_key": "/home/uwcc-admin/.ssh/blah"
     }
@@ -380,6 +981,41 @@ if __name__ == "__main__":
                     'unit_type'     : unit_type
                     }
     """
+    parser = argparse.ArgumentParser(description='Push WRF RAINNC outputs to the curw_fcst database.')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and ingest each wrf system as soon as its output file is complete')
+    parser.add_argument('--serve', action='store_true',
+                        help='keep running and ingest the jobs dropped into the spool directory')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='decode the outputs and build the rows, without writing anything to the database '
+                             '(same as "sink": "null" in config.json)')
+    parser.add_argument('--backfill', action='store_true',
+                        help='push every output in the wrf tree that is not in the database yet, newest first')
+    parser.add_argument('--backfill-start', default=None, help='with --backfill, first date, e.g.: 2019-07-01')
+    parser.add_argument('--backfill-end', default=None, help='with --backfill, last date, e.g.: 2019-07-30')
+    parser.add_argument('--profile', nargs='?', const='profiles', default=None, metavar='DIR',
+                        help='profile each wrf system and date in the pool workers, the profiles and their merged '
+                             'summary are written to a per run directory under DIR (default: profiles)')
+    parser.add_argument('--profile-sampling', action='store_true',
+                        help='with --profile, use the pyinstrument sampling profiler if installed')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, record the peak allocations of each stage with tracemalloc')
+    args = parser.parse_args()
+
+    # errors, timings and counts of the parent and the pool workers, reported at the end of the run
+    report_queue = mp.Queue()
+    init_run_report(report_queue)
+    run_report = RunReportCollector(report_queue)
+    run_report.start()
+
+    # the workers enqueue their log records, only this process writes and rotates wrf_data_pusher.log
+    log_queue, log_listener = start_log_listener(logger)
+
+    config = {}
+    pool = None
+    mp_pool = None
+    profile_dir = None
+
     try:
         config = json.loads(open('config.json').read())
 
@@ -387,12 +1023,27 @@ if __name__ == "__main__":
         wrf_dir = read_attribute_from_config_file('wrf_dir', config)
         model = read_attribute_from_config_file('model', config)
         version = read_attribute_from_config_file('version', config)
-        gfs_data_hour = read_attribute_from_config_file('gfs_data_hour', config)
         wrf_systems = read_attribute_from_config_file('wrf_systems', config)
         wrf_systems_list = wrf_systems.split(',')
 
-        # sim_tag
-        sim_tag = read_attribute_from_config_file('sim_tag', config)
+        # gfs cycles and domains, each under its own sim_tag, all pushed by this run (see wrf_cycles)
+        try:
+            cycles = read_cycles(config)
+        except ValueError as e:
+            msg = "Invalid cycles in config file :: {}".format(e)
+            logger.error(msg)
+            report_error(msg)
+            sys.exit(1)
+
+        if cycles:
+            # the first cycle is the one the watch, serve and backfill modes follow
+            gfs_data_hour = cycles[0]['gfs_data_hour']
+            sim_tag = cycles[0]['sim_tag']
+        else:
+            gfs_data_hour = read_attribute_from_config_file('gfs_data_hour', config)
+            # sim_tag
+            sim_tag = read_attribute_from_config_file('sim_tag', config)
+            cycles = [{'gfs_data_hour': gfs_data_hour, 'domain': 'd03', 'sim_tag': sim_tag, 'priority': 0}]
 
         # unit details
         unit = read_attribute_from_config_file('unit', config)
@@ -402,9 +1053,68 @@ if __name__ == "__main__":
         variable = read_attribute_from_config_file('variable', config)
 
         # rfield params
-        # rfield_host = read_attribute_from_config_file('rfield_host', config)
-        # rfield_user = read_attribute_from_config_file('rfield_user', config)
-        # rfield_key = read_attribute_from_config_file('rfield_key', config)
+        # rfield_mode: "local" (curw_rfield_extractor scripts, default), "remote" (the same scripts over ssh on
+        # rfield_host) or "native" (written from the decoded grids)
+        rfield_mode = 'local'
+        if 'rfield_mode' in config and (config['rfield_mode'] != ""):
+            rfield_mode = config['rfield_mode']
+
+        rfield_params = {}
+        if rfield_mode == 'native':
+            rfield_params['rfield_dir'] = read_attribute_from_config_file('rfield_dir', config)
+        elif rfield_mode == 'remote':
+            rfield_params['rfield_host'] = read_attribute_from_config_file('rfield_host', config)
+            rfield_params['rfield_user'] = read_attribute_from_config_file('rfield_user', config)
+            rfield_params['rfield_key'] = read_attribute_from_config_file('rfield_key', config)
+
+        # number of rfield jobs running at once
+        rfield_parallelism = 2
+        if 'rfield_parallelism' in config and (config['rfield_parallelism'] != ""):
+            rfield_parallelism = int(config['rfield_parallelism'])
+
+        # dry run: the full pipeline up to the rows, which are discarded instead of written to curw_fcst
+        dry_run = args.dry_run
+        if 'sink' in config and (config['sink'] == "null"):
+            dry_run = True
+        if dry_run:
+            logger.info("Dry run, nothing will be written to the database.")
+
+        # optional ensemble statistics across the wrf systems, pushed as derived sources once every system of a
+        # date is in, and only if at least ensemble_min_members (default: all of them) were decoded
+        ensemble_source = None
+        if 'ensemble_source' in config and (config['ensemble_source'] != "") and dry_run:
+            logger.info("Dry run, skipping the ensemble statistics.")
+        elif 'ensemble_source' in config and (config['ensemble_source'] != ""):
+            ensemble_source = config['ensemble_source']
+
+        ensemble_min_members = len(wrf_systems_list)
+        if 'ensemble_min_members' in config and (config['ensemble_min_members'] != ""):
+            ensemble_min_members = int(config['ensemble_min_members'])
+
+        # layout of historical archives (v3, v3_d03, see wrf_layouts), precipitation variables summed
+        # (e.g.: "RAINC,RAINNC") and whether time slot i is stamped times[i + 1] (1, default) or times[i] (0)
+        path_layout = 'v4'
+        if 'path_layout' in config and (config['path_layout'] != ""):
+            path_layout = config['path_layout']
+            if path_layout not in PATH_LAYOUTS:
+                msg = "Unknown path_layout {} in config file.".format(path_layout)
+                logger.error(msg)
+                report_error(msg)
+                sys.exit(1)
+
+        if path_layout == 'v3' and any(cycle['domain'] != 'd03' for cycle in cycles):
+            msg = "The v3 path layout only has d03 outputs."
+            logger.error(msg)
+            report_error(msg)
+            sys.exit(1)
+
+        rain_variables = ['RAINNC']
+        if 'rain_variables' in config and (config['rain_variables'] != ""):
+            rain_variables = config['rain_variables'].split(',')
+
+        timestamp_offset = 1
+        if 'timestamp_offset' in config and (config['timestamp_offset'] != ""):
+            timestamp_offset = int(config['timestamp_offset'])
 
         dates = []
 
@@ -416,15 +1126,26 @@ if __name__ == "__main__":
         pool = get_Pool(host=CURW_FCST_HOST, port=CURW_FCST_PORT, user=CURW_FCST_USERNAME, password=CURW_FCST_PASSWORD,
                         db=CURW_FCST_DATABASE)
 
+        # opt-in statement/row/byte/time accounting per db call type, inherited by the pool workers
+        if 'db_trace' in config and config['db_trace']:
+            pool = TracedPool(pool)
+            install_db_tracer(globals())
+
+        if 'metadata_ttl' in config and (config['metadata_ttl'] != ""):
+            metadata_cache.ttl = int(config['metadata_ttl'])
+
         try:
-            wrf_v3_stations = get_wrf_stations(pool)
+            # loaded before the workers are forked, so they start with a warm cache
+            get_wrf_station_ids(pool)
 
-            variable_id = get_variable_id(pool=pool, variable=variable)
-            unit_id = get_unit_id(pool=pool, unit=unit, unit_type=unit_type)
+            variable_id = metadata_cache.get(('variable', variable),
+                                             lambda: get_variable_id(pool=pool, variable=variable))
+            unit_id = metadata_cache.get(('unit', unit, unit_type.value),
+                                         lambda: get_unit_id(pool=pool, unit=unit, unit_type=unit_type))
         except Exception:
             msg = "Exception occurred while loading common metadata from database."
             logger.error(msg)
-            email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = msg
+            report_error(msg)
             sys.exit(1)
 
         tms_meta = {
@@ -442,51 +1163,170 @@ if __name__ == "__main__":
             'version': version,
             'dates': dates,
             'wrf_dir': wrf_dir,
-            'gfs_data_hour': gfs_data_hour
+            'gfs_data_hour': gfs_data_hour,
+            'domain': cycles[0]['domain'],
+            'wrf_systems': wrf_systems_list,
+            'dry_run': dry_run,
+            'path_layout': path_layout,
+            'rain_variables': rain_variables,
+            'timestamp_offset': timestamp_offset,
+            # decoded grids are only needed by the ensemble statistics and the native rfields
+            'return_grids': ensemble_source is not None or rfield_mode == 'native'
         }
 
-        mp_pool = mp.Pool(mp.cpu_count())
-
-        # wrf_results = mp_pool.starmap_async(extract_wrf_data,
-        #                                 [(wrf_system, config_data, tms_meta) for wrf_system in wrf_systems_list]).get()
-
-        wrf_results = mp_pool.starmap(extract_wrf_data,
-                                            [(wrf_system, config_data, tms_meta) for wrf_system in
-                                             wrf_systems_list])
-
-        print("wrf extraction results: ", wrf_results)
-
-        source_list = ""
-
-        for wrf_system in wrf_systems_list:
-            source_list += "WRF_{},".format(wrf_system)
-
-        source_list = source_list[:-1]
-
-        # kelani_basin_rfield_status = gen_kelani_basin_rfields(source_names=source_list, version=version, sim_tag=sim_tag,
-        #                                         rfield_host=rfield_host, rfield_key=rfield_key, rfield_user=rfield_user)
-
-        kelani_basin_rfield_status = gen_kelani_basin_rfields_locally(source_names=source_list, version=version,
-                                                              sim_tag=sim_tag)
-
-        if not kelani_basin_rfield_status:
-            email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = "Kelani basin rfiled generation for {} failed".format(source_list)
-
-        # d03_rfield_status = gen_all_d03_rfields(source_names=source_list, version=version, sim_tag=sim_tag,
-        #                                         rfield_host=rfield_host, rfield_key=rfield_key, rfield_user=rfield_user)
-
-        d03_rfield_status = gen_all_d03_rfields_locally(source_names=source_list, version=version, sim_tag=sim_tag)
-
-        if not d03_rfield_status:
-            email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = "SL d03 rfiled generation for {} failed".format(source_list)
+        # fine grained stage timers, inherited by the pool workers
+        if 'instrumentation' in config and config['instrumentation']:
+            enable_instrumentation()
+
+        # per worker profiles, also set before the workers are forked
+        if args.profile is not None:
+            profile_dir = os.path.join(args.profile, datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+            enable_profiling(profile_dir, use_sampling=args.profile_sampling, use_tracemalloc=args.profile_memory)
+            if args.profile_memory:
+                # the allocations are recorded per stage timer
+                enable_instrumentation()
+
+        # source ids are shared by every cycle, loaded before the workers are forked like the stations
+        if not dry_run:
+            try:
+                for wrf_system in wrf_systems_list:
+                    get_or_add_source_id(pool=pool, source_name="{}_{}".format(model, wrf_system), version=version)
+                if ensemble_source is not None:
+                    for stat in ENSEMBLE_STATS:
+                        get_or_add_source_id(pool=pool, source_name="{}_{}".format(ensemble_source, stat),
+                                             version=version)
+            except Exception:
+                msg = "Exception occurred while loading source meta data from database."
+                logger.error(msg)
+                report_error(msg)
+                sys.exit(1)
+
+        mp_pool = mp.Pool(mp.cpu_count(), initializer=init_worker, initargs=(report_queue, log_queue))
+
+        # rfield jobs of each wrf system start as soon as its ingestion finishes, the resident modes never join
+        # the scheduler and keep no results
+        scheduler = PipelineScheduler(mp_pool=mp_pool, max_dependent_jobs=rfield_parallelism,
+                                      keep_results=not (args.watch or args.serve))
+
+        if args.backfill:
+            backfill_statuses = backfill_wrf_outputs(config_data=config_data, tms_meta=tms_meta, scheduler=scheduler,
+                                                  start_date=args.backfill_start, end_date=args.backfill_end)
+            print("backfill results: ", backfill_statuses)
+            sys.exit(0)
+
+        if args.watch:
+            watch_wrf_outputs(config=config, config_data=config_data, tms_meta=tms_meta, sim_tag=sim_tag,
+                              rfield_mode=rfield_mode, rfield_params=rfield_params, scheduler=scheduler,
+                              run_report=run_report)
+
+        if args.serve:
+            serve_spool_jobs(config=config, config_data=config_data, tms_meta=tms_meta, sim_tag=sim_tag,
+                             rfield_mode=rfield_mode, rfield_params=rfield_params, scheduler=scheduler,
+                             run_report=run_report)
+
+        # one (cycle, domain, wrf system, date) unit per job, the pool takes them in priority order
+        cycle_config_data = {}
+        cycle_tms_meta = {}
+        for cycle in cycles:
+            cycle_config_data[cycle['sim_tag']] = dict(config_data, gfs_data_hour=cycle['gfs_data_hour'],
+                                                       domain=cycle['domain'])
+            cycle_tms_meta[cycle['sim_tag']] = dict(tms_meta, sim_tag=cycle['sim_tag'])
+
+        planned_units = plan_units(cycles, wrf_systems_list, dates)
+        units = {}
+        ingestion_jobs = {}
+        for key, cycle, wrf_system, date in planned_units:
+            unit_config_data = dict(cycle_config_data[cycle['sim_tag']])
+            unit_config_data['dates'] = [date]
+            units[key] = (cycle, wrf_system, unit_config_data)
+            ingestion_jobs[key] = (extract_wrf_data, (wrf_system, unit_config_data, cycle_tms_meta[cycle['sim_tag']]))
+
+        # the rfield scripts read the database, not the grid of a date, they run once per wrf system and cycle
+        # after the last unit of the system (any date or cycle) is in, for the cycles with an ingested unit.
+        # Only called on the pool's result handler thread.
+        system_countdown = SystemCountdown(planned_units)
+
+        def get_unit_rfield_jobs(key, grids):
+            cycle, wrf_system, unit_config_data = units[key]
+            if rfield_mode == 'native':
+                return get_rfield_jobs(wrf_system=wrf_system, grids=grids, config_data=unit_config_data,
+                                       sim_tag=cycle['sim_tag'], rfield_mode=rfield_mode, rfield_params=rfield_params)
+
+            ingested_dates = system_countdown.finish(key, is_ingested(grids))
+            if ingested_dates is None:
+                return []
+
+            rfield_jobs = []
+            for system_cycle in cycles:
+                if system_cycle['sim_tag'] in ingested_dates:
+                    rfield_jobs.extend(get_rfield_jobs(
+                        wrf_system=wrf_system, grids={date: True for date in ingested_dates[system_cycle['sim_tag']]},
+                        config_data=cycle_config_data[system_cycle['sim_tag']], sim_tag=system_cycle['sim_tag'],
+                        rfield_mode=rfield_mode, rfield_params=rfield_params))
+            return rfield_jobs
+
+        # decoded grids of each (sim_tag, date) as its wrf systems finish, the ensemble of the date is submitted
+        # with its last member. Only called on the pool's result handler thread.
+        ensemble_members = {}
+
+        def on_unit_finished(key, grids):
+            cycle, wrf_system, unit_config_data = units[key]
+            date = unit_config_data['dates'][0]
+            members = ensemble_members.setdefault((cycle['sim_tag'], date), {})
+            members[wrf_system] = (grids or {}).get(date)
+            if len(members) == len(wrf_systems_list):
+                submit_ensemble_stats(scheduler=scheduler, ensemble_source=ensemble_source, grids=members, date=date,
+                                      config_data=unit_config_data, tms_meta=cycle_tms_meta[cycle['sim_tag']],
+                                      min_members=ensemble_min_members)
+                del ensemble_members[(cycle['sim_tag'], date)]
+
+        unit_grids, rfield_results = scheduler.run(ingestion_jobs=ingestion_jobs,
+                                                   get_dependent_jobs=get_unit_rfield_jobs,
+                                                   on_finished=on_unit_finished if ensemble_source is not None else None)
+
+        # dict of sim_tag -> wrf system -> date -> decoded grid
+        wrf_grids = {cycle['sim_tag']: {wrf_system: {} for wrf_system in wrf_systems_list} for cycle in cycles}
+        for key, (cycle, wrf_system, unit_config_data) in units.items():
+            date = unit_config_data['dates'][0]
+            wrf_grids[cycle['sim_tag']][wrf_system][date] = (unit_grids.get(key) or {}).get(date)
+
+        print("wrf extraction results: ", {cycle_sim_tag: {wrf_system: {date: grid is not None
+                                                                        for date, grid in grids.items()}
+                                                           for wrf_system, grids in system_grids.items()}
+                                           for cycle_sim_tag, system_grids in wrf_grids.items()})
+
+        for rfield_job, rfield_status in rfield_results.items():
+            if not rfield_status:
+                report_error("{} generation failed".format(rfield_job))
+
+        if ensemble_source is not None:
+            # failed pushes are already reported by push_ensemble_grid
+            print("ensemble results: ", {key: status for key, status in unit_grids.items() if key not in units})
 
     except Exception as e:
         msg = 'Multiprocessing error.'
         logger.error(msg)
-        email_content[datetime.now().strftime(COMMON_DATE_TIME_FORMAT)] = msg
+        report_error(msg)
         traceback.print_exc()
     finally:
-        mp_pool.close()
-        destroy_Pool(pool)
+        if mp_pool is not None:
+            mp_pool.close()
+            # workers flush their pending report events on exit
+            mp_pool.join()
+        close_session_pools()
+        if pool is not None:
+            destroy_Pool(pool)
         logger.info("Process finished.")
-        logger.info("Email Content {}".format(json.dumps(email_content)))
+
+        flush_instrumentation()
+        flush_db_trace()
+        run_report.stop()
+        if profile_dir is not None:
+            try:
+                summary_file = write_profile_summary(profile_dir)
+                if summary_file is not None:
+                    logger.info("Profile summary written to {}".format(summary_file))
+            except Exception:
+                logger.warning("Could not write the profile summary.")
+        write_run_reports(config, run_report)
+        stop_log_listener(log_listener)
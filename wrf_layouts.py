@@ -0,0 +1,53 @@
+import os
+
+# precipitation variables of the wrf outputs, their sum is pushed (see "rain_variables" in config.json)
+RAIN_VARIABLES = ['RAINC', 'RAINNC']
+
+
+def resolve_v4_paths(wrf_dir, version, gfs_data_hour, wrf_system, date, domain='d03'):
+    """
+    /wrf_nfs/wrf/4.0/18/A/2019-07-30/d03_RAINNC.nc
+    """
+    output_dir = os.path.join(wrf_dir, version, gfs_data_hour, wrf_system, date)
+    return {'RAINNC': os.path.join(output_dir, '{}_RAINNC.nc'.format(domain))}
+
+
+def resolve_v3_paths(wrf_dir, version, gfs_data_hour, wrf_system, date, domain='d03'):
+    """
+    /mnt/disks/wrf-mod/STATIONS_2019-03-23/RAINNC_2019-03-23_A.nc (and RAINC_2019-03-23_A.nc), d03 only
+    """
+    output_dir = os.path.join(wrf_dir, 'STATIONS_{}'.format(date))
+    return {variable: os.path.join(output_dir, '{}_{}_{}.nc'.format(variable, date, wrf_system))
+            for variable in RAIN_VARIABLES}
+
+
+def resolve_v3_d03_paths(wrf_dir, version, gfs_data_hour, wrf_system, date, domain='d03'):
+    """
+    /mnt/disks/wrf-mod/STATIONS_2019-03-23/d03_RAINNC_2019-03-23_A.nc
+    """
+    output_dir = os.path.join(wrf_dir, 'STATIONS_{}'.format(date))
+    return {'RAINNC': os.path.join(output_dir, '{}_RAINNC_{}_{}.nc'.format(domain, date, wrf_system))}
+
+
+# "path_layout" in config.json -> resolver returning {variable: netcdf file path}, the RAINNC file also holds
+# XLAT, XLONG and XTIME, and any variable without a file of its own
+PATH_LAYOUTS = {
+    'v4': resolve_v4_paths,
+    'v3': resolve_v3_paths,
+    'v3_d03': resolve_v3_d03_paths
+}
+
+
+def get_rain_files(path_layout, wrf_dir, version, gfs_data_hour, wrf_system, date, rain_variables=('RAINNC',),
+                   domain='d03'):
+    """
+    :param path_layout: key of PATH_LAYOUTS, e.g.: v4
+    :param rain_variables: variables summed into the precipitation, e.g.: ['RAINC', 'RAINNC']
+    :param domain: e.g.: d01, d02 or d03
+    :return: dict of variable -> netcdf file path, for the RAINNC variable and each of rain_variables
+    """
+    if path_layout not in PATH_LAYOUTS:
+        raise ValueError("Unknown path layout {}, expected one of {}".format(path_layout, sorted(PATH_LAYOUTS.keys())))
+
+    paths = PATH_LAYOUTS[path_layout](wrf_dir, version, gfs_data_hour, wrf_system, date, domain)
+    return {variable: paths.get(variable, paths['RAINNC']) for variable in set(['RAINNC'] + list(rain_variables))}
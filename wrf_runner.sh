@@ -40,8 +40,9 @@ then
 fi
 
 # Push WRFv4 data into the database
-echo "Running scripts to push wrf data. Logs Available in wrf_data_pusher.log file."
-python wrf_data_pusher.py >> wrf_data_pusher.log 2>&1
+# wrf_data_pusher.log is written and rotated by the script itself, stdout/stderr go to a file of their own
+echo "Running scripts to push wrf data. Logs Available in wrf_data_pusher.log file, stdout in wrf_data_pusher.out."
+python wrf_data_pusher.py >> wrf_data_pusher.out 2>&1
 
 # Deactivating virtual environment
 echo "Deactivating virtual environment"